@@ -1,58 +1,271 @@
+import os
+import time
+from dataclasses import asdict
+
 import streamlit as st
-import pypdfium2 as pdfium
-from io import BytesIO
-import base64
-from together import Together
-import json
 from PIL import Image
-import sqlite3
-import os
-import google.generativeai as genai
+from pipeline import RENDER_LOCK
+from rendering import MemoryBudget, iter_group_results, iter_page_results, limit_malloc_arenas, open_pdf
+from database import BillDatabase
+from dedup import DedupIndex, file_digest
+from extraction_cache import ExtractionCache
+from extractor import BillRecord, Extractor
+from jobs import ACTIVE_STATUSES, JobQueue, format_metrics
+from multibill import GROUP_SIZE, GroupExtractor, merge_records
+from providers import ProviderError, create_resilient_backend
+from preprocess import MIME_TYPES, PageArtifact, PreprocessConfig, format_bytes
+from telemetry import BUCKETS, Telemetry, bind, configure_json_logs, log_event, serve_metrics
+from textlayer import TextLayerParser
 
-def initialize_db():
-    conn = sqlite3.connect('bills.db')
-    cursor = conn.cursor() #gggjg
-    
+@st.cache_resource
+def get_db():
+    # One pooled connection for every session instead of connect/commit/close per insert
+    return BillDatabase()
+
+
+# Seconds between status checks of queued jobs
+JOB_POLL_SECONDS = 2
+
+# Sidebar label -> extractor backend
+AI_SERVICES = {
+    "Test ai model 1": "together",
+    "Test ai model 2": "gemini",
+}
+
+
+@st.cache_resource
+def get_dedup_index():
+    # Known files and pages live in bills.db; counters are per server process
+    return DedupIndex(get_db())
+
+
+@st.cache_resource
+def get_job_queue():
+    return JobQueue(get_db())
+
+
+@st.cache_resource
+def setup_telemetry():
+    # Once per server process: extraction results are logged to stdout as
+    # JSON lines, and with BILLS_METRICS_PORT set the process-wide stage
+    # timings and counters are served for Prometheus
+    configure_json_logs("-")
+    port = os.environ.get("BILLS_METRICS_PORT")
+    return serve_metrics(int(port)) if port else None
+
+
+@st.cache_resource
+def get_extraction_cache():
+    # One cache per server process so hit/miss counters survive reruns
+    return ExtractionCache()
+
+
+@st.cache_resource
+def get_backend(backend_name, api_key, fallback_api_key):
+    # Provider clients are built once per key and reused across pages and
+    # reruns. The other service, when it has a key, takes over pages the
+    # selected one keeps failing.
+    fallback_name = next(name for name in AI_SERVICES.values() if name != backend_name)
+    return create_resilient_backend({backend_name: api_key, fallback_name: fallback_api_key})
+
+
+def show_cache_stats(placeholder, cache):
+    stats = cache.stats()
+    placeholder.caption(
+        f"Extraction cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries"
+    )
+
+
+def show_provider_stats(placeholder, backend):
+    stats = backend.stats
+    latency = backend.latency_percentiles()
+    text = (
+        f"Provider calls: {stats['succeeded']} ok, {stats['failed']} failed, "
+        f"{stats['retries']} retries, {stats['throttled']} throttled, {stats['failovers']} failovers"
+    )
+    if latency[50] is not None:
+        text += f" · p50 {latency[50]:.2f}s, p99 {latency[99]:.2f}s"
+    if stats["tokens_in"] or stats["tokens_out"]:
+        text += f" · {stats['tokens_in']} tokens in, {stats['tokens_out']} out"
+    placeholder.caption(text)
 
-    # Create new table with bill_date instead of upload_date
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS bills (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            invoice_number TEXT NOT NULL,
-            company_name TEXT NOT NULL,
-            total_cost REAL NOT NULL,
-            bill_date DATE NOT NULL
+
+def show_stage_timings(placeholder, telemetry):
+    # Where this session's pages spent their time, with a latency histogram per stage
+    summary = telemetry.stage_summary()
+    with placeholder.container():
+        if not summary:
+            st.caption("Nothing processed in this session yet.")
+            return
+        st.dataframe(
+            [
+                {"stage": stage, "calls": calls, "total": seconds, "p50": 1000 * p50, "p95": 1000 * p95,
+                 "histogram": buckets}
+                for stage, calls, seconds, p50, p95, buckets in summary
+            ],
+            column_config={
+                "total": st.column_config.NumberColumn("Total", format="%.2f s"),
+                "p50": st.column_config.NumberColumn("p50", format="%.1f ms"),
+                "p95": st.column_config.NumberColumn("p95", format="%.1f ms"),
+                "histogram": st.column_config.BarChartColumn(
+                    "Latency histogram", y_min=0,
+                    help=f"Calls per latency bucket, from ≤{1000 * BUCKETS[0]:g} ms to over {BUCKETS[-2]:g} s"
+                ),
+            },
+            hide_index=True,
         )
-    """)
-    conn.commit()
-    conn.close()
-
-def add_bill_to_db(invoice_number, company_name, total_cost, bill_date):
-    conn = sqlite3.connect('bills.db')
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO bills (invoice_number, company_name, total_cost, bill_date)
-        VALUES (?, ?, ?, ?)
-    """, (invoice_number, company_name, total_cost, bill_date))
-    conn.commit()
-    conn.close()
-
-def remove_json_markers(text):
-    # Remove ```json from the beginning
-    if text.startswith("```json"):
-        text = text.replace("```json", "")
-    # Remove ``` from the end
-    
-        text = text.replace("\n```", "")
-        return text.strip()
+        counters = telemetry.snapshot()["counters"]
+        if "bytes_sent" in counters:
+            counters["bytes_sent"] = format_bytes(counters["bytes_sent"])
+        st.caption(", ".join(f"{name.replace('_', ' ')}: {value}" for name, value in sorted(counters.items())))
+
+
+def log_record(record, **fields):
+    # The model's answer as given, next to what was made of it
+    log_event(
+        "extracted", source=record.source, pages=record.pages, error=record.error,
+        invalid=record.invalid, raw_response=record.raw_response, **fields
+    )
+
+
+def extract_page(extractor, artifact):
+    # A provider that is still failing after retries and failover costs
+    # this page only; the rest of the PDF carries on
+    try:
+        return extractor.extract(artifact)
+    except ProviderError as e:
+        return BillRecord(error=f"Extraction failed: {e}")
+
+
+def extract_group(group_extractor, artifacts, first_page):
+    # Same as extract_page, for a group of pages sent in one request
+    try:
+        return group_extractor.extract_group(artifacts, first_page)
+    except ProviderError as e:
+        pages = list(range(first_page, first_page + len(artifacts)))
+        return [BillRecord(error=f"Extraction failed: {e}", pages=pages)]
+
+
+def add_bill(db, dedup, **bill):
+    if db.add_bill(**bill):
+        st.success("✅ Added to database!")
     else:
-        return text
-# Example usage
+        dedup.count("bills")
+        st.warning("This vendor's invoice number is already in the database, not added again.")
+
+
+def show_bill_form(db, dedup, record, form_key):
+    if record.error:
+        st.error(record.error)
+        return
+    if record.invalid:
+        # Values the model gave that couldn't be read, e.g. a total that isn't a number
+        st.warning("Check these fields, they couldn't be read: "
+                   + ", ".join(f"{key} = {value!r}" for key, value in record.invalid.items()))
+    with st.form(key=form_key):
+        st.markdown("### Edit Extracted Data")
+        company_name = st.text_input("Company Name", value=record.vendor_name or "")
+        bill_date = st.text_input("Bill Date", value=record.bill_date or "")
+        # The record's total is already a number, currency symbols and separators removed
+        total_cost = st.number_input("Total Cost", value=float(record.total_amount or 0.0), format="%.2f")
+        invoice_number = st.text_input("Invoice Number", value=record.invoice_number or "")
+        
+        submit_button = st.form_submit_button("Add to Database")
+        
+        if submit_button:
+            add_bill(
+                db, dedup,
+                invoice_number=invoice_number,
+                company_name=company_name,
+                total_cost=total_cost,
+                bill_date=bill_date
+            )
+
+
+def show_grouped_bill(db, dedup, record, pngs, index):
+    # One bill from grouped extraction, with the images of every page it is on
+    pages = record.pages or []
+    label = ", ".join(str(page + 1) for page in pages)
+    col1, col2 = st.columns(2)
+    with col1:
+        st.subheader(f"Page {label}" if len(pages) == 1 else f"Pages {label}")
+        for page in pages:
+            if page in pngs:
+                st.image(pngs[page], caption=f"Page {page + 1}", use_container_width=True)
+    with col2:
+        st.subheader(f"Analysis of Page {label}" if len(pages) == 1 else f"Analysis of Pages {label}")
+        log_record(record)
+        json_data = record.to_dict()
+        # Receipts on one page share its number, so forms are keyed by the bill's position
+        show_bill_form(db, dedup, record, f"form_bill_{index}")
+        st.json(json_data)
+    st.divider()
+
+
+def show_job(job):
+    label = f"Job {job['id']} · {job['file_name']}"
+    if job["status"] == "running":
+        pages = job["pages"] or 0
+        progress = job["pages_done"] / pages if pages else 0.0
+        st.progress(min(progress, 1.0), text=f"{label}: page {job['pages_done']} of {pages or '?'}")
+    elif job["status"] == "done":
+        result = job["result"] or {}
+        text = f"{label}: {job['bills_inserted']} bills added from {job['pages']} pages"
+        if result.get("duplicate_files"):
+            st.info(f"{label}: already processed before, nothing added")
+        elif result.get("errors"):
+            st.warning(f"{text}, {result['errors']} pages failed: " + "; ".join(result.get("error_messages", [])[:3]))
+        else:
+            st.success(text)
+    elif job["status"] == "failed":
+        st.error(f"{label}: failed: {job['error']}")
+    else:
+        st.info(f"{label}: {job['status']}")
+
+
+def submit_background_job(queue, options):
+    # Queues the upload for worker.py and follows this session's jobs; the
+    # Jobs page lists everyone's
+    uploaded_file = st.file_uploader(
+        "Choose a PDF or Image file",
+        type=["pdf", "png", "jpg", "jpeg"],
+        help="The file is queued and processed by the background worker"
+    )
+    if uploaded_file is not None:
+        digest = file_digest(uploaded_file)
+        # Reruns of this session (the polling below) don't queue it again
+        if st.session_state.get("queued_digest") != digest:
+            job_id = queue.submit(uploaded_file, uploaded_file.name, options)
+            st.session_state["queued_digest"] = digest
+            st.session_state.setdefault("job_ids", []).append(job_id)
+    
+    st.caption(f"Queue: {format_metrics(queue.metrics())}")
+    jobs = [queue.get(job_id) for job_id in reversed(st.session_state.get("job_ids", []))]
+    jobs = [job for job in jobs if job is not None]
+    for job in jobs:
+        show_job(job)
+    if any(job["status"] in ACTIVE_STATUSES for job in jobs):
+        time.sleep(JOB_POLL_SECONDS)
+        st.rerun()
+
+
+def show_payload_size(artifact):
+    prepared = artifact.prepared
+    st.caption(
+        f"Sent to model: {format_bytes(len(prepared.data))} {prepared.mime_type} "
+        f"({prepared.width}×{prepared.height}), rendered PNG was {format_bytes(len(artifact.png))}"
+    )
 
 
 def main():
     # Initialize the database
-    initialize_db()
+    db = get_db()
+    setup_telemetry()
+    # Stage timings of this session's pages, besides the process-wide ones
+    session_telemetry = st.session_state.setdefault("telemetry", Telemetry())
+    bind(session_telemetry)
+    # Keep resident memory near the page memory budget
+    limit_malloc_arenas()
     
     st.set_page_config(
         page_title="Bill Analyzer",
@@ -65,36 +278,99 @@ def main():
     # Add a sidebar with info and API key input
     with st.sidebar:
         st.info("This app converts PDF pages or images to JSON by analyzing them.")
-        ai_service = st.radio("Select AI Service:", ["Test ai model 1", "Test ai model 2"])
+        ai_service = st.radio("Select AI Service:", list(AI_SERVICES))
         
-        if ai_service == "Together AI":
+        if AI_SERVICES[ai_service] == "together":
             ey = st.text_input("Enter your Model 1 AI API key:", type="password")
         else:
             ey = st.text_input("Enter your Model 2 AI API key:", type="password")
-            if ey:
-                os.environ["GEMINI_API_KEY"] = ey
-                genai.configure(api_key=ey)
+        fallback_ey = st.text_input(
+            "Fallback API key for the other model (optional):", type="password",
+            help="Pages go to the other model when the selected one keeps failing"
+        )
+        
+        # PDF pages are sent to the model in parallel, within the provider's rate limit
+        concurrency = st.slider("Pages processed in parallel", min_value=1, max_value=16, value=4)
+        # Consecutive pages sent to the model in one request; the model says which
+        # pages each bill is on, so multi-page invoices and receipt sheets come
+        # back as the right number of bills
+        pages_per_request = st.slider(
+            "Pages per model request", min_value=1, max_value=8, value=1,
+            help=f"1 sends every page on its own; {GROUP_SIZE} usually cuts the calls per document by "
+                 "that much. Grouped pages skip the text layer and duplicate-page checks."
+        )
+        requests_per_second = st.number_input(
+            "Max requests per second (0 = unlimited)", min_value=0.0, value=2.0, step=0.5
+        )
+        # Rendering waits once this much page bitmap memory is in flight
+        max_page_memory_mb = st.number_input(
+            "Max memory for rendered pages (MB)", min_value=16, value=256, step=16
+        )
+        
+        # Responses are cached per page image, prompt and model
+        cache = get_extraction_cache()
+        if st.button("Clear extraction cache"):
+            cache.clear()
+        cache_stats = st.empty()
+        show_cache_stats(cache_stats, cache)
+        provider_stats = st.empty()
+        dedup = get_dedup_index()
+        dedup_stats = st.empty()
+        dedup_stats.caption(f"Duplicates: {dedup.summary()}")
+        
+        # Digital PDFs are read from their text layer when the fields can be
+        # found there with confidence; only the rest go to the model
+        use_text_layer = st.checkbox("Read PDF text layer first", value=True)
+        tier_stats = st.empty()
+        
+        # Shrink page images before they are uploaded to the model
+        with st.expander("Image preprocessing"):
+            preprocess_config = PreprocessConfig(
+                grayscale=st.checkbox("Convert to grayscale"),
+                max_dimension=st.number_input("Max dimension in pixels (0 = keep)", min_value=0, value=0, step=100),
+                format=st.selectbox("Upload format", list(MIME_TYPES)),
+                quality=st.slider("JPEG/WEBP quality", min_value=10, max_value=100, value=85),
+                crop_borders=st.checkbox("Crop whitespace borders"),
+            )
+        
+        with st.expander("Pipeline timings (this session)"):
+            stage_timings = st.empty()
+            show_stage_timings(stage_timings, session_telemetry)
+        
+        # Uploads can go to the job queue instead, processed by worker.py
+        # outside this session
+        run_in_background = st.checkbox(
+            "Process in the background",
+            help="Queue the file for the background worker (python worker.py), which uses the server's "
+                 "API keys. The page can be closed; the Jobs page shows progress."
+        )
                 
    
     
+    if run_in_background:
+        submit_background_job(get_job_queue(), {
+            "backend": AI_SERVICES[ai_service],
+            "preprocess": asdict(preprocess_config),
+            "text_layer": use_text_layer,
+        })
+        return
+    
     if not ey:
         st.warning("Please enter your Model AI API key to proceed.")
         return
     
-    # Initialize Together AI client
-    together = Together(api_key=ey)
-    
-    # Define the prompt for JSON conversion
-    getDescriptionPrompt = """
-        You are an AI model working for Global Autotech Limited that extracts billing information from images.
-        Analyze the attached bill/invoice image and provide ONLY a JSON response with the following case-sensitive fields:
-        - vendor_name: Name of the company/vendor
-        - bill_date: Date of the bill
-        - total_amount: Total amount of the bill
-        - invoice_number: Invoice number of the bill
-        Ensure the JSON is well-structured, includes only these fields, and contains no additional information.
-        Do not include any text, explanations, or code blocks. Respond with pure "JSON" only.
-    """
+    # Build the extractor for the selected service. The backend's own token
+    # bucket keeps it under the requests/second limit and backs off on 429s.
+    backend = get_backend(AI_SERVICES[ai_service], ey, fallback_ey)
+    backend.set_rate(requests_per_second)
+    show_provider_stats(provider_stats, backend)
+    extractor = Extractor(
+        backend,
+        cache=cache,
+        preprocess=preprocess_config,
+        dedup=dedup,
+        text_parser=TextLayerParser() if use_text_layer else None,
+    )
     
     # File uploader accepts PDF and image files
     uploaded_file = st.file_uploader(
@@ -105,143 +381,150 @@ def main():
     
     if uploaded_file is not None and ey:
         try:
+            # Pages of a file seen before are answered from the dedup index
+            digest = file_digest(uploaded_file)
+            known_file = dedup.find_file(digest)
+            # Reruns of this session (e.g. a form submit) aren't a new duplicate
+            if known_file is not None and st.session_state.get("upload_digest") != digest:
+                dedup.count("files")
+                st.info(
+                    f"This file was already processed on {known_file[2]} (as {known_file[0]}); "
+                    "its pages are reused instead of being sent to the model again."
+                )
+            st.session_state["upload_digest"] = digest
+            
             # Show progress bar
             with st.spinner('Processing and analyzing...'):
                 file_type = uploaded_file.type
-                if file_type == "application/pdf":
-                    # Process PDF file
-                    pdf = pdfium.PdfDocument(uploaded_file.read())
+                if file_type == "application/pdf" and pages_per_request > 1:
+                    pdf = open_pdf(uploaded_file)
+                    group_results = None
+                    try:
+                        total_pages = len(pdf)
+                        st.info(f"Total pages: {total_pages}")
                     
-                    # Show total pages
-                    total_pages = len(pdf)
-                    st.info(f"Total pages: {total_pages}")
-                    
-                    # Convert each page
-                    for page_number in range(total_pages):
-                        # Create two columns for image and analysis
-                        col1, col2 = st.columns(2)
-                        
-                        # Load and process the page
-                        page = pdf[page_number]
-                        bitmap = page.render(scale=1.0, rotation=0)
-                        pil_image = bitmap.to_pil()
+                        # Groups of pages go to the model in one request each, in
+                        # parallel, and come back in order
+                        group_extractor = GroupExtractor(extractor, pages_per_request)
+                        group_results = iter_group_results(
+                            pdf,
+                            lambda artifacts, first_page: extract_group(group_extractor, artifacts, first_page),
+                            group_size=pages_per_request,
+                            max_workers=concurrency,
+                            config=preprocess_config,
+                            budget=MemoryBudget(max_page_memory_mb * 1024 * 1024),
+                        )
+                        # The last bill of a group is held back until the next group
+                        # is in, since the invoice may carry on over its pages
+                        pending = []
+                        pngs = {}
+                        shown = 0
+                        # A file with a failed page isn't recorded as seen, so
+                        # uploading it again retries instead of being skipped
+                        all_pages_ok = True
+                        for page_numbers, artifacts, records in group_results:
+                            all_pages_ok = all_pages_ok and not any(record.error for record in records)
+                            for page_number, artifact in zip(page_numbers, artifacts):
+                                pngs[page_number] = artifact.png
+                            with RENDER_LOCK:
+                                for artifact in artifacts:
+                                    artifact.release()
                         
-                        # Left column: Display image and download button
-                        with col1:
-                            st.subheader(f"Page {page_number + 1}")
-                            st.image(pil_image, caption=f"Page {page_number + 1}", use_container_width=True)
-                            
-                            # Create download button
-                            buf = BytesIO()
-                            pil_image.save(buf, format="PNG")
-                            
-                            st.download_button(
-                                label=f"⬇️ Download Page {page_number + 1}",
-                                data=buf.getvalue(),
-                                file_name=f"page_{page_number + 1}.png",
-                                mime="image/png",
-                                key=f"download_{page_number}"
-                            )
+                            records = merge_records(pending + records)
+                            pending = records[-1:]
+                            for record in records[:-1]:
+                                show_grouped_bill(db, dedup, record, pngs, shown)
+                                shown += 1
+                            # Keep only the page images the held-back bill still needs
+                            keep = set(pending[0].pages or []) if pending else set()
+                            pngs = {page: png for page, png in pngs.items() if page in keep}
+                        for record in pending:
+                            show_grouped_bill(db, dedup, record, pngs, shown)
+                    
+                        if all_pages_ok:
+                            dedup.add_file(digest, uploaded_file.name, total_pages)
+                    finally:
+                        # Stop the workers before the document they render from is closed
+                        if group_results is not None:
+                            group_results.close()
+                        with RENDER_LOCK:
+                            pdf.close()
+                
+                elif file_type == "application/pdf":
+                    # Process PDF file
+                    pdf = open_pdf(uploaded_file)
+                    page_results = None
+                    try:
+                        # Show total pages
+                        total_pages = len(pdf)
+                        st.info(f"Total pages: {total_pages}")
+                    
+                        # Pages are rendered one at a time on demand and analyzed on a
+                        # bounded worker pool; results come back in page order, so the
+                        # layout matches the PDF
+                        page_results = iter_page_results(
+                            pdf,
+                            lambda artifact: extract_page(extractor, artifact),
+                            max_workers=concurrency,
+                            config=preprocess_config,
+                            budget=MemoryBudget(max_page_memory_mb * 1024 * 1024),
+                            text_layer=use_text_layer,
+                        )
+                        # Only recorded as seen if every page was extracted, as above
+                        all_pages_ok = True
+                        for page_number, artifact, record in page_results:
+                            all_pages_ok = all_pages_ok and not record.error
+                            # Create two columns for image and analysis
+                            col1, col2 = st.columns(2)
                         
-                        # Right column: Together AI analysis
-                        with col2:
-                            st.subheader(f"Analysis of Page {page_number + 1}")
-                            
-                            # Convert image to base64
-                            buffered = BytesIO()
-                            pil_image.save(buffered, format="PNG", encoding='utf-8')
-                            base64_image = base64.b64encode(buffered.getvalue()).decode('utf-8')
+                            # Left column: Display image and download button
+                            with col1:
+                                st.subheader(f"Page {page_number + 1}")
+                                # Display and download share the same PNG bytes
+                                st.image(artifact.png, caption=f"Page {page_number + 1}", use_container_width=True)
                             
-                            # Get analysis based on selected AI service
-                            if ai_service == "Together AI":
-                                response = together.chat.completions.create(
-                                    model="meta-llama/Llama-3.2-11B-Vision-Instruct-Turbo",
-                                    messages=[
-                                        {
-                                            "role": "user",
-                                            "content": [
-                                                {"type": "text", "text": getDescriptionPrompt},
-                                                {
-                                                    "type": "image_url",
-                                                    "image_url": {
-                                                        "url": f"data:image/png;base64,{base64_image}",
-                                                    },
-                                                },
-                                            ],
-                                        }
-                                    ]
+                                # Create download button
+                                st.download_button(
+                                    label=f"⬇️ Download Page {page_number + 1}",
+                                    data=artifact.png,
+                                    file_name=f"page_{page_number + 1}.png",
+                                    mime="image/png",
+                                    key=f"download_{page_number}"
                                 )
-                                json_description = response.choices[0].message.content.strip()
-                            else:
-                                # Configure Gemini
-                                generation_config = {
-                                    "temperature": 1,
-                                    "top_p": 0.95,
-                                    "top_k": 40,
-                                    "max_output_tokens": 8192,
-                                }
-                                model = genai.GenerativeModel("gemini-1.5-pro", generation_config=generation_config)
-                                
-                                # Convert PIL Image to bytes
-                                buffered = BytesIO()
-                                pil_image.save(buffered, format="PNG")
-                                image_bytes = buffered.getvalue()
-                                
-                                # Create content parts with image bytes
-                                content_parts = [
-                                    {
-                                        "mime_type": "image/png",
-                                        "data": image_bytes
-                                    },
-                                    getDescriptionPrompt
-                                ]
-                                
-                                # Generate response
-                                response = model.generate_content(content_parts)
-                                json_description = response.text.strip()
+                        
+                            # Right column: Together AI analysis
+                            with col2:
+                                st.subheader(f"Analysis of Page {page_number + 1}")
+                                if record.source == "text_layer":
+                                    st.caption("Read from the PDF text layer, no model call")
+                                else:
+                                    show_payload_size(artifact)
                             
-                            print("============")
-                            print(json_description)
-                            print("============")
-                            try:
-                                json_data = json.loads(remove_json_markers(json_description))
-                                # Validate that only required fields are present
-                                valid_keys = {"vendor_name", "bill_date", "total_amount", "invoice_number"}
-                                json_data = {k: v for k, v in json_data.items() if k in valid_keys}
-                            except json.JSONDecodeError:
-                                json_data = {"error": "Invalid JSON response from AI model."}
+                                log_record(record, page=page_number + 1)
+                                json_data = record.to_dict()
                             
-                            if "error" not in json_data:
-                                form_key = f"form_page_{page_number}"
-                                with st.form(key=form_key):
-                                    st.markdown("### Edit Extracted Data")
-                                    company_name = st.text_input("Company Name", value=json_data.get("vendor_name", ""))
-                                    bill_date = st.text_input("Bill Date", value=json_data.get("bill_date", ""))
-                                    # Clean the total_amount string by removing commas before converting to float
-                                    total_amount_str = str(json_data.get("total_amount", "0.0")).replace(",", "")
-                                    total_cost = st.number_input("Total Cost", value=float(total_amount_str), format="%.2f")
-                                    invoice_number = st.text_input("Invoice Number", value=json_data.get("invoice_number", ""))
-                                    
-                                    submit_button = st.form_submit_button("Add to Database")
-                                    
-                                    if submit_button:
-                                        add_bill_to_db(
-                                            invoice_number=invoice_number,
-                                            company_name=company_name,
-                                            total_cost=total_cost,
-                                            bill_date=bill_date
-                                        )
-                                        st.success("✅ Added to database!")
-                            else:
-                                st.error(json_data["error"])
+                                show_bill_form(db, dedup, record, f"form_page_{page_number}")
                             
-                            st.json(json_data)
+                                st.json(json_data)
                         
-                        st.divider()
+                            st.divider()
+                        
+                            # Streamlit has its own copy now, drop the page bitmap and buffers
+                            with RENDER_LOCK:
+                                artifact.release()
+                    
+                        if all_pages_ok:
+                            dedup.add_file(digest, uploaded_file.name, total_pages)
+                    finally:
+                        # As above, the workers stop before the document is closed
+                        if page_results is not None:
+                            page_results.close()
+                        with RENDER_LOCK:
+                            pdf.close()
                 
                 elif file_type in ["image/png", "image/jpg", "image/jpeg"]:
                     # Process Image file
-                    pil_image = Image.open(uploaded_file)
+                    artifact = PageArtifact(Image.open(uploaded_file), preprocess_config)
                     
                     # Create two columns for image and analysis
                     col1, col2 = st.columns(2)
@@ -249,15 +532,12 @@ def main():
                     # Left column: Display image
                     with col1:
                         st.subheader("Uploaded Image")
-                        st.image(pil_image, caption="Uploaded Image", use_container_width=True)
+                        st.image(artifact.png, caption="Uploaded Image", use_container_width=True)
                         
                         # Create download button
-                        buf = BytesIO()
-                        pil_image.save(buf, format="PNG")
-                        
                         st.download_button(
                             label="⬇️ Download Image",
-                            data=buf.getvalue(),
+                            data=artifact.png,
                             file_name="uploaded_image.png",
                             mime="image/png",
                             key="download_image"
@@ -267,96 +547,20 @@ def main():
                     with col2:
                         st.subheader("Analysis of Uploaded Image")
                         
-                        # Convert image to base64
-                        buffered = BytesIO()
-                        pil_image.save(buffered, format="PNG", encoding='utf-8')
-                        base64_image = base64.b64encode(buffered.getvalue()).decode('utf-8')
+                        show_payload_size(artifact)
+                        record = extract_page(extractor, artifact)
                         
-                        # Get analysis based on selected AI service
-                        if ai_service == "Together AI":
-                            response = together.chat.completions.create(
-                                model="meta-llama/Llama-3.2-11B-Vision-Instruct-Turbo",
-                                messages=[
-                                    {
-                                        "role": "user",
-                                        "content": [
-                                            {"type": "text", "text": getDescriptionPrompt},
-                                            {
-                                                "type": "image_url",
-                                                "image_url": {
-                                                    "url": f"data:image/png;base64,{base64_image}",
-                                                },
-                                            },
-                                        ],
-                                    }
-                                ]
-                            )
-                            json_description = response.choices[0].message.content.strip()
-                        else:
-                            # Configure Gemini
-                            generation_config = {
-                                "temperature": 1,
-                                "top_p": 0.95,
-                                "top_k": 40,
-                                "max_output_tokens": 8192,
-                            }
-                            model = genai.GenerativeModel("gemini-1.5-pro", generation_config=generation_config)
-                            
-                            # Convert PIL Image to bytes
-                            buffered = BytesIO()
-                            pil_image.save(buffered, format="PNG")
-                            image_bytes = buffered.getvalue()
-                            
-                            # Create content parts with image bytes
-                            content_parts = [
-                                {
-                                    "mime_type": "image/png",
-                                    "data": image_bytes
-                                },
-                                getDescriptionPrompt
-                            ]
-                            
-                            # Generate response
-                            response = model.generate_content(content_parts)
-                            json_description = response.text.strip()
+                        log_record(record, file=uploaded_file.name)
+                        json_data = record.to_dict()
                         
-                        print("============")
-                        print(json_description)
-                        print("============")
-                        try:
-                            json_data = json.loads(remove_json_markers(json_description))
-                            # Validate that only required fields are present
-                            valid_keys = {"vendor_name", "bill_date", "total_amount", "invoice_number"}
-                            json_data = {k: v for k, v in json_data.items() if k in valid_keys}
-                        except json.JSONDecodeError:
-                            json_data = {"error": "Invalid JSON response from AI model."}
-                        
-                        if "error" not in json_data:
-                            with st.form(key="form_image"):
-                                st.markdown("### Edit Extracted Data")
-                                company_name = st.text_input("Company Name", value=json_data.get("vendor_name", ""))
-                                bill_date = st.text_input("Bill Date", value=json_data.get("bill_date", ""))
-                                # Clean the total_amount string by removing commas before converting to float
-                                total_amount_str = str(json_data.get("total_amount", "0.0")).replace(",", "")
-                                total_cost = st.number_input("Total Cost", value=float(total_amount_str), format="%.2f")
-                                invoice_number = st.text_input("Invoice Number", value=json_data.get("invoice_number", ""))
-                                
-                                submit_button = st.form_submit_button("Add to Database")
-                                
-                                if submit_button:
-                                    add_bill_to_db(
-                                        invoice_number=invoice_number,
-                                        company_name=company_name,
-                                        total_cost=total_cost,
-                                        bill_date=bill_date
-                                    )
-                                    st.success("✅ Added to database!")
-                        else:
-                                st.error(json_data["error"])
+                        show_bill_form(db, dedup, record, "form_image")
                         
                         st.json(json_data)
                     
                     st.divider()
+                    artifact.release()
+                    if not record.error:
+                        dedup.add_file(digest, uploaded_file.name, 1)
                 
                 else:
                     st.error("Unsupported file type.")
@@ -366,6 +570,14 @@ def main():
         except Exception as e:
             st.error(f"❌ An error occurred: {str(e)}")
             st.warning("Please try again with a different file.")
+        
+        # Refresh the sidebar counters now that this run's pages are done
+        show_cache_stats(cache_stats, cache)
+        show_provider_stats(provider_stats, backend)
+        if extractor.tiers.counts:
+            tier_stats.caption(f"This file: {extractor.tiers.format()}")
+        dedup_stats.caption(f"Duplicates: {dedup.summary()}")
+        show_stage_timings(stage_timings, session_telemetry)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,389 @@
+# Headless bulk ingestion: walks a folder (or reads a manifest of paths),
+# extracts every page of every PDF/image and bulk-inserts into bills.db.
+#
+#   python batch.py invoices/ --backend together --workers 8
+#   python batch.py --manifest month_end.txt --backend gemini
+#   python batch.py invoices/ --metrics-file batch.prom --profile batch.prof
+#
+# Finished files are appended to a checkpoint file, so an interrupted run
+# picks up where it stopped when started again with the same checkpoint.
+import argparse
+import contextvars
+import json
+import os
+import sys
+import time
+from contextlib import nullcontext
+from pathlib import Path
+
+import pypdfium2 as pdfium
+from PIL import Image
+
+from database import BillDatabase
+from dedup import DedupIndex, file_digest
+from extraction_cache import ExtractionCache
+from extractor import Extractor, FakeBackend
+from pipeline import RENDER_LOCK, RateLimiter, process_in_order
+from providers import create_resilient_backend
+from rendering import BYTES_PER_PIXEL, MemoryBudget, limit_malloc_arenas, render_page
+from preprocess import MIME_TYPES, PageArtifact, PreprocessConfig, format_bytes
+from telemetry import Telemetry, bind, configure_json_logs, log_event, profiled, write_metrics_file
+from textlayer import TextLayerParser, read_text_layer
+
+PDF_EXTENSIONS = {".pdf"}
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg"}
+# Pages in flight per worker
+LOOKAHEAD = 4
+API_KEY_ENV = {
+    "together": "TOGETHER_API_KEY",
+    "gemini": "GEMINI_API_KEY",
+}
+# Point a provider somewhere else, e.g. the benchmarks' fake server
+BASE_URL_ENV = {
+    "together": "TOGETHER_BASE_URL",
+    "gemini": "GEMINI_BASE_URL",
+}
+
+
+def find_files(input_dir=None, manifest=None):
+    if manifest:
+        with open(manifest, encoding="utf-8") as f:
+            paths = [Path(line.strip()) for line in f if line.strip() and not line.startswith("#")]
+    else:
+        paths = sorted(p for p in Path(input_dir).rglob("*") if p.is_file())
+    return [p for p in paths if p.suffix.lower() in PDF_EXTENSIONS | IMAGE_EXTENSIONS]
+
+
+def checkpoint_id(path):
+    # A file counts as done only if it hasn't changed since it was ingested
+    stat = path.stat()
+    return f"{path.resolve()}:{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def load_checkpoint(checkpoint_path):
+    if not checkpoint_path or not os.path.exists(checkpoint_path):
+        return set()
+    with open(checkpoint_path, encoding="utf-8") as f:
+        return {json.loads(line)["id"] for line in f if line.strip()}
+
+
+def validate(record):
+    # Returns (row, error) for a bills table insert
+    if record.error:
+        return None, record.error
+    if not record.invoice_number or not record.vendor_name:
+        return None, "missing vendor_name or invoice_number"
+    if record.invalid and "total_amount" in record.invalid:
+        return None, f"invalid total_amount {record.invalid['total_amount']!r}"
+    return (record.invoice_number, record.vendor_name, record.total_amount or 0.0, record.bill_date or ""), None
+
+
+def make_backend(name, api_key=None, fallback_api_key=None, rate=2.0, timeout=60.0, **fake_options):
+    # (backend, rate_limiter). Keys default to the environment; the other
+    # provider takes over when its key is there too.
+    if name == "fake":
+        return FakeBackend(**fake_options), RateLimiter(rate)
+    api_key = api_key or os.environ.get(API_KEY_ENV[name])
+    if not api_key:
+        raise ValueError(f"no API key for {name}: pass --api-key or set {API_KEY_ENV[name]}")
+    fallback = next(other for other in API_KEY_ENV if other != name)
+    fallback_api_key = fallback_api_key or os.environ.get(API_KEY_ENV[fallback])
+    # Retries, timeouts, 429 backoff and failover; rate limited per provider
+    base_urls = {provider: os.environ[env] for provider, env in BASE_URL_ENV.items() if os.environ.get(env)}
+    backend = create_resilient_backend(
+        {name: api_key, fallback: fallback_api_key}, rate=rate, timeout=timeout, base_urls=base_urls
+    )
+    return backend, None
+
+
+class BatchRunner:
+    def __init__(self, extractor, db_path="bills.db", workers=4, scale=1.0, checkpoint_path=None,
+                 max_resident_bytes=None, dedup=None, progress=None):
+        self.extractor = extractor
+        self.dedup = dedup
+        # Called as progress(stats, total_pages) after every page
+        self.progress = progress
+        self.max_resident_bytes = max_resident_bytes
+        self.budget = None
+        self.db_path = db_path
+        self.workers = workers
+        self.scale = scale
+        self.checkpoint_path = checkpoint_path
+        self.stats = {
+            "files": 0, "skipped_files": 0, "pages": 0, "inserted": 0, "errors": 0, "bytes_sent": 0,
+            "duplicate_files": 0, "duplicate_bills": 0,
+        }
+        self.errors = []
+        # Paths with a page that failed (or that couldn't be opened). Kept per
+        # file because opening a PDF ahead can fail before the previous
+        # file's last page is in.
+        self.failed_files = set()
+        # Stage timings and counters of this run (also in the process-wide registry)
+        self.telemetry = Telemetry()
+
+    def iter_pages(self, files, documents):
+        # Yields one unit of work per page. PDFs are opened from disk (pdfium
+        # reads them lazily) and stay open only while their pages are in flight.
+        for path in files:
+            if path.suffix.lower() in PDF_EXTENSIONS:
+                try:
+                    with RENDER_LOCK:
+                        pdf = pdfium.PdfDocument(str(path))
+                        total_pages = len(pdf)
+                except Exception as e:
+                    self.fail(path, None, f"could not open PDF: {e}")
+                    yield path, None, 0
+                    continue
+                if not total_pages:
+                    yield path, None, 0
+                    continue
+                documents[path] = pdf
+                for page_number in range(total_pages):
+                    yield path, page_number, total_pages
+            else:
+                yield path, 0, 1
+
+    def process_page(self, ticket, unit, documents):
+        path, page_number, total_pages = unit
+        if page_number is None:
+            self.budget.skip(ticket)
+            return None, 0
+        if path.suffix.lower() in PDF_EXTENSIONS:
+            # Born-digital pages are read from their text layer without
+            # rendering anything; the rest are rendered for the model
+            if self.extractor.text_parser is not None:
+                try:
+                    text = read_text_layer(documents[path], page_number)
+                except Exception:
+                    text = None
+                record = self.extractor.extract_from_text(text)
+                if record is not None:
+                    self.budget.skip(ticket)
+                    return record, 0
+            artifact = render_page(
+                documents[path], page_number, self.scale, self.extractor.preprocess, self.budget, ticket
+            )
+        else:
+            try:
+                image = Image.open(path)
+            except Exception:
+                self.budget.skip(ticket)
+                raise
+            reservation = self.budget.reserve(ticket, image.width * image.height * BYTES_PER_PIXEL)
+            artifact = PageArtifact(image, self.extractor.preprocess, resources=(reservation,))
+        try:
+            return self.extractor.extract(artifact), len(artifact.prepared.data)
+        finally:
+            with RENDER_LOCK:
+                artifact.release()
+
+    def fail(self, path, page_number, message):
+        self.stats["errors"] += 1
+        self.failed_files.add(path)
+        where = str(path) if page_number is None else f"{path} page {page_number + 1}"
+        self.errors.append(f"{where}: {message}")
+
+    def run(self, files):
+        # In a context of its own, so binding this run's telemetry doesn't outlive it
+        return contextvars.copy_context().run(self._run, files)
+
+    def _run(self, files):
+        bind(self.telemetry)
+        done = load_checkpoint(self.checkpoint_path)
+        todo = []
+        # Same content under another name, or already ingested by an earlier
+        # run or the app: skipped before anything is opened or rendered
+        digests = {}
+        seen = set()
+        for path in files:
+            if checkpoint_id(path) in done:
+                self.stats["skipped_files"] += 1
+                continue
+            if self.dedup is not None:
+                digest = file_digest(path)
+                if digest in seen or self.dedup.find_file(digest):
+                    self.stats["duplicate_files"] += 1
+                    self.dedup.count("files")
+                    continue
+                seen.add(digest)
+                digests[path] = digest
+            todo.append(path)
+
+        db = BillDatabase(self.db_path)
+        checkpoint = open(self.checkpoint_path, "a", encoding="utf-8") if self.checkpoint_path else None
+        documents = {}
+        rows = []
+        # Rendering waits (in input order) while too much page memory is in flight
+        self.budget = MemoryBudget(self.max_resident_bytes)
+        start = time.perf_counter()
+
+        def process(item):
+            ticket, unit = item
+            try:
+                record, payload_bytes = self.process_page(ticket, unit, documents)
+                return record, payload_bytes, None
+            except Exception as e:
+                return None, 0, str(e)
+
+        try:
+            units = enumerate(self.iter_pages(todo, documents))
+            # Look ahead past a page waiting on the model so text-layer and
+            # dedup pages behind it keep the workers busy; rendered memory
+            # stays capped by the budget
+            results = process_in_order(units, process, self.workers, self.workers * LOOKAHEAD)
+            for (_, (path, page_number, total_pages)), (record, payload_bytes, error) in results:
+                if page_number is not None:
+                    self.stats["pages"] += 1
+                    self.stats["bytes_sent"] += payload_bytes
+                    row, error = (None, error) if error else validate(record)
+                    if error:
+                        self.fail(path, page_number, error)
+                    else:
+                        rows.append(row)
+
+                # Last page of a file: commit its rows, then checkpoint it
+                if page_number is None or page_number == total_pages - 1:
+                    if rows:
+                        inserted = db.add_bills(rows)
+                        self.stats["inserted"] += inserted
+                        self.stats["duplicate_bills"] += len(rows) - inserted
+                        if self.dedup is not None:
+                            self.dedup.count("bills", len(rows) - inserted)
+                        rows = []
+                    # Files with failed pages (or that couldn't be opened) stay
+                    # eligible for another try: not recorded as known or done
+                    complete = path not in self.failed_files
+                    if path in digests and complete:
+                        self.dedup.add_file(digests[path], str(path), total_pages)
+                    pdf = documents.pop(path, None)
+                    if pdf is not None:
+                        with RENDER_LOCK:
+                            pdf.close()
+                    self.stats["files"] += 1
+                    if checkpoint is not None and complete:
+                        checkpoint.write(json.dumps({"id": checkpoint_id(path)}) + "\n")
+                        checkpoint.flush()
+                if self.progress is not None:
+                    self.progress(self.stats, total_pages)
+        finally:
+            self.budget.abort()
+            db.close()
+            if checkpoint is not None:
+                checkpoint.close()
+
+        self.stats["seconds"] = round(time.perf_counter() - start, 3)
+        self.stats["tiers"] = self.extractor.tiers.summary()
+        self.stats["stages"] = [
+            (stage, calls, round(seconds, 3), p50, p95)
+            for stage, calls, seconds, p50, p95, _ in self.telemetry.stage_summary()
+        ]
+        return self.stats
+
+
+def print_summary(stats, errors, dedup=None):
+    seconds = stats["seconds"] or 1e-9
+    print(f"Files processed:  {stats['files']} ({stats['skipped_files']} skipped from checkpoint)")
+    print(f"Pages processed:  {stats['pages']}")
+    print(f"Bills inserted:   {stats['inserted']}")
+    calls_avoided = dedup.stats["pages"] if dedup is not None else 0
+    print(f"Duplicates:       {stats['duplicate_files']} files, {calls_avoided} pages "
+          f"(model calls avoided), {stats['duplicate_bills']} bills (rows not inserted)")
+    print(f"Bytes sent:       {format_bytes(stats['bytes_sent'])}")
+    print(f"Errors:           {stats['errors']}")
+    print(f"Elapsed:          {stats['seconds']:.2f}s")
+    print(f"Throughput:       {stats['pages'] / seconds:.2f} pages/s")
+    for tier, count, share, avg_ms in stats.get("tiers", []):
+        print(f"  {tier:<15} {count:>6} pages  {share:>6.1%}  {avg_ms:>9.1f} ms/page")
+    if stats.get("stages"):
+        # Summed over the worker threads, so stages can add up to more than the elapsed time
+        print(f"Stages:           {'calls':>6} {'total s':>9} {'p50 ms':>9} {'p95 ms':>9}")
+        for stage, calls, seconds, p50, p95 in stats["stages"]:
+            print(f"  {stage:<15} {calls:>6} {seconds:>9.2f} {1000 * p50:>9.1f} {1000 * p95:>9.1f}")
+    for error in errors:
+        print(f"  {error}", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-ingest a folder of invoices into bills.db")
+    parser.add_argument("input_dir", nargs="?", help="folder to scan for PDFs and images")
+    parser.add_argument("--manifest", help="text file with one file path per line")
+    parser.add_argument("--backend", choices=["together", "gemini", "fake"], default="together")
+    parser.add_argument("--api-key", help="defaults to TOGETHER_API_KEY / GEMINI_API_KEY")
+    parser.add_argument("--fallback-api-key",
+                        help="key for the other provider, used when --backend keeps failing "
+                             "(defaults to its environment variable)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds per provider request")
+    parser.add_argument("--workers", type=int, default=4, help="pages processed in parallel")
+    parser.add_argument("--rate", type=float, default=2.0, help="max requests per second (0 = unlimited)")
+    parser.add_argument("--scale", type=float, default=1.0, help="PDF render scale")
+    parser.add_argument("--max-page-memory", type=int, default=512,
+                        help="MB of rendered pages allowed in flight (0 = unlimited)")
+    parser.add_argument("--db", default="bills.db")
+    parser.add_argument("--checkpoint", default="batch_checkpoint.jsonl",
+                        help="file recording finished inputs ('' to disable)")
+    parser.add_argument("--no-cache", action="store_true", help="skip the extraction cache")
+    parser.add_argument("--no-text-layer", action="store_true",
+                        help="send every PDF page to the model, even if its text layer is readable")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="process files and pages even if they were seen before")
+    parser.add_argument("--grayscale", action="store_true", help="send grayscale images")
+    parser.add_argument("--max-dimension", type=int, help="downscale so the longest side fits")
+    parser.add_argument("--format", choices=list(MIME_TYPES), default="PNG", help="upload encoding")
+    parser.add_argument("--quality", type=int, default=85, help="JPEG/WEBP quality")
+    parser.add_argument("--crop-borders", action="store_true", help="trim whitespace borders")
+    parser.add_argument("--json-logs", metavar="PATH", help="write structured JSON log lines here ('-' for stdout)")
+    parser.add_argument("--log-spans", action="store_true", help="with --json-logs, log every timed stage too")
+    parser.add_argument("--metrics-file", help="write Prometheus text-format metrics here when done")
+    parser.add_argument("--profile", metavar="PATH", help="write cProfile stats of the run here")
+    args = parser.parse_args(argv)
+
+    if not args.input_dir and not args.manifest:
+        parser.error("give an input folder or --manifest")
+
+    limit_malloc_arenas()
+    if args.json_logs:
+        configure_json_logs(args.json_logs, spans=args.log_spans)
+    try:
+        backend, rate_limiter = make_backend(
+            args.backend, args.api_key, args.fallback_api_key, rate=args.rate, timeout=args.timeout
+        )
+    except ValueError as e:
+        parser.error(str(e))
+
+    dedup = None if args.no_dedup else DedupIndex(BillDatabase(args.db))
+    extractor = Extractor(
+        backend,
+        cache=None if args.no_cache else ExtractionCache(),
+        rate_limiter=rate_limiter,
+        preprocess=PreprocessConfig(
+            grayscale=args.grayscale,
+            max_dimension=args.max_dimension,
+            format=args.format,
+            quality=args.quality,
+            crop_borders=args.crop_borders,
+        ),
+        dedup=dedup,
+        text_parser=None if args.no_text_layer else TextLayerParser(),
+    )
+    runner = BatchRunner(
+        extractor, db_path=args.db, workers=args.workers, scale=args.scale,
+        checkpoint_path=args.checkpoint or None,
+        max_resident_bytes=args.max_page_memory * 1024 * 1024,
+        dedup=dedup,
+    )
+    try:
+        with profiled(args.profile) if args.profile else nullcontext():
+            stats = runner.run(find_files(args.input_dir, args.manifest))
+    finally:
+        backend.close()
+        if dedup is not None:
+            dedup.db.close()
+    if args.metrics_file:
+        write_metrics_file(args.metrics_file)
+    log_event("batch_done", **{k: v for k, v in stats.items() if k != "tiers"})
+    print_summary(stats, runner.errors, dedup)
+    return 1 if stats["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,48 @@
+# Pages-per-second of the per-page PDF pipeline against a fake provider.
+#
+#   python -m benchmarks.concurrency --pages 40 --latency 0.5
+#
+import argparse
+import time
+
+from PIL import Image
+
+from extractor import Extractor, FakeBackend
+from pipeline import RENDER_LOCK, RateLimiter, process_in_order
+
+
+def fake_render(page_number):
+    # Stand-in for page.render(); a blank A4 page at 72 DPI
+    with RENDER_LOCK:
+        return Image.new("RGB", (595, 842), "white")
+
+
+def run(pages, latency, concurrency, rate=0):
+    extractor = Extractor(FakeBackend(latency=latency), rate_limiter=RateLimiter(rate))
+
+    def analyze_page(page_number):
+        return extractor.extract(fake_render(page_number))
+
+    start = time.perf_counter()
+    order = [page_number for page_number, _ in process_in_order(range(pages), analyze_page, concurrency)]
+    elapsed = time.perf_counter() - start
+    assert order == list(range(pages))
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parallel page extraction")
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.5, help="fake model latency in seconds")
+    parser.add_argument("--rate", type=float, default=0, help="requests per second limit (0 = unlimited)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    print(f"{'workers':>8} {'seconds':>9} {'pages/s':>9}")
+    for workers in args.concurrency:
+        elapsed = run(args.pages, args.latency, workers, args.rate)
+        print(f"{workers:>8} {elapsed:>9.2f} {args.pages / elapsed:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# Inserts per second into the bills table: the old connect/insert/commit/close
+# per row, add_bill on the shared WAL connection, and add_bills in batches.
+#
+#   python -m benchmarks.db_inserts --rows 100000
+#
+import argparse
+import itertools
+import os
+import sqlite3
+import tempfile
+import time
+
+from database import BillDatabase
+
+
+def make_rows(count):
+    return [(f"INV-{i:08d}", f"Vendor {i % 5000}", round(i * 1.37 % 100000, 2), "2024-01-01") for i in range(count)]
+
+
+def old_path(db_path, rows):
+    # What app.add_bill_to_db did for every bill
+    for row in rows:
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO bills (invoice_number, company_name, total_cost, bill_date)
+            VALUES (?, ?, ?, ?)
+        """, row)
+        conn.commit()
+        conn.close()
+
+
+def shared_connection(db, rows):
+    for row in rows:
+        db.add_bill(*row)
+
+
+def batched(db, rows, batch_size):
+    for start in range(0, len(rows), batch_size):
+        db.add_bills(rows[start:start + batch_size])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bills table inserts")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    db_names = itertools.count()
+    print(f"{'path':<34} {'rows':>8} {'seconds':>8} {'rows/s':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        def run(name, func):
+            db_path = os.path.join(tmp, f"{next(db_names)}.db")
+            db = BillDatabase(db_path)
+            if name.startswith("old"):
+                # The old path ran against a default rollback-journal database
+                db.conn.execute("PRAGMA journal_mode=DELETE")
+            start = time.perf_counter()
+            func(db_path, db)
+            elapsed = time.perf_counter() - start
+            (count,) = db.conn.execute("SELECT COUNT(*) FROM bills").fetchone()
+            db.close()
+            print(f"{name:<34} {count:>8} {elapsed:>8.2f} {count / elapsed:>10.0f}")
+
+        run("old connect/commit/close per row", lambda path, db: old_path(path, rows))
+        run("shared WAL connection, add_bill", lambda path, db: shared_connection(db, rows))
+        run(f"add_bills x{args.batch_size}", lambda path, db: batched(db, rows, args.batch_size))
+        run("add_bills single transaction", lambda path, db: db.add_bills(rows))
+
+
+if __name__ == "__main__":
+    main()
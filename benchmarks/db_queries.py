@@ -0,0 +1,95 @@
+# View Bills / BillDatabase query times on a large bills table, before and
+# after the index migration.
+#
+#   python -m benchmarks.db_queries --rows 1000000
+#
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+
+from database import MIGRATIONS, _index_bills, connect, migrate
+
+QUERIES = {
+    "latest 50 by bill_date": (
+        "SELECT * FROM bills ORDER BY bill_date DESC LIMIT 50", ()
+    ),
+    "month total (range scan)": (
+        "SELECT COUNT(*), SUM(total_cost) FROM bills WHERE bill_date BETWEEN ? AND ?",
+        ("2024-03-01", "2024-03-31"),
+    ),
+    "invoice_number lookup": (
+        "SELECT * FROM bills WHERE invoice_number = ?", ("INV-00500000",)
+    ),
+    "company_name total": (
+        "SELECT COUNT(*), SUM(total_cost) FROM bills WHERE company_name = ?", ("Vendor 42",)
+    ),
+}
+
+
+def fill(conn, rows, vendors=5000):
+    rng = random.Random(0)
+    start = date(2020, 1, 1)
+    batch = []
+    with conn:
+        for i in range(rows):
+            batch.append((
+                f"INV-{i:08d}",
+                f"Vendor {rng.randrange(vendors)}",
+                round(rng.uniform(10, 100000), 2),
+                (start + timedelta(days=rng.randrange(5 * 365))).isoformat(),
+            ))
+            if len(batch) == 50_000:
+                conn.executemany(
+                    "INSERT INTO bills (invoice_number, company_name, total_cost, bill_date) VALUES (?, ?, ?, ?)",
+                    batch,
+                )
+                batch = []
+        if batch:
+            conn.executemany(
+                "INSERT INTO bills (invoice_number, company_name, total_cost, bill_date) VALUES (?, ?, ?, ?)",
+                batch,
+            )
+
+
+def time_queries(conn, repeat):
+    results = {}
+    for name, (sql, params) in QUERIES.items():
+        start = time.perf_counter()
+        for _ in range(repeat):
+            conn.execute(sql, params).fetchall()
+        results[name] = (time.perf_counter() - start) / repeat
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bills queries with and without indexes")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = connect(os.path.join(tmp, "bills.db"))
+        # Everything up to, but not including, the index migration
+        migrate(conn, MIGRATIONS.index(_index_bills))
+        start = time.perf_counter()
+        fill(conn, args.rows)
+        print(f"Inserted {args.rows} rows in {time.perf_counter() - start:.1f}s")
+
+        before = time_queries(conn, args.repeat)
+        start = time.perf_counter()
+        migrate(conn)
+        conn.execute("ANALYZE")
+        print(f"Index migration took {time.perf_counter() - start:.1f}s")
+        after = time_queries(conn, args.repeat)
+        conn.close()
+
+    print(f"{'query':<28} {'no index ms':>12} {'indexed ms':>11} {'speedup':>8}")
+    for name in QUERIES:
+        print(f"{name:<28} {1000 * before[name]:>12.2f} {1000 * after[name]:>11.2f} {before[name] / after[name]:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
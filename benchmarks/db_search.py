@@ -0,0 +1,57 @@
+# Search latency on a large bills table: the old LIKE '%term%' scan versus
+# the FTS5 index behind BillDatabase.search_bills.
+#
+#   python -m benchmarks.db_search --rows 1000000
+#
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.db_queries import fill
+from database import BillDatabase
+
+TERMS = ["Vendor 42", "vend", "INV-0050", "INV-00999999", "nomatch"]
+
+
+def like_search(conn, term):
+    # What search_bills used to run, and what View Bills did in pandas
+    return conn.execute("""
+        SELECT * FROM bills
+        WHERE invoice_number LIKE ?
+        OR company_name LIKE ?
+        ORDER BY bill_date DESC
+        LIMIT 50
+    """, (f"%{term}%", f"%{term}%")).fetchall()
+
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark LIKE versus FTS5 bill search")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = BillDatabase(os.path.join(tmp, "bills.db"))
+        start = time.perf_counter()
+        fill(db.conn, args.rows)
+        print(f"Inserted {args.rows} rows (with FTS triggers) in {time.perf_counter() - start:.1f}s")
+
+        print(f"{'term':<16} {'LIKE ms':>9} {'FTS ms':>8} {'FTS count ms':>13} {'matches':>9}")
+        for term in TERMS:
+            like, _ = timed(lambda: like_search(db.conn, term), args.repeat)
+            fts, _ = timed(lambda: db.search_bills(term, limit=50), args.repeat)
+            count_time, count = timed(lambda: db.count_search_results(term), args.repeat)
+            print(f"{term:<16} {1000 * like:>9.2f} {1000 * fts:>8.2f} {1000 * count_time:>13.2f} {count:>9}")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+# Model calls and bill rows avoided by the dedup index on a folder of
+# synthetic invoices from one template, with exact copies (the same PDF
+# emailed twice), re-saved copies (same page, different file bytes),
+# re-scans (shifted, rescaled, recompressed, darker) and near misses: pairs
+# of invoices whose pages differ only in one digit of the invoice number,
+# which must both be extracted and stored. The fake model reads the
+# invoice number from a block code printed on the page, so a re-scan gets
+# the same answer, as from a real model.
+#
+#   python -m benchmarks.dedup --invoices 40 --copies 10 --resaved 10 --rescans 10 --near-misses 10
+#
+import argparse
+import io
+import json
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageEnhance, ImageOps
+
+from batch import BatchRunner, find_files
+from benchmarks.invoices import corpus, invoice_image, invoice_lines
+from database import BillDatabase
+from dedup import DedupIndex, page_digest
+from extractor import Backend, Extractor
+
+CODE_BITS = 16
+BLOCK = 24
+NEAR_MISS_BASE = 20000
+
+
+def draw_invoice(number, rng):
+    # Same layout for every invoice, only the numbers and lines change
+    image = Image.new("RGB", (1240, 1754), "white")
+    draw = ImageDraw.Draw(image)
+    for bit in range(CODE_BITS):
+        if number >> bit & 1:
+            draw.rectangle((60 + bit * BLOCK, 60, 60 + (bit + 1) * BLOCK - 1, 60 + BLOCK - 1), fill="black")
+    draw.text((60, 140), "ACME SUPPLIES LTD", fill="black", font_size=48)
+    draw.text((60, 220), f"Invoice INV-{number:05d}", fill="black", font_size=32)
+    # Pairs of numbers (2n, 2n + 1) share a date, so near misses differ in one digit only
+    day = number // 2
+    draw.text((60, 270), f"Date 2024-{day % 12 + 1:02d}-{day % 28 + 1:02d}", fill="black", font_size=32)
+    y = 400
+    total = 0
+    for line in range(rng.randint(3, 12)):
+        amount = rng.randint(100, 99999) / 100
+        total += amount
+        draw.text((60, y), f"Item {rng.randint(1000, 9999)}  x{rng.randint(1, 20)}", fill="black", font_size=28)
+        draw.text((900, y), f"{amount:10.2f}", fill="black", font_size=28)
+        y += 60
+    draw.line((60, y + 20, 1180, y + 20), fill="black", width=3)
+    draw.text((700, y + 50), f"TOTAL {total:10.2f}", fill="black", font_size=36)
+    return image
+
+
+def rescan(image, rng):
+    # Off by a few pixels, rescaled, recompressed and a little darker, like
+    # a second scan
+    dx, dy = rng.randint(-8, 8), rng.randint(-8, 8)
+    image = ImageOps.expand(image, border=10, fill="white").crop(
+        (10 + dx, 10 + dy, 10 + dx + image.width, 10 + dy + image.height)
+    )
+    scaled = image.resize((int(image.width * 0.9), int(image.height * 0.9)), Image.BILINEAR)
+    scaled = ImageEnhance.Brightness(scaled).enhance(rng.uniform(0.93, 0.99))
+    buffered = io.BytesIO()
+    scaled.save(buffered, format="JPEG", quality=60)
+    return Image.open(io.BytesIO(buffered.getvalue())).convert("RGB")
+
+
+class BlockCodeBackend(Backend):
+    name = "block-code"
+    model_name = "block-code"
+
+    def __init__(self):
+        self.calls = 0
+
+    def generate(self, prompt, image):
+        self.calls += 1
+        page = Image.open(io.BytesIO(image.data)).convert("L")
+        scale = page.width / 1240
+        number = 0
+        for bit in range(CODE_BITS):
+            x = int((60 + bit * BLOCK + BLOCK / 2) * scale)
+            y = int((60 + BLOCK / 2) * scale)
+            if page.getpixel((x, y)) < 128:
+                number |= 1 << bit
+        return json.dumps({
+            "vendor_name": "Acme Supplies Ltd",
+            "bill_date": "2024-01-01",
+            "total_amount": "100.00",
+            "invoice_number": f"INV-{number:05d}",
+        })
+
+
+def make_corpus(folder, invoices, copies, resaved, rescans, near_misses, seed=0):
+    rng = random.Random(seed)
+    images = {}
+    for number in range(invoices):
+        images[number] = draw_invoice(number, rng)
+        images[number].save(folder / f"invoice_{number:05d}.png")
+    for i, number in enumerate(rng.sample(range(invoices), copies)):
+        (folder / f"copy_{i:03d}.png").write_bytes((folder / f"invoice_{number:05d}.png").read_bytes())
+    for i, number in enumerate(rng.sample(range(invoices), resaved)):
+        images[number].save(folder / f"resaved_{i:03d}.png", compress_level=1)
+    for i, number in enumerate(rng.sample(range(invoices), rescans)):
+        rescan(images[number], rng).save(folder / f"rescan_{i:03d}.png")
+    # Same line items, numbers one digit apart, numbered clear of the invoices above
+    for i in range(near_misses):
+        number = NEAR_MISS_BASE + 2 * i
+        for variant in (number, number + 1):
+            draw_invoice(variant, random.Random(seed + i)).save(folder / f"near_{variant:05d}.png")
+
+
+def near_miss_pages(invoices, seed=0):
+    # The dedup index straight on two same-template pages, one digit of the
+    # invoice number and of the total apart: matches found (must be 0)
+    db = BillDatabase(":memory:")
+    dedup = DedupIndex(db)
+    matches = 0
+    for invoice, style in corpus(invoices, seed, styles=(0, 1, 2)):
+        lines = invoice_lines(invoice, style)
+        neighbour = dict(invoice, invoice_number=invoice["invoice_number"][:-1]
+                         + str((int(invoice["invoice_number"][-1]) + 1) % 10),
+                         total_amount=f"{float(invoice['total_amount']) + 100:.2f}")
+        dedup.add_page(dedup.page_signature(invoice_image(lines)), "{}")
+        signature = dedup.page_signature(invoice_image(invoice_lines(neighbour, style)))
+        matches += dedup.find_page(signature) is not None
+    db.close()
+    return matches
+
+
+def run(folder, db_path, use_dedup):
+    backend = BlockCodeBackend()
+    dedup = DedupIndex(BillDatabase(db_path)) if use_dedup else None
+    runner = BatchRunner(Extractor(backend, dedup=dedup), db_path=db_path, workers=4, dedup=dedup)
+    stats = runner.run(find_files(folder))
+    calls_avoided = dedup.stats["pages"] if dedup else 0
+    if dedup:
+        dedup.db.close()
+    return backend.calls, calls_avoided, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the dedup index")
+    parser.add_argument("--invoices", type=int, default=40)
+    parser.add_argument("--copies", type=int, default=10)
+    parser.add_argument("--resaved", type=int, default=10)
+    parser.add_argument("--rescans", type=int, default=10)
+    parser.add_argument("--near-misses", type=int, default=10, help="pairs of invoices one digit apart")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = Path(tmp) / "invoices"
+        folder.mkdir()
+        make_corpus(folder, args.invoices, args.copies, args.resaved, args.rescans, args.near_misses)
+        files = len(find_files(folder))
+
+        image = Image.open(folder / "invoice_00000.png").convert("RGB")
+        start = time.perf_counter()
+        for _ in range(20):
+            page_digest(image)
+        hash_ms = (time.perf_counter() - start) / 20 * 1000
+
+        print(f"{files} files: {args.invoices} invoices, {args.copies} exact copies, {args.resaved} re-saved, "
+              f"{args.rescans} re-scans, {args.near_misses} near-miss pairs; page digest {hash_ms:.1f} ms/page")
+        print(f"{'run':<22} {'model calls':>11} {'avoided':>8} {'dup files':>9} {'rows':>5} {'dup rows':>8}")
+        for name, db_name, use_dedup in (
+            ("no dedup", "plain.db", False),
+            ("dedup", "dedup.db", True),
+            ("dedup, same folder", "dedup.db", True),
+        ):
+            db_path = os.path.join(tmp, db_name)
+            calls, avoided, stats = run(folder, db_path, use_dedup)
+            print(f"{name:<22} {calls:>11} {avoided:>8} {stats['duplicate_files']:>9} "
+                  f"{stats['inserted']:>5} {stats['duplicate_bills']:>8}")
+        db = BillDatabase(os.path.join(tmp, "dedup.db"))
+        missing = args.invoices + 2 * args.near_misses - db.summarize_bills()[0]
+        db.close()
+        print(f"invoices wrongly merged by the page index: {missing}")
+        print(f"same-template pages one digit apart matched as the same page: {near_miss_pages(args.invoices)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# Peak Python memory and time of the old in-memory CSV download
+# (DataFrame.to_csv().encode()) against the streaming exporter.
+#
+#   python -m benchmarks.export --rows 100000 1000000
+#
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+from benchmarks.db_queries import fill
+from database import BILL_COLUMNS, BillDatabase
+from export import available_formats, export_bills
+
+
+def old_csv(db, path):
+    bills = db.search_bills("", limit=None)
+    df = pd.DataFrame.from_records(bills, columns=BILL_COLUMNS)
+    data = df.to_csv(index=False).encode('utf-8')
+    return len(data)
+
+
+def new_export(db, path, format):
+    export_bills(path, format, db.db_path)
+    return os.path.getsize(path)
+
+
+def measure(func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = func(*args)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bill exports")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    args = parser.parse_args()
+
+    print(f"{'rows':>9} {'method':<14} {'seconds':>8} {'peak MB':>8} {'file MB':>8}")
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = BillDatabase(os.path.join(tmp, "bills.db"))
+            fill(db.conn, rows)
+            out = os.path.join(tmp, "out")
+            runs = [("to_csv (old)", old_csv, (db, out))]
+            runs += [(f"stream {format}", new_export, (db, out, format)) for format in available_formats()]
+            for name, func, func_args in runs:
+                seconds, peak, size = measure(func, *func_args)
+                print(f"{rows:>9} {name:<14} {seconds:>8.2f} {peak / 2**20:>8.1f} {size / 2**20:>8.1f}")
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+# Local stand-in for the Together and Gemini HTTP APIs, for benchmarks.
+# Answers both request shapes with a deterministic bill JSON (an array of
+# bills for a request with several images), whole or streamed as
+# server-sent events, reports token usage the way each API does, and
+# injects latency, hangs, 5xx errors and 429s at the given rates.
+# server.counts has the totals.
+#
+#   server = start_fake_provider(latency=0.1, error_rate=0.1)
+#   base_url = f"http://127.0.0.1:{server.server_port}"
+#
+# Standalone, for batch.py, worker.py or the app:
+#
+#   python -m benchmarks.fake_provider --port 8000 --latency 0.5
+#   TOGETHER_BASE_URL=http://127.0.0.1:8000/v1 TOGETHER_API_KEY=x python batch.py invoices/
+#
+import argparse
+import base64
+import hashlib
+import io
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+# Vision models bill an image by the tiles it's cut into
+IMAGE_TILE = 768
+TOKENS_PER_TILE = 258
+# Characters per streamed event
+STREAM_CHUNK = 16
+
+
+def bill_answer(digest):
+    return {
+        "vendor_name": f"Vendor {digest[:4].upper()}",
+        "bill_date": "2024-01-01",
+        "total_amount": f"{int(digest[4:10], 16) % 100000 / 100:.2f}",
+        "invoice_number": f"INV-{digest[10:16].upper()}",
+    }
+
+
+def fake_answer(body, images=1):
+    digest = hashlib.sha256(body).hexdigest()
+    if images <= 1:
+        return json.dumps(bill_answer(digest))
+    return json.dumps([
+        dict(bill_answer(hashlib.sha256(f"{digest}:{page}".encode()).hexdigest()), pages=[page])
+        for page in range(1, images + 1)
+    ])
+
+
+def request_parts(body):
+    # (prompt text, [base64 images], streamed) from a Together or Gemini
+    # request body; Gemini asks for a stream in the URL instead
+    try:
+        payload = json.loads(body)
+        stream = bool(payload.get("stream"))
+        if "contents" in payload:
+            parts = payload["contents"][0]["parts"]
+            texts = [part["text"] for part in parts if "text" in part]
+            images = [part["inline_data"]["data"] for part in parts if "inline_data" in part]
+        else:
+            content = payload["messages"][0]["content"]
+            texts = [item["text"] for item in content if item.get("type") == "text"]
+            images = [item["image_url"]["url"].split(",", 1)[-1] for item in content if item.get("type") == "image_url"]
+    except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+        return "", [], False
+    return "".join(texts), images, stream
+
+
+def image_tokens(data):
+    # Tokens for one base64 image: a flat rate per tile of its pixel size
+    try:
+        width, height = Image.open(io.BytesIO(base64.b64decode(data))).size
+    except Exception:
+        return TOKENS_PER_TILE
+    return math.ceil(width / IMAGE_TILE) * math.ceil(height / IMAGE_TILE) * TOKENS_PER_TILE
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Clients that cut a stream short reconnect; the default backlog of 5
+    # drops connections when many pages do that at once
+    request_queue_size = 128
+
+
+def start_fake_provider(latency=0.1, jitter=0.5, error_rate=0.0, throttle_rate=0.0, hang_rate=0.0,
+                        hang_seconds=10.0, retry_after=0.5, down=False, seed=0, image_latency=0.0,
+                        port=0, host="127.0.0.1"):
+    # latency: median seconds per request, plus image_latency per image,
+    # spread by +-jitter (fraction). down: every request fails with 500,
+    # like a provider outage.
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+    counts = {"requests": 0, "errors": 0, "throttled": 0, "hangs": 0, "images": 0, "tokens_in": 0, "tokens_out": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def reply(self, status, payload, headers=()):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def reply_stream(self, events):
+            # Server-sent events in a chunked body, so the connection is kept
+            # alive as with the real APIs
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for event in events:
+                data = b"data: " + (event if isinstance(event, bytes) else json.dumps(event).encode()) + b"\n\n"
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            prompt, images, stream = request_parts(body)
+            gemini = ":generateContent" in self.path or ":streamGenerateContent" in self.path
+            stream = stream or ":streamGenerateContent" in self.path
+            with rng_lock:
+                counts["requests"] += 1
+                roll = rng.random()
+                delay = (latency + image_latency * len(images)) * (1 + rng.uniform(-jitter, jitter))
+            if down or roll < error_rate:
+                counts["errors"] += 1
+                time.sleep(delay)
+                return self.reply(503 if not down else 500, {"error": "upstream failure"})
+            roll -= error_rate
+            if roll < throttle_rate:
+                counts["throttled"] += 1
+                return self.reply(429, {"error": "rate limited"}, [("Retry-After", str(retry_after))])
+            roll -= throttle_rate
+            if roll < hang_rate:
+                counts["hangs"] += 1
+                delay = hang_seconds
+            time.sleep(delay)
+
+            text = fake_answer(body, len(images))
+            # About four characters per text token
+            tokens_in = len(prompt) // 4 + sum(image_tokens(image) for image in images)
+            tokens_out = len(text) // 4
+            with rng_lock:
+                counts["images"] += len(images)
+                counts["tokens_in"] += tokens_in
+                counts["tokens_out"] += tokens_out
+            pieces = [text[i:i + STREAM_CHUNK] for i in range(0, len(text), STREAM_CHUNK)]
+            if gemini and stream:
+                events = [{"candidates": [{"content": {"parts": [{"text": piece}]}}],
+                           "usageMetadata": {"promptTokenCount": tokens_in,
+                                             "candidatesTokenCount": (i + 1) * tokens_out // len(pieces)}}
+                          for i, piece in enumerate(pieces)]
+            elif stream:
+                events = [{"choices": [{"delta": {"content": piece}}]} for piece in pieces]
+                events += [{"choices": [], "usage": {"prompt_tokens": tokens_in, "completion_tokens": tokens_out}},
+                           b"[DONE]"]
+            elif gemini:
+                payload = {"candidates": [{"content": {"parts": [{"text": text}]}}],
+                           "usageMetadata": {"promptTokenCount": tokens_in, "candidatesTokenCount": tokens_out}}
+            else:
+                payload = {"choices": [{"message": {"content": text}}],
+                           "usage": {"prompt_tokens": tokens_in, "completion_tokens": tokens_out}}
+            try:
+                if stream:
+                    self.reply_stream(events)
+                else:
+                    self.reply(200, payload)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    server = FakeServer((host, port), Handler)
+    server.counts = counts
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve fake Together and Gemini APIs")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--latency", type=float, default=0.5, help="median seconds per request")
+    parser.add_argument("--image-latency", type=float, default=0.0, help="extra seconds per image")
+    parser.add_argument("--jitter", type=float, default=0.5, help="latency spread, as a fraction")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests failing with 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of requests rejected with 429")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = start_fake_provider(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+        seed=args.seed, image_latency=args.image_latency, port=args.port, host=args.host,
+    )
+    url = f"http://{args.host}:{server.server_port}"
+    print(f"Together: {url}/v1  Gemini: {url}/v1beta")
+    try:
+        while True:
+            time.sleep(60)
+            print(json.dumps(server.counts), flush=True)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(json.dumps(server.counts))
+
+
+if __name__ == "__main__":
+    main()
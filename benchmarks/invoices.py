@@ -0,0 +1,199 @@
+# Synthetic invoices for benchmarks: the ground-truth fields, a born-digital
+# PDF with a real text layer (several label and date styles), or a scanned
+# PDF/PNG/JPEG with no text layer at all, at a given resolution. Everything
+# is seeded, so the same arguments give byte-identical files.
+#
+#   python -m benchmarks.invoices corpus/ --files 40 --max-pages 8 --dpi 100 150 200
+#
+import argparse
+import io
+import json
+import random
+from datetime import date, timedelta
+from pathlib import Path
+
+from PIL import Image, ImageDraw
+
+VENDORS = [
+    "Acme Supplies Pvt Ltd", "Globex Corporation", "Initech Traders", "Umbrella Industries Ltd",
+    "Stark Components LLC", "Wayne Enterprises", "Hooli Logistics Co", "Vandelay Imports Inc",
+]
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+A4_INCHES = (8.27, 11.69)
+# What invoice_image's default size (1240x1754) is a scan at
+BASE_DPI = 150
+
+
+def make_invoice(number, rng):
+    # Ground truth for one invoice, in the shape the model answers with
+    items = [(f"Item {rng.randint(1000, 9999)}", rng.randint(1, 20), rng.randint(100, 500000) / 100)
+             for _ in range(rng.randint(2, 10))]
+    subtotal = round(sum(qty * price for _, qty, price in items), 2)
+    tax = round(subtotal * 0.18, 2)
+    return {
+        "vendor_name": rng.choice(VENDORS),
+        "bill_date": (date(2023, 1, 1) + timedelta(days=rng.randrange(700))).isoformat(),
+        "total_amount": f"{subtotal + tax:.2f}",
+        "invoice_number": f"INV-{number:06d}",
+        "items": items,
+        "subtotal": subtotal,
+        "tax": tax,
+    }
+
+
+def invoice_lines(invoice, style):
+    # Printed lines of text; each style labels things differently
+    day = date.fromisoformat(invoice["bill_date"])
+    total = float(invoice["total_amount"])
+    header = {
+        0: ["TAX INVOICE", f"Invoice No: {invoice['invoice_number']}", f"Invoice Date: {day:%d/%m/%Y}"],
+        1: ["INVOICE", f"Invoice # {invoice['invoice_number']}", f"Date: {MONTHS[day.month - 1]} {day.day}, {day.year}"],
+        2: ["Bill of Supply", f"Bill No. {invoice['invoice_number']}", f"Dated {day.day:02d}-{MONTHS[day.month - 1]}-{day.year}"],
+        3: ["Statement", f"Ref {invoice['invoice_number']}", f"{day.isoformat()}"],
+    }[style]
+    footer = {
+        0: [f"Sub Total {invoice['subtotal']:,.2f}", f"GST 18% {invoice['tax']:,.2f}", f"Grand Total Rs. {total:,.2f}"],
+        1: [f"Subtotal ${invoice['subtotal']:,.2f}", f"Tax ${invoice['tax']:,.2f}", f"Total Due: ${total:,.2f}"],
+        2: [f"Taxable value {invoice['subtotal']:.2f}", "Amount Payable", f"INR {total:,.2f}"],
+        3: [f"{total:,.2f}"],
+    }[style]
+    lines = [invoice["vendor_name"], "12 Industrial Estate, Pune 411001", *header, "", "Bill To: Global Autotech Limited", ""]
+    lines += [f"{name}   x{qty}   {qty * price:,.2f}" for name, qty, price in invoice["items"]]
+    lines += ["", *footer, "", "Thank you for your business"]
+    return lines
+
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def text_pdf(pages):
+    # Minimal PDF with one Helvetica text line per entry: a real text layer
+    # that pdfium can extract, like an invoice exported from accounting
+    # software. pages is a list of line lists.
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    page_ids = []
+    for lines in pages:
+        ops = ["BT", "/F1 11 Tf", "14 TL", "60 790 Td"]
+        ops += [f"({_pdf_escape(line)}) '" for line in lines]
+        ops.append("ET")
+        stream = "\n".join(ops).encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids).encode()
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b"%010d 00000 n \n" % offset)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+def page_size(dpi):
+    # Pixel size of an A4 page scanned at dpi
+    return round(A4_INCHES[0] * dpi), round(A4_INCHES[1] * dpi)
+
+
+def invoice_image(lines, width=1240, height=1754):
+    # The same lines drawn on a page image, for scans without a text layer.
+    # The layout scales with the width, so any resolution looks alike.
+    scale = width / 1240
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    y = 100 * scale
+    for line in lines:
+        draw.text((120 * scale, y), line, fill="black", font_size=26 * scale)
+        y += 36 * scale
+    return image
+
+
+def scanned_pdf(pages_lines, dpi=BASE_DPI):
+    images = [invoice_image(lines, *page_size(dpi)) for lines in pages_lines]
+    out = io.BytesIO()
+    images[0].save(out, format="PDF", save_all=True, append_images=images[1:], resolution=dpi)
+    return out.getvalue()
+
+
+def scanned_image(lines, dpi=BASE_DPI, format="PNG"):
+    # A photographed or scanned invoice as uploaded, encoded
+    out = io.BytesIO()
+    invoice_image(lines, *page_size(dpi)).save(out, format=format, quality=85)
+    return out.getvalue()
+
+
+def corpus(count, seed=0, styles=(0, 1, 2, 3)):
+    # [(invoice, style)] with the styles mixed evenly
+    rng = random.Random(seed)
+    return [(make_invoice(number, rng), styles[number % len(styles)]) for number in range(count)]
+
+
+def write_corpus(folder, files=40, max_pages=8, dpis=(100, 150, 200), seed=0,
+                 kinds=(("digital", 2), ("scanned", 2), ("image", 1))):
+    # A folder of born-digital PDFs, scanned PDFs at the given resolutions
+    # and single scanned PNG/JPEG pages, in the given proportions; PDFs have
+    # 1 to max_pages pages. Returns the manifest: one entry per file.
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    names, weights = zip(*kinds)
+    manifest = []
+    number = 0
+    for index in range(files):
+        kind = rng.choices(names, weights)[0]
+        pages = 1 if kind == "image" else rng.randint(1, max_pages)
+        dpi = None if kind == "digital" else rng.choice(dpis)
+        invoices = [make_invoice(number + page, rng) for page in range(pages)]
+        lines = [invoice_lines(invoice, (number + page) % 4) for page, invoice in enumerate(invoices)]
+        number += pages
+        if kind == "digital":
+            name, data = f"digital_{index:04d}.pdf", text_pdf(lines)
+        elif kind == "scanned":
+            name, data = f"scanned_{index:04d}_{dpi}dpi.pdf", scanned_pdf(lines, dpi)
+        else:
+            format = rng.choice(("PNG", "JPEG"))
+            name = f"photo_{index:04d}_{dpi}dpi.{'png' if format == 'PNG' else 'jpg'}"
+            data = scanned_image(lines[0], dpi, format)
+        (folder / name).write_bytes(data)
+        manifest.append({
+            "file": name, "kind": kind, "pages": pages, "dpi": dpi, "bytes": len(data),
+            "invoice_numbers": [invoice["invoice_number"] for invoice in invoices],
+        })
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a folder of synthetic invoices")
+    parser.add_argument("folder")
+    parser.add_argument("--files", type=int, default=40)
+    parser.add_argument("--max-pages", type=int, default=8, help="pages per PDF, 1 to this many")
+    parser.add_argument("--dpi", type=int, nargs="+", default=[100, 150, 200], help="scan resolutions")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    manifest = write_corpus(args.folder, args.files, args.max_pages, args.dpi, args.seed)
+    with open(Path(args.folder) / "manifest.json", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    pages = sum(entry["pages"] for entry in manifest)
+    size = sum(entry["bytes"] for entry in manifest)
+    print(f"{len(manifest)} files, {pages} pages, {size / 1024 / 1024:.1f} MB in {args.folder}")
+
+
+if __name__ == "__main__":
+    main()
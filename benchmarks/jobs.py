@@ -0,0 +1,90 @@
+# The job queue end to end: how long submitting an upload holds up the
+# Streamlit script (against processing it inline), then queue throughput
+# and job latency with worker.py running 1, 2 and 4 processes against a
+# fake model with realistic latency.
+#
+#   python -m benchmarks.jobs --jobs 12 --pages 5 --latency 0.5
+#
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from batch import BatchRunner
+from benchmarks.invoices import corpus, invoice_lines, scanned_pdf
+from database import BillDatabase
+from extractor import Extractor, FakeBackend
+from jobs import JobQueue, format_metrics
+
+
+def make_documents(count, pages, seed=0):
+    invoices = corpus(count * pages, seed, styles=(0, 1, 2))
+    return [
+        scanned_pdf([invoice_lines(invoice, style) for invoice, style in invoices[i * pages:(i + 1) * pages]])
+        for i in range(count)
+    ]
+
+
+def inline_seconds(tmp, document, latency, threads):
+    # What the upload costs the Streamlit session when processed in it
+    path = Path(tmp) / "inline.pdf"
+    path.write_bytes(document)
+    runner = BatchRunner(Extractor(FakeBackend(latency)), db_path=os.path.join(tmp, "inline.db"), workers=threads)
+    start = time.perf_counter()
+    runner.run([path])
+    return time.perf_counter() - start
+
+
+def run_queue(tmp, documents, processes, threads, latency):
+    db_path = os.path.join(tmp, f"queue_{processes}.db")
+    spool = os.path.join(tmp, f"spool_{processes}")
+    db = BillDatabase(db_path)
+    queue = JobQueue(db, spool)
+    start = time.perf_counter()
+    for index, document in enumerate(documents):
+        queue.submit(document, f"doc_{index}.pdf", {"backend": "fake"})
+    submit_ms = (time.perf_counter() - start) / len(documents) * 1000
+
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "worker.py", "--db", db_path, "--spool-dir", spool, "--backend", "fake",
+         "--fake-latency", str(latency), "--processes", str(processes), "--threads", str(threads),
+         "--rate", "0", "--no-cache", "--once"],
+        check=True, stdout=subprocess.DEVNULL,
+    )
+    seconds = time.perf_counter() - start
+    metrics = queue.metrics()
+    db.close()
+    return submit_ms, seconds, metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the background job queue")
+    parser.add_argument("--jobs", type=int, default=12)
+    parser.add_argument("--pages", type=int, default=5, help="pages per uploaded PDF")
+    parser.add_argument("--latency", type=float, default=0.5, help="fake model latency in seconds")
+    parser.add_argument("--threads", type=int, default=2, help="pages in flight per job")
+    parser.add_argument("--processes", default="1,2,4")
+    args = parser.parse_args()
+
+    documents = make_documents(args.jobs, args.pages)
+    with tempfile.TemporaryDirectory() as tmp:
+        inline = inline_seconds(tmp, documents[0], args.latency, args.threads)
+        print(f"{args.jobs} jobs of {args.pages} pages, model latency {args.latency}s, {args.threads} pages in flight "
+              f"per job, {os.cpu_count()} CPUs")
+        print(f"one upload processed inline blocks the session {inline:.2f}s")
+        print(f"{'processes':>9} {'submit ms':>9} {'drain s':>8} {'jobs/min':>8} {'pages/min':>9} "
+              f"{'latency p50':>11} {'p95':>6} {'wait p50':>8}")
+        for processes in (int(p) for p in args.processes.split(",")):
+            submit_ms, seconds, metrics = run_queue(tmp, documents, processes, args.threads, args.latency)
+            print(f"{processes:>9} {submit_ms:>9.1f} {seconds:>8.1f} {args.jobs * 60 / seconds:>8.1f} "
+                  f"{args.jobs * args.pages * 60 / seconds:>9.1f} {metrics['latency_p50']:>10.1f}s "
+                  f"{metrics['latency_p95']:>5.1f}s {metrics['wait_p50']:>7.1f}s")
+        print(f"last run's queue metrics: {format_metrics(metrics)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# Peak memory of the per-page render -> encode -> upload path, old style
+# (three PNG encodes, buffers left to the garbage collector) versus
+# PageArtifact (one lazy encode, bitmap released when the page is done).
+# Each run happens in its own process so peak RSS isn't shared.
+#
+#   python -m benchmarks.memory --pages 10 50 100
+#
+import argparse
+import base64
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+
+import pypdfium2 as pdfium
+from PIL import Image, ImageDraw
+
+from extractor import Extractor, FakeBackend
+from preprocess import PageArtifact
+
+
+def make_pdf(path, pages):
+    # Noisy pages so the PNGs are about the size of a real scan
+    noise = Image.effect_noise((595, 842), 40).convert("RGB")
+    images = []
+    for page_number in range(pages):
+        image = noise.copy()
+        ImageDraw.Draw(image).text((40, 40), f"Invoice page {page_number + 1}", fill="black")
+        images.append(image)
+    images[0].save(path, save_all=True, append_images=images[1:])
+
+
+def run_legacy(pdf, extractor):
+    for page_number in range(len(pdf)):
+        page = pdf[page_number]
+        bitmap = page.render(scale=1.0, rotation=0)
+        pil_image = bitmap.to_pil()
+        # Download button
+        buf = BytesIO()
+        pil_image.save(buf, format="PNG")
+        download = buf.getvalue()
+        # Base64 data URL
+        buffered = BytesIO()
+        pil_image.save(buffered, format="PNG")
+        base64.b64encode(buffered.getvalue()).decode("utf-8")
+        # Gemini image_bytes
+        buffered = BytesIO()
+        pil_image.save(buffered, format="PNG")
+        extractor.extract(buffered.getvalue())
+        del download
+
+
+def run_artifact(pdf, extractor):
+    for page_number in range(len(pdf)):
+        page = pdf[page_number]
+        bitmap = page.render(scale=1.0, rotation=0)
+        artifact = PageArtifact(bitmap.to_pil(), resources=(page, bitmap))
+        download = artifact.png
+        artifact.prepared.base64()
+        extractor.extract(artifact)
+        del download
+        artifact.release()
+
+
+def peak_rss_kb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    return 0
+
+
+def child(mode, path):
+    extractor = Extractor(FakeBackend())
+    pdf = pdfium.PdfDocument(path)
+    tracemalloc.start()
+    start = time.perf_counter()
+    {"legacy": run_legacy, "artifact": run_artifact}[mode](pdf, extractor)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    print(json.dumps({"seconds": elapsed, "traced_peak": peak, "rss_peak_kb": peak_rss_kb()}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-page peak memory")
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 50, 100])
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "PDF"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return
+
+    print(f"{'mode':<10} {'pages':>6} {'seconds':>8} {'traced peak':>12} {'peak RSS':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for pages in args.pages:
+            path = os.path.join(tmp, f"{pages}.pdf")
+            make_pdf(path, pages)
+            for mode in ("legacy", "artifact"):
+                output = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.memory", "--child", mode, path],
+                    check=True, capture_output=True, text=True,
+                ).stdout
+                result = json.loads(output)
+                print(
+                    f"{mode:<10} {pages:>6} {result['seconds']:>8.2f} "
+                    f"{result['traced_peak'] / 1024 / 1024:>9.1f} MB {result['rss_peak_kb'] / 1024:>7.1f} MB"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+# Model calls and estimated tokens per invoice for scanned stacks of bills
+# (single-page invoices, invoices running over 2-3 pages and sheets of four
+# receipts), one page per request as today versus grouped pages, sent as
+# several images (Gemini) or tiled into one (Together/Llama), and whether
+# the bills come back whole.
+#
+# The fake model reads a block code printed on every page (also from a
+# tiled sheet) and answers from the ground truth with only what is printed
+# on the pages it was shown: a continuation page has no vendor, the total
+# is on the last page, and with the one-bill prompt a receipt sheet only
+# yields its first receipt.
+#
+#   python -m benchmarks.multibill --documents 10 --group-size 4
+#
+import argparse
+import io
+import json
+import math
+import random
+import re
+
+from PIL import Image, ImageDraw
+
+from benchmarks.invoices import invoice_image, invoice_lines, make_invoice
+from extractor import VALID_KEYS, Backend, BillRecord, Extractor
+from multibill import GroupExtractor, merge_records, tile_boxes
+from rendering import iter_group_results, iter_page_results, open_pdf
+
+PAGE_SIZE = (1240, 1754)
+CODE_BITS = 16
+BLOCK = 40
+# Rough token prices: Gemini bills 258 tokens per 768x768 tile of an image,
+# Llama 3.2 Vision about 1601 per image whatever its size; text is ~4
+# characters per token
+GEMINI_TILE = 768
+GEMINI_TILE_TOKENS = 258
+LLAMA_IMAGE_TOKENS = 1601
+CHARS_PER_TOKEN = 4
+
+
+def draw_code(image, page_id):
+    draw = ImageDraw.Draw(image)
+    for bit in range(CODE_BITS):
+        if page_id >> bit & 1:
+            draw.rectangle((40 + bit * BLOCK, 20, 40 + (bit + 1) * BLOCK - 1, 20 + BLOCK - 1), fill="black")
+    return image
+
+
+def receipt_sheet(receipts):
+    # Four till receipts scanned on one page
+    image = Image.new("RGB", PAGE_SIZE, "white")
+    draw = ImageDraw.Draw(image)
+    for index, receipt in enumerate(receipts):
+        left, top = 80 + index % 2 * 580, 160 + index // 2 * 780
+        draw.rectangle((left, top, left + 520, top + 700), outline="grey", width=3)
+        lines = [receipt["vendor_name"], f"Receipt No: {receipt['invoice_number']}",
+                 f"Date: {receipt['bill_date']}", "", f"Total Rs. {receipt['total_amount']}"]
+        for row, line in enumerate(lines):
+            draw.text((left + 30, top + 40 + row * 50), line, fill="black", font_size=26)
+    return image
+
+
+def truth(invoice):
+    return {key: invoice[key] for key in VALID_KEYS}
+
+
+def make_documents(count, seed=0):
+    # Each document is one scanned PDF of several bills. Returns
+    # [(pdf bytes, [(bill, pages)])] and, per page id, the parts of bills
+    # printed on that page as (bill, first page of it, last page of it).
+    rng = random.Random(seed)
+    documents = []
+    parts = {}
+    number = 0
+    page_id = 1
+    for _ in range(count):
+        images = []
+        bills = []
+        for kind in rng.choices(["single", "multi", "receipts"], weights=[5, 3, 2], k=rng.randint(6, 10)):
+            if kind == "receipts":
+                receipts = []
+                for _ in range(4):
+                    number += 1
+                    receipts.append(make_invoice(number, rng))
+                images.append(draw_code(receipt_sheet(receipts), page_id))
+                parts[page_id] = [(truth(receipt), True, True) for receipt in receipts]
+                bills += [(truth(receipt), [len(images) - 1]) for receipt in receipts]
+                page_id += 1
+                continue
+
+            number += 1
+            invoice = make_invoice(number, rng)
+            lines = invoice_lines(invoice, 0)
+            page_count = 1 if kind == "single" else rng.randint(2, 3)
+            # Header on the first page, item lines spread out, totals on the last
+            split = [lines[:8]] + [[] for _ in range(page_count - 1)]
+            items = lines[8:-6]
+            for index, line in enumerate(items):
+                split[index * page_count // len(items)].append(line)
+            split[-1] += lines[-6:]
+            pages = []
+            for index, page_lines in enumerate(split):
+                if index:
+                    page_lines = [f"Invoice {invoice['invoice_number']} (continued), page {index + 1} of {page_count}",
+                                  ""] + page_lines
+                images.append(draw_code(invoice_image(page_lines), page_id))
+                parts[page_id] = [(truth(invoice), index == 0, index == page_count - 1)]
+                pages.append(len(images) - 1)
+                page_id += 1
+            bills.append((truth(invoice), pages))
+
+        out = io.BytesIO()
+        images[0].save(out, format="PDF", save_all=True, append_images=images[1:], resolution=150)
+        documents.append((out.getvalue(), bills))
+    return documents, parts
+
+
+def read_code(page, left=0, top=0, scale=1.0):
+    number = 0
+    for bit in range(CODE_BITS):
+        x = left + int((40 + bit * BLOCK + BLOCK / 2) * scale)
+        y = top + int((20 + BLOCK / 2) * scale)
+        if page.getpixel((x, y)) < 128:
+            number |= 1 << bit
+    return number
+
+
+def visible_fields(bill, first, last):
+    # What of the bill is printed on the pages shown: the invoice number is
+    # on every page, vendor and date in the header, the total at the end
+    fields = {"invoice_number": bill["invoice_number"]}
+    if first:
+        fields.update(vendor_name=bill["vendor_name"], bill_date=bill["bill_date"])
+    if last:
+        fields["total_amount"] = bill["total_amount"]
+    return fields
+
+
+def gemini_image_tokens(width, height):
+    return math.ceil(width / GEMINI_TILE) * math.ceil(height / GEMINI_TILE) * GEMINI_TILE_TOKENS
+
+
+class GroundTruthBackend(Backend):
+    name = "ground-truth"
+    model_name = "ground-truth"
+    max_images = 16
+
+    def __init__(self, parts):
+        self.parts = parts
+        self.calls = 0
+        self.images = []
+        self.text_chars = 0
+
+    def page_ids(self, prompt, images):
+        pages = [Image.open(io.BytesIO(image.data)).convert("L") for image in images]
+        for page in pages:
+            self.images.append(page.size)
+        tiled = re.search(r"showing (\d+) pages tiled", prompt)
+        if not tiled:
+            return [read_code(page, scale=page.width / PAGE_SIZE[0]) for page in pages]
+        sheet = pages[0]
+        ids = []
+        for left, top, right, bottom in tile_boxes(int(tiled.group(1)), sheet.width, sheet.height):
+            # Pages are shrunk to fit their cell, keeping the aspect ratio
+            scale = min((right - left) / PAGE_SIZE[0], (bottom - top) / PAGE_SIZE[1])
+            ids.append(read_code(sheet, left, top, scale))
+        return ids
+
+    def generate(self, prompt, image):
+        # The one-bill prompt: the first bill on the page, as far as it shows
+        self.calls += 1
+        bill, first, last = self.parts[self.page_ids(prompt, [image])[0]][0]
+        response = json.dumps(visible_fields(bill, first, last))
+        self.text_chars += len(prompt) + len(response)
+        return response
+
+    def generate_many(self, prompt, images):
+        self.calls += 1
+        bills = {}
+        for number, page_id in enumerate(self.page_ids(prompt, images), 1):
+            for bill, first, last in self.parts.get(page_id, []):
+                entry = bills.setdefault(bill["invoice_number"], [bill, False, False, []])
+                entry[1] |= first
+                entry[2] |= last
+                entry[3].append(number)
+        response = json.dumps([
+            dict(visible_fields(bill, first, last), pages=pages) for bill, first, last, pages in bills.values()
+        ])
+        self.text_chars += len(prompt) + len(response)
+        return response
+
+
+def run_per_page(pdf, extractor, merge):
+    records = []
+    for page_number, artifact, record in iter_page_results(pdf, extractor.extract, max_workers=4):
+        artifact.release()
+        record.pages = [page_number]
+        records.append(record)
+    return merge_records(records) if merge else records
+
+
+def run_grouped(pdf, group_extractor):
+    records = []
+    for _, artifacts, group in iter_group_results(pdf, group_extractor.extract_group,
+                                                  group_size=group_extractor.group_size, max_workers=4):
+        for artifact in artifacts:
+            artifact.release()
+        records.extend(group)
+    return merge_records(records)
+
+
+def score(records, bills):
+    # Bills that came back whole (every field and the right pages)
+    found = {}
+    for record in records:
+        found.setdefault(record.invoice_number, []).append(record)
+    correct = 0
+    for bill, pages in bills:
+        matches = found.get(bill["invoice_number"], [])
+        if len(matches) == 1 and matches[0].to_dict() == BillRecord.from_fields(bill).to_dict() \
+                and matches[0].pages == pages:
+            correct += 1
+    return correct
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark grouped and tiled multi-bill extraction")
+    parser.add_argument("--documents", type=int, default=10)
+    parser.add_argument("--group-size", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    documents, parts = make_documents(args.documents, args.seed)
+    page_count = len(parts)
+    bill_count = sum(len(bills) for _, bills in documents)
+    print(f"{args.documents} scanned documents, {page_count} pages, {bill_count} bills; "
+          f"group size {args.group_size}")
+    print(f"{'mode':<28} {'calls':>6} {'calls/bill':>10} {'records':>8} {'whole bills':>11} "
+          f"{'Gemini tok/bill':>15} {'Llama tok/bill':>14}")
+
+    modes = (
+        ("per page (current)", lambda extractor: lambda pdf: run_per_page(pdf, extractor, merge=False)),
+        ("per page + merge", lambda extractor: lambda pdf: run_per_page(pdf, extractor, merge=True)),
+        ("grouped, one image per page",
+         lambda extractor: lambda pdf: run_grouped(pdf, GroupExtractor(extractor, args.group_size, tile=False))),
+        ("grouped, tiled",
+         lambda extractor: lambda pdf: run_grouped(pdf, GroupExtractor(extractor, args.group_size, tile=True))),
+    )
+    for name, make_run in modes:
+        backend = GroundTruthBackend(parts)
+        run = make_run(Extractor(backend))
+        records = 0
+        correct = 0
+        for data, bills in documents:
+            pdf = open_pdf(io.BytesIO(data))
+            result = run(pdf)
+            pdf.close()
+            records += len(result)
+            correct += score(result, bills)
+        text_tokens = backend.text_chars / CHARS_PER_TOKEN
+        gemini = (sum(gemini_image_tokens(w, h) for w, h in backend.images) + text_tokens) / bill_count
+        llama = (len(backend.images) * LLAMA_IMAGE_TOKENS + text_tokens) / bill_count
+        print(f"{name:<28} {backend.calls:>6} {backend.calls / bill_count:>10.2f} {records:>8} "
+              f"{correct:>5}/{bill_count:<5} {gemini:>15.0f} {llama:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# Bytes and time saved per page by the preprocessing stage, measured by
+# posting each payload to a local stand-in model server.
+#
+#   python -m benchmarks.preprocess --image temp_image.png --bandwidth 1000000
+#
+import argparse
+import base64
+import json
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+from preprocess import PreprocessConfig, format_bytes, prepare_image
+
+CONFIGS = {
+    "png (current)": PreprocessConfig(),
+    "png gray": PreprocessConfig(grayscale=True),
+    "png gray 1600px": PreprocessConfig(grayscale=True, max_dimension=1600),
+    "jpeg q85": PreprocessConfig(format="JPEG", quality=85),
+    "jpeg gray q75 1600px": PreprocessConfig(grayscale=True, max_dimension=1600, format="JPEG", quality=75),
+    "webp gray q75 1600px crop": PreprocessConfig(
+        grayscale=True, max_dimension=1600, format="WEBP", quality=75, crop_borders=True
+    ),
+}
+
+
+def start_model_server(bandwidth):
+    # Reads the whole request body, then sleeps as if it had arrived over a
+    # link of `bandwidth` bytes per second
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            if bandwidth:
+                time.sleep(len(body) / bandwidth)
+            reply = json.dumps({"choices": [{"message": {"content": "{}"}}]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(reply)))
+            self.end_headers()
+            self.wfile.write(reply)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def upload(url, prepared):
+    # Same shape as the Together chat completion request
+    payload = json.dumps({
+        "messages": [{"content": [{"image_url": {
+            "url": f"data:{prepared.mime_type};base64,{base64.b64encode(prepared.data).decode()}"
+        }}]}]
+    }).encode()
+    request = urllib.request.Request(url, data=payload, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request) as response:
+        response.read()
+    return len(payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark image preprocessing")
+    parser.add_argument("--image", default="temp_image.png")
+    parser.add_argument("--bandwidth", type=float, default=1_000_000, help="simulated upload bytes/s (0 = unlimited)")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    image = Image.open(args.image)
+    image.load()
+    server = start_model_server(args.bandwidth)
+    url = f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+
+    print(f"{'config':<28} {'payload':>10} {'request':>10} {'saved':>8} {'prep ms':>8} {'upload ms':>10}")
+    for name, config in CONFIGS.items():
+        prep = send = 0.0
+        for _ in range(args.repeat):
+            prepared = prepare_image(image, config)
+            prep += prepared.seconds
+            start = time.perf_counter()
+            request_bytes = upload(url, prepared)
+            send += time.perf_counter() - start
+        print(
+            f"{name:<28} {format_bytes(len(prepared.data)):>10} {format_bytes(request_bytes):>10} "
+            f"{100 * prepared.saved_bytes / prepared.original_bytes:>7.0f}% "
+            f"{1000 * prep / args.repeat:>8.1f} {1000 * send / args.repeat:>10.1f}"
+        )
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# Latency and success rate of the provider layer against fake Together and
+# Gemini servers that inject latency, hangs, 503s and 429s: a single
+# attempt with no timeout (what the SDK calls did) against ResilientBackend
+# with timeouts and retries, and with failover when the primary is down.
+#
+#   python -m benchmarks.providers --pages 300 --workers 16
+#
+import argparse
+import time
+
+from benchmarks.fake_provider import start_fake_provider
+from pipeline import process_in_order
+from preprocess import PreparedImage
+from providers import GeminiClient, ResilientBackend, ResilientProvider, RetryPolicy, TogetherClient
+
+
+def base_url(server, path):
+    return f"http://127.0.0.1:{server.server_port}{path}"
+
+
+def make_backend(primary, fallback, attempts, timeout, rate, failover):
+    retry = RetryPolicy(max_attempts=attempts, base_delay=0.1, max_delay=2.0)
+    providers = [ResilientProvider(
+        TogetherClient("key", base_url=base_url(primary, "/v1")), rate=rate, timeout=timeout, retry=retry
+    )]
+    if failover:
+        providers.append(ResilientProvider(
+            GeminiClient("key", base_url=base_url(fallback, "/v1beta")), rate=rate, timeout=timeout, retry=retry
+        ))
+    return ResilientBackend(providers)
+
+
+def run(backend, pages, workers):
+    def call(page):
+        image = PreparedImage(page.to_bytes(4, "big"), "image/png")
+        start = time.perf_counter()
+        try:
+            backend.generate("prompt", image)
+            ok = True
+        except Exception:
+            ok = False
+        return ok, time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = [result for _, result in process_in_order(range(pages), call, workers)]
+    elapsed = time.perf_counter() - start
+    backend.close()
+    latencies = sorted(seconds for _, seconds in results)
+    succeeded = sum(ok for ok, _ in results)
+    return {
+        "success": succeeded / pages,
+        "p50": latencies[len(latencies) // 2],
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "seconds": elapsed,
+        "retries": backend.stats["retries"],
+        "failovers": backend.stats["failovers"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark provider retries, timeouts and failover")
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.1, help="median fake provider latency (s)")
+    parser.add_argument("--error-rate", type=float, default=0.1)
+    parser.add_argument("--throttle-rate", type=float, default=0.05)
+    parser.add_argument("--hang-rate", type=float, default=0.02)
+    parser.add_argument("--hang-seconds", type=float, default=10.0)
+    parser.add_argument("--timeout", type=float, default=1.0)
+    parser.add_argument("--rate", type=float, default=0, help="requests/s per provider (0 = unlimited)")
+    args = parser.parse_args()
+
+    def flaky():
+        return start_fake_provider(
+            latency=args.latency, error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+            hang_rate=args.hang_rate, hang_seconds=args.hang_seconds, retry_after=0.2,
+        )
+
+    scenarios = {
+        "single attempt, no timeout": lambda: make_backend(flaky(), None, 1, args.hang_seconds * 2, args.rate, False),
+        "retries + timeout": lambda: make_backend(flaky(), None, 4, args.timeout, args.rate, False),
+        "primary down, no failover": lambda: make_backend(
+            start_fake_provider(latency=args.latency, down=True), None, 4, args.timeout, args.rate, False
+        ),
+        "primary down, failover": lambda: make_backend(
+            start_fake_provider(latency=args.latency, down=True), flaky(), 4, args.timeout, args.rate, True
+        ),
+    }
+
+    print(f"{'scenario':<28} {'success':>8} {'p50 ms':>8} {'p99 ms':>9} {'seconds':>8} {'retries':>8} {'failovers':>9}")
+    for name, make in scenarios.items():
+        r = run(make(), args.pages, args.workers)
+        print(f"{name:<28} {r['success']:>8.1%} {1000 * r['p50']:>8.0f} {1000 * r['p99']:>9.0f} "
+              f"{r['seconds']:>8.2f} {r['retries']:>8} {r['failovers']:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# A corpus of messy model responses (fences, prose, Python literals,
+# trailing commas, renamed fields, currency amounts, cut-off output) run
+# through BillRecord.from_response, against what each should come out as.
+# Prints what the previous parser made of the same corpus, parse time per
+# response, and how far into a streamed response fields can be checked.
+# Exits non-zero if any response parses differently than expected.
+#
+#   python -m benchmarks.responses
+#   python -m benchmarks.responses --verbose
+#
+import argparse
+import json
+import sys
+import time
+
+from extractor import BillRecord
+from responses import JsonStreamParser
+
+ACME = {"vendor_name": "Acme Supplies Pvt Ltd", "bill_date": "2024-03-05", "total_amount": 1200.0,
+        "invoice_number": "INV-0042"}
+CLEAN = json.dumps({**ACME, "total_amount": "1200.00"})
+
+# (name, response, expected to_dict())
+CORPUS = [
+    ("plain json", CLEAN, ACME),
+    ("json fence", f"```json\n{CLEAN}\n```", ACME),
+    ("bare fence", f"```\n{CLEAN}\n```", ACME),
+    ("fence, no newline", f"```json{CLEAN}```", ACME),
+    ("prose around", f"Here is the extracted information:\n\n{CLEAN}\n\nLet me know if you need anything else.", ACME),
+    ("prose with brackets", f"Based on the invoice [page 1], the details are: {CLEAN}", ACME),
+    ("prose with braces", f"I read the {{header}} and footer. {CLEAN}", ACME),
+    ("trailing comma", CLEAN[:-1] + ",}", ACME),
+    ("python dict",
+     "{'vendor_name': 'Acme Supplies Pvt Ltd', 'bill_date': '05/03/2024', 'total_amount': 1200, "
+     "'invoice_number': 'INV-0042'}", ACME),
+    ("python literals", '{"vendor_name": "Acme Supplies Pvt Ltd", "bill_date": None, "total_amount": 1200.0, '
+     '"invoice_number": "INV-0042"}', {k: v for k, v in ACME.items() if k != "bill_date"}),
+    ("unquoted keys", '{vendor_name: "Acme Supplies Pvt Ltd", bill_date: "2024-03-05", total_amount: "1,200.00", '
+     'invoice_number: "INV-0042"}', ACME),
+    ("comments", '{\n  "vendor_name": "Acme Supplies Pvt Ltd", // from the letterhead\n  "bill_date": "2024-03-05",\n'
+     '  "total_amount": 1200, /* incl. GST */\n  "invoice_number": "INV-0042"\n}', ACME),
+    ("smart quotes", CLEAN.replace('"', "“", 1).replace('"', "”", 1), ACME),
+    ("rupee symbol", CLEAN.replace('"1200.00"', '"₹1,200.00"'), {**ACME, "currency": "INR"}),
+    ("rs suffix", CLEAN.replace('"1200.00"', '"Rs. 1,200/-"'), {**ACME, "currency": "INR"}),
+    ("lakh grouping", CLEAN.replace('"1200.00"', '"INR 12,34,567.50"'),
+     {**ACME, "total_amount": 1234567.5, "currency": "INR"}),
+    ("dollar", CLEAN.replace('"1200.00"', '"$1,200.00"'), {**ACME, "currency": "USD"}),
+    ("euro decimal comma", CLEAN.replace('"1200.00"', '"1.200,00 €"'), {**ACME, "currency": "EUR"}),
+    ("bare thousands number", CLEAN.replace('"1200.00"', "1,200.00"), ACME),
+    ("currency field", json.dumps({**ACME, "total_amount": "1,200.00", "currency": "usd"}),
+     {**ACME, "currency": "USD"}),
+    ("renamed fields", json.dumps({"Vendor Name": "Acme Supplies Pvt Ltd", "Invoice Date": "March 5, 2024",
+                                   "Total": "1200", "Invoice No": "INV-0042"}), ACME),
+    ("camel case", json.dumps({"vendorName": "Acme Supplies Pvt Ltd", "billDate": "5 Mar 2024",
+                               "totalAmount": 1200, "invoiceNumber": "INV-0042"}), ACME),
+    ("wrapped", json.dumps({"invoice": {**ACME, "total_amount": "1200"}}), ACME),
+    ("array of one", json.dumps([{**ACME, "total_amount": "1200"}]), ACME),
+    ("extra whitespace", json.dumps({**ACME, "vendor_name": "  Acme  Supplies\nPvt Ltd ", "total_amount": " 1200 "}),
+     ACME),
+    ("placeholders", json.dumps({**ACME, "invoice_number": "N/A", "bill_date": "unknown", "total_amount": "1200"}),
+     {"vendor_name": ACME["vendor_name"], "total_amount": 1200.0}),
+    ("second object ignored", f"{CLEAN}\n\nAlternatively: {{\"vendor_name\": \"Other\"}}", ACME),
+    ("cut off in a string", CLEAN[:CLEAN.index("INV-") + 3], {k: v for k, v in ACME.items() if k != "invoice_number"}),
+    ("cut off after a value", CLEAN[:CLEAN.index(', "invoice_number"')],
+     {k: v for k, v in ACME.items() if k != "invoice_number"}),
+    ("refusal", "I'm sorry, I can't read the text in this image.", {"error": "Invalid JSON response from AI model."}),
+    ("empty object", "{}", {"error": "No bill fields in AI response."}),
+    ("empty", "", {"error": "Invalid JSON response from AI model."}),
+]
+
+
+def previous_parse(text):
+    # What the parser before this one did: strip a leading ```json and a
+    # trailing fence, json.loads, and float() on the total with commas removed
+    if text.startswith("```json"):
+        text = text.replace("```json", "").replace("\n```", "").strip()
+    data = json.loads(text)
+    if not isinstance(data, dict):
+        raise ValueError("not an object")
+    fields = {k: data[k] for k in ACME if k in data}
+    fields["total_amount"] = float(str(fields.get("total_amount", "0.0")).replace(",", ""))
+    return fields
+
+
+def previous_ok(text, expected):
+    try:
+        fields = previous_parse(text)
+    except (ValueError, TypeError):
+        return "error" in expected
+    return "error" not in expected and fields.get("total_amount") == expected.get("total_amount") \
+        and all(fields.get(k) == expected.get(k) for k in ("vendor_name", "invoice_number"))
+
+
+def streamed_reads(text, chunk_size=4):
+    # (characters read when the first field is known, when the record is
+    # complete) for a response fed a few characters at a time like model
+    # tokens; the rest of the response needn't be read
+    parser = JsonStreamParser()
+    first = None
+    for end in range(chunk_size, len(text) + chunk_size, chunk_size):
+        parser.feed(text[end - chunk_size:end])
+        if first is None and parser.fields:
+            first = min(end, len(text))
+        if parser.done:
+            return first or min(end, len(text)), min(end, len(text))
+    return first or len(text), len(text)
+
+
+def timed(func, texts, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            func(text)
+    return (time.perf_counter() - start) / repeat / len(texts) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and time model response parsing")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    failures = 0
+    previous = 0
+    for name, text, expected in CORPUS:
+        got = BillRecord.from_response(text).to_dict()
+        ok = got == expected
+        failures += not ok
+        previous += previous_ok(text, expected)
+        if args.verbose or not ok:
+            print(f"{'ok  ' if ok else 'FAIL'} {name:<24} {got}" + ("" if ok else f"\n     expected {expected}"))
+
+    def previous_safe(text):
+        try:
+            previous_parse(text)
+        except (ValueError, TypeError):
+            pass
+
+    print(f"{len(CORPUS)} responses: {len(CORPUS) - failures} parsed as expected, "
+          f"previous parser {previous}")
+    texts = [text for _, text, _ in CORPUS]
+    print(f"parse time: {timed(BillRecord.from_response, texts, args.repeat):.1f} µs/response over the corpus, "
+          f"{timed(BillRecord.from_response, [CLEAN], args.repeat):.1f} µs for plain JSON "
+          f"(previous parser {timed(previous_safe, texts, args.repeat):.1f} µs)")
+    streamed = [(streamed_reads(text), len(text)) for _, text, expected in CORPUS if "error" not in expected]
+    total = sum(length for _, length in streamed)
+    first = sum(reads[0] for reads, _ in streamed) / total
+    complete = sum(reads[1] for reads, _ in streamed) / total
+    print(f"streamed: first field checked after {first:.0%} of the characters, "
+          f"record complete after {complete:.0%}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+# Resident memory while streaming a large PDF through render -> extract with
+# a slow extraction stage, for several memory caps. Each run is a separate
+# process; the run fails if the budget's high-water mark exceeds its cap.
+#
+#   python -m benchmarks.streaming --pages 60 --scale 2.0 --caps 0 64 256
+#
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from PIL import Image, ImageDraw
+
+from extractor import Extractor, FakeBackend
+from pipeline import RENDER_LOCK
+from rendering import MemoryBudget, limit_malloc_arenas, estimate_page_bytes, iter_page_results, open_pdf
+
+
+def make_pdf(path, pages):
+    image = Image.new("RGB", (595, 842), "white")
+    ImageDraw.Draw(image).text((40, 40), "Invoice", fill="black")
+    image.save(path, save_all=True, append_images=[image] * (pages - 1))
+
+
+def peak_rss_kb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    return 0
+
+
+def child(path, cap_mb, scale, workers, latency):
+    limit_malloc_arenas()
+    extractor = Extractor(FakeBackend(latency=latency))
+    budget = MemoryBudget(cap_mb * 1024 * 1024)
+    start = time.perf_counter()
+    pdf = open_pdf(path)
+    results = iter_page_results(pdf, extractor.extract, max_workers=workers, scale=scale, budget=budget)
+    for _, artifact, _ in results:
+        with RENDER_LOCK:
+            artifact.release()
+    print(json.dumps({
+        "seconds": time.perf_counter() - start,
+        "rss_peak_kb": peak_rss_kb(),
+        "budget_peak": budget.peak,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark streaming PDF rendering under a memory cap")
+    parser.add_argument("--pages", type=int, default=60)
+    parser.add_argument("--scale", type=float, default=300 / 72, help="render scale (300 DPI by default)")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.05, help="fake model latency in seconds")
+    parser.add_argument("--caps", type=int, nargs="+", default=[0, 128, 512], help="caps in MB (0 = unlimited)")
+    parser.add_argument("--child", nargs=5, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        path, cap, scale, workers, latency = args.child
+        child(path, int(cap), float(scale), int(workers), float(latency))
+        return
+
+    page_mb = estimate_page_bytes(595, 842, args.scale) / 1024 / 1024
+    print(f"{args.pages} pages, ~{page_mb:.0f} MB estimated per rendered page")
+    print(f"{'cap':>8} {'seconds':>8} {'budget peak':>12} {'peak RSS':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "large.pdf")
+        make_pdf(path, args.pages)
+        for cap in args.caps:
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.streaming", "--child", path, str(cap),
+                 str(args.scale), str(args.workers), str(args.latency)],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            result = json.loads(output)
+            budget_mb = result["budget_peak"] / 1024 / 1024
+            print(
+                f"{cap or 'none':>8} {result['seconds']:>8.2f} {budget_mb:>9.0f} MB "
+                f"{result['rss_peak_kb'] / 1024:>7.0f} MB"
+            )
+            # A single page larger than the cap is still admitted on its own
+            if cap and budget_mb > max(cap, page_mb):
+                sys.exit(f"budget peak {budget_mb:.0f} MB exceeded the {cap} MB cap")
+
+
+if __name__ == "__main__":
+    main()
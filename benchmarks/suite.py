@@ -0,0 +1,443 @@
+# The benchmark suite: four scenarios covering the app end to end, each in
+# a process of its own against the fake provider server, with the results
+# written as JSON so runs can be compared across commits.
+#
+#   single_image  one uploaded scan through the app's path, at several resolutions
+#   pdf_100       a 100-page scanned PDF through the page pipeline, per page and grouped
+#   bulk_folder   batch.py over a folder of mixed PDFs and photos
+#   view_bills    View Bills page loads, search and CSV export at 1M rows
+#
+#   python -m benchmarks.suite                  # writes benchmarks/results/<commit>.json
+#   python -m benchmarks.suite --quick --scenarios single_image pdf_100
+#   python -m benchmarks.suite --compare benchmarks/results/1c4d91f.json
+#   python -m benchmarks.suite --compare old.json new.json --threshold 5
+#
+# Inputs are generated from fixed seeds and the fake provider's latency is
+# seeded too, so two runs on the same machine differ by what the code does.
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from PIL import Image
+
+from batch import BatchRunner, find_files
+from benchmarks.db_queries import fill
+from benchmarks.fake_provider import start_fake_provider
+from benchmarks.invoices import corpus, invoice_lines, scanned_image, scanned_pdf, write_corpus
+from benchmarks.memory import peak_rss_kb
+from benchmarks.view_bills import PAGE_SIZE, new_page_load
+from database import BillDatabase
+from dedup import DedupIndex
+from export import export_bills
+from extractor import Extractor
+from jobs import percentile
+from multibill import GROUP_SIZE, GroupExtractor
+from pipeline import RENDER_LOCK
+from preprocess import PageArtifact
+from providers import create_resilient_backend
+from rendering import MemoryBudget, iter_group_results, iter_page_results, open_pdf
+from telemetry import Telemetry, bind
+from textlayer import TextLayerParser
+
+RESULTS_DIR = Path("benchmarks/results")
+FORMAT_VERSION = 1
+API_PATHS = {"together": "/v1", "gemini": "/v1beta"}
+OPTIONS = {
+    "seed": 0,
+    "provider": "together",
+    "latency": 0.5,
+    "jitter": 0.5,
+    "dpis": [100, 150, 300],
+    "single_repeat": 10,
+    "pdf_pages": 100,
+    "pdf_dpi": 150,
+    "workers": 4,
+    "max_page_memory_mb": 256,
+    "bulk_files": 40,
+    "bulk_max_pages": 8,
+    "bulk_workers": 8,
+    "rows": 1_000_000,
+    "view_repeat": 5,
+}
+# Smaller inputs for a quick check; not comparable with full runs
+QUICK = {"dpis": [150], "single_repeat": 3, "pdf_pages": 20, "bulk_files": 10, "rows": 100_000, "view_repeat": 3}
+# Metrics where a bigger number is better; for all the others smaller is
+HIGHER_IS_BETTER = ("per_second",)
+
+
+def make_backend(options):
+    provider = options["provider"]
+    return create_resilient_backend(
+        {provider: "benchmark"}, rate=0,
+        base_urls={provider: options["base_url"] + API_PATHS[provider]},
+    )
+
+
+def ms(values, p=50):
+    return round(1000 * percentile(sorted(values), p), 3)
+
+
+def stage_metrics(telemetry):
+    return {
+        stage: {"calls": calls, "total_seconds": round(seconds, 4), "p50_ms": round(1000 * p50, 3),
+                "p95_ms": round(1000 * p95, 3)}
+        for stage, calls, seconds, p50, p95, _ in telemetry.stage_summary()
+    }
+
+
+def counter_metrics(telemetry):
+    counters = telemetry.snapshot()["counters"]
+    return {
+        "model_calls": counters.get("model_calls", 0),
+        "bytes_sent_mb": round(counters.get("bytes_sent", 0) / 1024 / 1024, 3),
+        "tokens_in": counters.get("tokens_in", 0),
+        "tokens_out": counters.get("tokens_out", 0),
+    }
+
+
+def single_image(options, tmp):
+    # An uploaded PNG scan as the app handles it: decode, PNG for display,
+    # payload, model call, then the form's insert
+    backend = make_backend(options)
+    db = BillDatabase(os.path.join(tmp, "bills.db"))
+    extractor = Extractor(backend)
+    invoice, style = corpus(1, options["seed"])[0]
+    lines = invoice_lines(invoice, style)
+    telemetry = Telemetry()
+    bind(telemetry)
+    metrics = {}
+    try:
+        for dpi in options["dpis"]:
+            upload = scanned_image(lines, dpi)
+            timings = {"prepare": [], "extract": [], "store": [], "total": []}
+            for _ in range(options["single_repeat"]):
+                start = time.perf_counter()
+                artifact = PageArtifact(Image.open(io.BytesIO(upload)))
+                artifact.png
+                payload_bytes = len(artifact.prepared.data)
+                prepared = time.perf_counter()
+                record = extractor.extract(artifact)
+                extracted = time.perf_counter()
+                db.add_bill(record.invoice_number, record.vendor_name, record.total_amount or 0.0, record.bill_date)
+                end = time.perf_counter()
+                artifact.release()
+                timings["prepare"].append(prepared - start)
+                timings["extract"].append(extracted - prepared)
+                timings["store"].append(end - extracted)
+                timings["total"].append(end - start)
+            for name, values in timings.items():
+                metrics[f"{name}_ms_{dpi}dpi"] = ms(values)
+            metrics[f"total_p95_ms_{dpi}dpi"] = ms(timings["total"], 95)
+            metrics[f"upload_kb_{dpi}dpi"] = round(len(upload) / 1024, 1)
+            metrics[f"payload_kb_{dpi}dpi"] = round(payload_bytes / 1024, 1)
+    finally:
+        backend.close()
+        db.close()
+    return {"metrics": {**metrics, **counter_metrics(telemetry)}, "stages": stage_metrics(telemetry)}
+
+
+def pdf_100(options, tmp):
+    # A long scanned PDF as the app handles it: pages rendered on demand,
+    # extracted in parallel under the memory budget, shown in order; then
+    # the same PDF with GROUP_SIZE pages per model request
+    pages = options["pdf_pages"]
+    invoices = corpus(pages, options["seed"], styles=(0, 1, 2))
+    document = scanned_pdf([invoice_lines(invoice, style) for invoice, style in invoices], options["pdf_dpi"])
+    backend = make_backend(options)
+    db = BillDatabase(os.path.join(tmp, "bills.db"))
+    extractor = Extractor(backend, dedup=DedupIndex(db), text_parser=TextLayerParser())
+    budget_bytes = options["max_page_memory_mb"] * 1024 * 1024
+    telemetry = Telemetry()
+    bind(telemetry)
+    try:
+        start = time.perf_counter()
+        first_page = None
+        errors = 0
+        budget = MemoryBudget(budget_bytes)
+        pdf = open_pdf(io.BytesIO(document))
+        results = iter_page_results(pdf, extractor.extract, max_workers=options["workers"], budget=budget,
+                                    text_layer=True)
+        for _, artifact, record in results:
+            if first_page is None:
+                first_page = time.perf_counter() - start
+            artifact.png
+            errors += bool(record.error)
+            with RENDER_LOCK:
+                artifact.release()
+        seconds = time.perf_counter() - start
+        with RENDER_LOCK:
+            pdf.close()
+
+        bind(Telemetry())
+        group_extractor = GroupExtractor(Extractor(backend), GROUP_SIZE)
+        start = time.perf_counter()
+        pdf = open_pdf(io.BytesIO(document))
+        grouped_calls = 0
+        results = iter_group_results(pdf, group_extractor.extract_group, group_size=GROUP_SIZE,
+                                     max_workers=options["workers"], budget=MemoryBudget(budget_bytes))
+        for _, artifacts, _ in results:
+            grouped_calls += 1
+            with RENDER_LOCK:
+                for artifact in artifacts:
+                    artifact.release()
+        grouped_seconds = time.perf_counter() - start
+        with RENDER_LOCK:
+            pdf.close()
+    finally:
+        backend.close()
+        db.close()
+    metrics = {
+        "pages": pages,
+        "seconds": round(seconds, 3),
+        "pages_per_second": round(pages / seconds, 3),
+        "first_page_seconds": round(first_page, 3),
+        "errors": errors,
+        **counter_metrics(telemetry),
+        "budget_peak_mb": round(budget.peak / 1024 / 1024, 1),
+        "grouped_seconds": round(grouped_seconds, 3),
+        "grouped_pages_per_second": round(pages / grouped_seconds, 3),
+        "grouped_model_calls": grouped_calls,
+        "peak_rss_mb": round(peak_rss_kb() / 1024, 1),
+    }
+    return {"metrics": metrics, "stages": stage_metrics(telemetry)}
+
+
+def bulk_folder(options, tmp):
+    # batch.py's path over born-digital and scanned PDFs of 1 to
+    # bulk_max_pages pages at mixed resolutions, and single-page photos
+    folder = Path(tmp) / "corpus"
+    manifest = write_corpus(folder, options["bulk_files"], options["bulk_max_pages"], options["dpis"],
+                            options["seed"])
+    db_path = os.path.join(tmp, "bills.db")
+    backend = make_backend(options)
+    dedup = DedupIndex(BillDatabase(db_path))
+    extractor = Extractor(backend, text_parser=TextLayerParser(), dedup=dedup)
+    runner = BatchRunner(extractor, db_path=db_path, workers=options["bulk_workers"], dedup=dedup)
+    try:
+        stats = runner.run(find_files(folder))
+    finally:
+        backend.close()
+        dedup.db.close()
+    tiers = {tier: share for tier, _, share, _ in stats["tiers"]}
+    metrics = {
+        "files": len(manifest),
+        "input_mb": round(sum(entry["bytes"] for entry in manifest) / 1024 / 1024, 2),
+        "pages": stats["pages"],
+        "seconds": stats["seconds"],
+        "pages_per_second": round(stats["pages"] / stats["seconds"], 3),
+        "inserted": stats["inserted"],
+        "errors": stats["errors"],
+        "text_layer_share": round(tiers.get("text_layer", 0.0), 3),
+        **counter_metrics(runner.telemetry),
+        "peak_rss_mb": round(peak_rss_kb() / 1024, 1),
+    }
+    return {"metrics": metrics, "stages": stage_metrics(runner.telemetry)}
+
+
+def view_bills(options, tmp):
+    # The View Bills page without Streamlit's cache: first page, a search,
+    # a page halfway through, the totals, and a CSV export of everything
+    rows = options["rows"]
+    db = BillDatabase(os.path.join(tmp, "bills.db"))
+    start = time.perf_counter()
+    fill(db.conn, rows)
+    fill_seconds = time.perf_counter() - start
+
+    def repeated(func):
+        values = []
+        for _ in range(options["view_repeat"]):
+            start = time.perf_counter()
+            func()
+            values.append(time.perf_counter() - start)
+        return ms(values)
+
+    middle = rows // 2 // PAGE_SIZE * PAGE_SIZE
+    metrics = {
+        "rows": rows,
+        "fill_seconds": round(fill_seconds, 2),
+        "first_page_ms": repeated(lambda: new_page_load(db)),
+        "search_ms": repeated(lambda: new_page_load(db, "Vendor 42")),
+        "middle_page_ms": repeated(lambda: db.search_bills("", limit=PAGE_SIZE, offset=middle)),
+        "summary_ms": repeated(lambda: db.summarize_bills("")),
+    }
+    with tempfile.TemporaryFile() as f:
+        start = time.perf_counter()
+        export_bills(f, "csv", db.db_path)
+        metrics["export_csv_seconds"] = round(time.perf_counter() - start, 3)
+        metrics["export_csv_mb"] = round(f.tell() / 1024 / 1024, 1)
+    db.close()
+    metrics["peak_rss_mb"] = round(peak_rss_kb() / 1024, 1)
+    return {"metrics": metrics}
+
+
+SCENARIOS = {
+    "single_image": single_image,
+    "pdf_100": pdf_100,
+    "bulk_folder": bulk_folder,
+    "view_bills": view_bills,
+}
+
+
+def child(name, options_json):
+    # One scenario in this process; the result is the last line of output
+    options = json.loads(options_json)
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        result = SCENARIOS[name](options, tmp)
+    result["wall_seconds"] = round(time.perf_counter() - start, 3)
+    print(json.dumps(result))
+
+
+def git_revision():
+    # (commit, dirty), or (None, False) outside a git checkout
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+    return commit.strip(), bool(status.strip())
+
+
+def run_suite(names, options):
+    server = start_fake_provider(latency=options["latency"], jitter=options["jitter"], seed=options["seed"])
+    options = dict(options, base_url=f"http://127.0.0.1:{server.server_port}")
+    scenarios = {}
+    try:
+        for name in names:
+            print(f"{name}...", end=" ", flush=True)
+            process = subprocess.run(
+                [sys.executable, "-m", "benchmarks.suite", "--child", name, json.dumps(options)],
+                capture_output=True, text=True,
+            )
+            if process.returncode:
+                error = process.stderr.strip().splitlines()[-1:] or [f"exit code {process.returncode}"]
+                scenarios[name] = {"error": error[0]}
+                print(f"failed: {error[0]}")
+                continue
+            scenarios[name] = json.loads(process.stdout.strip().splitlines()[-1])
+            print(f"{scenarios[name]['wall_seconds']:.1f}s")
+    finally:
+        server.shutdown()
+    return {"provider_counts": dict(server.counts), "scenarios": scenarios}
+
+
+def print_results(results):
+    for name, scenario in results["scenarios"].items():
+        print(f"\n{name}")
+        if "error" in scenario:
+            print(f"  error: {scenario['error']}")
+            continue
+        for metric, value in scenario["metrics"].items():
+            print(f"  {metric:<28} {value:>12}")
+        if scenario.get("stages"):
+            print(f"  {'stage':<12} {'calls':>6} {'total s':>9} {'p50 ms':>9} {'p95 ms':>9}")
+            for stage, data in scenario["stages"].items():
+                print(f"  {stage:<12} {data['calls']:>6} {data['total_seconds']:>9.3f} {data['p50_ms']:>9.2f} "
+                      f"{data['p95_ms']:>9.2f}")
+
+
+def compare(baseline, current, threshold):
+    # Prints each metric of both runs; returns how many got worse by more
+    # than threshold percent
+    print(f"baseline {baseline.get('commit') or '?'}{' (dirty)' if baseline.get('dirty') else ''}, "
+          f"current {current.get('commit') or '?'}{' (dirty)' if current.get('dirty') else ''}")
+    if baseline.get("options") != current.get("options"):
+        print("warning: the runs used different options, so the numbers aren't like for like")
+    regressions = 0
+    for name, scenario in current["scenarios"].items():
+        before = baseline["scenarios"].get(name, {}).get("metrics")
+        after = scenario.get("metrics")
+        if not before or not after:
+            continue
+        print(f"\n{name}")
+        print(f"  {'metric':<28} {'baseline':>12} {'current':>12} {'change':>8}")
+        for metric, value in after.items():
+            old = before.get(metric)
+            if old is None:
+                continue
+            change = (value - old) / old * 100 if old else 0.0
+            worse = -change if metric.endswith(HIGHER_IS_BETTER) else change
+            flag = ""
+            if abs(change) > threshold:
+                flag = "worse" if worse > 0 else "better"
+                regressions += worse > 0
+            print(f"  {metric:<28} {old:>12} {value:>12} {change:>+7.1f}% {flag}")
+    print(f"\n{regressions} metrics worse by more than {threshold:g}%")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the benchmark suite and write or compare JSON results")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--quick", action="store_true", help="smaller inputs, for a quick check")
+    parser.add_argument("--latency", type=float, help=f"fake provider latency (default {OPTIONS['latency']}s)")
+    parser.add_argument("--provider", choices=list(API_PATHS), help="API shape the fake provider answers")
+    parser.add_argument("--output", help=f"results file (default {RESULTS_DIR}/<commit>.json)")
+    parser.add_argument("--compare", nargs="+", metavar="RESULTS",
+                        help="BASELINE [CURRENT]: compare two results files, or a new run with BASELINE")
+    parser.add_argument("--threshold", type=float, default=10.0, help="percent change that counts (default 10)")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="exit non-zero when a metric got worse by more than the threshold")
+    parser.add_argument("--child", nargs=2, metavar=("SCENARIO", "OPTIONS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return 0
+
+    if args.compare and len(args.compare) > 2:
+        parser.error("--compare takes a baseline and at most one other results file")
+    if args.compare and len(args.compare) == 2:
+        baseline, current = (json.loads(Path(path).read_text(encoding="utf-8")) for path in args.compare)
+        regressions = compare(baseline, current, args.threshold)
+        return 1 if regressions and args.fail_on_regression else 0
+
+    options = dict(OPTIONS, **(QUICK if args.quick else {}))
+    if args.latency is not None:
+        options["latency"] = args.latency
+    if args.provider:
+        options["provider"] = args.provider
+    commit, dirty = git_revision()
+    print(f"commit {commit[:12] if commit else '?'}{' (dirty)' if dirty else ''}, {os.cpu_count()} CPUs, "
+          f"fake provider latency {options['latency']}s")
+    results = {
+        "format_version": FORMAT_VERSION,
+        "commit": commit,
+        "dirty": dirty,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "machine": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine(),
+            "cpus": os.cpu_count(),
+        },
+        "options": options,
+        **run_suite(args.scenarios, options),
+    }
+    print_results(results)
+
+    name = f"{(commit or 'unknown')[:12]}{'-dirty' if dirty else ''}.json"
+    output = Path(args.output) if args.output else RESULTS_DIR / name
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=1) + "\n", encoding="utf-8")
+    print(f"\nresults written to {output}")
+
+    failed = [name for name, scenario in results["scenarios"].items() if "error" in scenario]
+    regressions = 0
+    if args.compare:
+        print()
+        regressions = compare(json.loads(Path(args.compare[0]).read_text(encoding="utf-8")), results, args.threshold)
+    return 1 if failed or (regressions and args.fail_on_regression) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
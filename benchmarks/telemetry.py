@@ -0,0 +1,119 @@
+# Where a batch run's time goes, stage by stage, and what the
+# instrumentation costs: a folder of born-digital and scanned PDFs through
+# BatchRunner against the fake provider server (with 503s, so retries
+# show up in the counters), under the all-threads profiler. Checks that
+# the Prometheus text is well formed and agrees with the run, and that the
+# profile saw the worker threads.
+#
+#   python -m benchmarks.telemetry --files 8 --scanned 8 --latency 0.3
+#
+import argparse
+import os
+import pstats
+import re
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from batch import BatchRunner, find_files
+from benchmarks.fake_provider import start_fake_provider
+from benchmarks.textlayer import make_folder
+from extractor import Extractor
+from providers import ResilientBackend, ResilientProvider, RetryPolicy, TogetherClient
+from telemetry import Telemetry, bind, count, profiled, prometheus_text, span
+from textlayer import TextLayerParser
+
+SAMPLE_LINE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{[a-z_]+="[^"]*"(,[a-z_]+="[^"]*")*\})? -?[0-9.e+-]+$')
+
+
+def overhead_us(repeat):
+    # Cost of one span and one counter increment, with a bound session
+    # registry as in the app (both the process-wide and the session's are updated)
+    bind(Telemetry())
+    start = time.perf_counter()
+    for _ in range(repeat):
+        with span("benchmark"):
+            pass
+    span_us = (time.perf_counter() - start) / repeat * 1e6
+    start = time.perf_counter()
+    for _ in range(repeat):
+        count("benchmark")
+    count_us = (time.perf_counter() - start) / repeat * 1e6
+    bind(None)
+    return span_us, count_us
+
+
+def check_prometheus(text, telemetry):
+    # Every sample line parses, and the histogram counts match the registry
+    problems = [line for line in text.splitlines() if line and not line.startswith("#")
+                and not SAMPLE_LINE.match(line)]
+    for stage, calls, _, _, _, _ in telemetry.stage_summary():
+        if f'bills_stage_seconds_count{{stage="{stage}"}} {calls}' not in text:
+            problems.append(f"count of {stage} missing")
+        if f'bills_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {calls}' not in text:
+            problems.append(f"+Inf bucket of {stage} wrong")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage timings and instrumentation overhead")
+    parser.add_argument("--files", type=int, default=8, help="born-digital PDFs")
+    parser.add_argument("--scanned", type=int, default=8, help="scanned PDFs")
+    parser.add_argument("--latency", type=float, default=0.3, help="fake provider latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.1, help="share of provider requests failing")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=200000)
+    args = parser.parse_args()
+
+    span_us, count_us = overhead_us(args.repeat)
+    server = start_fake_provider(latency=args.latency, error_rate=args.error_rate)
+    retry = RetryPolicy(max_attempts=4, base_delay=0.05, max_delay=0.5)
+    backend = ResilientBackend([ResilientProvider(
+        TogetherClient("key", base_url=f"http://127.0.0.1:{server.server_port}/v1"), rate=0, retry=retry
+    )])
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            folder = Path(tmp) / "in"
+            folder.mkdir()
+            make_folder(folder, args.files, args.scanned)
+            extractor = Extractor(backend, text_parser=TextLayerParser())
+            runner = BatchRunner(extractor, db_path=os.path.join(tmp, "bills.db"), workers=args.workers)
+            profile_path = os.path.join(tmp, "run.prof")
+            with profiled(profile_path):
+                stats = runner.run(find_files(folder))
+            profile = pstats.Stats(profile_path)
+    finally:
+        backend.close()
+        server.shutdown()
+
+    telemetry = runner.telemetry
+    summary = telemetry.stage_summary()
+    spans = sum(calls for _, calls, _, _, _, _ in summary)
+    print(f"{stats['pages']} pages ({args.files} born-digital, {args.scanned} scanned PDFs) in "
+          f"{stats['seconds']:.2f}s, {args.workers} workers, model latency {args.latency}s, {args.error_rate:.0%} failing requests")
+    print(f"{'stage':<11} {'calls':>6} {'total s':>8} {'share':>6} {'p50 ms':>8} {'p95 ms':>8}")
+    total = sum(seconds for _, _, seconds, _, _, _ in summary) or 1e-9
+    for stage, calls, seconds, p50, p95, _ in summary:
+        print(f"{stage:<11} {calls:>6} {seconds:>8.2f} {seconds / total:>6.1%} {1000 * p50:>8.1f} {1000 * p95:>8.1f}")
+    counters = telemetry.snapshot()["counters"]
+    print("counters: " + ", ".join(f"{name} {value}" for name, value in sorted(counters.items())))
+    print(f"overhead: {span_us:.2f} µs per span, {count_us:.2f} µs per counter; {spans} spans in this run "
+          f"cost ~{spans * span_us / 1000:.1f} ms of {stats['seconds'] * 1000 * args.workers:.0f} worker-ms")
+
+    problems = check_prometheus(prometheus_text(telemetry), telemetry)
+    # The profile has to cover the pipeline's worker threads, not just this one
+    profiled_functions = {name for _, _, name in profile.stats}
+    for function in ("render_page", "extract", "add_bills"):
+        if function not in profiled_functions:
+            problems.append(f"{function} missing from the profile")
+    if not counters.get("retries"):
+        problems.append("no retries counted")
+    for problem in problems:
+        print(f"FAIL {problem}")
+    print(f"prometheus text and profile: {'ok' if not problems else f'{len(problems)} problems'}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
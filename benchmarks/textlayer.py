@@ -0,0 +1,87 @@
+# Tier hit rates and per-page latency of the text-layer fast path on a mix
+# of born-digital PDFs (four label styles, one of which the rules can't
+# read) and scanned PDFs, against a fake model with realistic latency. Also
+# checks the locally parsed fields against the ground truth.
+#
+#   python -m benchmarks.textlayer --files 40 --scanned 10 --latency 0.8
+#
+import argparse
+import os
+import tempfile
+from pathlib import Path
+
+from batch import BatchRunner, find_files
+from benchmarks.invoices import corpus, invoice_lines, scanned_pdf, text_pdf
+from database import BillDatabase
+from extractor import Extractor, FakeBackend
+from textlayer import TextLayerParser
+
+PAGES_PER_FILE = 5
+
+
+def make_folder(folder, files, scanned, seed=0):
+    invoices = corpus((files + scanned) * PAGES_PER_FILE, seed)
+    truth = {}
+    for index in range(files + scanned):
+        batch = invoices[index * PAGES_PER_FILE:(index + 1) * PAGES_PER_FILE]
+        pages = [invoice_lines(invoice, style) for invoice, style in batch]
+        if index < files:
+            data = text_pdf(pages)
+            for invoice, style in batch:
+                truth[invoice["invoice_number"]] = invoice
+        else:
+            data = scanned_pdf(pages)
+        (folder / f"{'digital' if index < files else 'scanned'}_{index:04d}.pdf").write_bytes(data)
+    return truth
+
+
+def check_accuracy(db_path, truth):
+    # Fields of every text-layer row that match the ground truth
+    db = BillDatabase(db_path)
+    fields = checked = 0
+    for bill in db.search_bills("", limit=None):
+        invoice = truth.get(bill["invoice_number"])
+        if invoice is None:
+            continue
+        checked += 1
+        fields += (bill["company_name"] == invoice["vendor_name"])
+        fields += (bill["bill_date"] == invoice["bill_date"])
+        fields += (abs(bill["total_cost"] - float(invoice["total_amount"])) < 0.005)
+        fields += 1  # matched on invoice_number
+    db.close()
+    return checked, fields / (4 * checked) if checked else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the text-layer extraction tier")
+    parser.add_argument("--files", type=int, default=40, help="born-digital PDFs")
+    parser.add_argument("--scanned", type=int, default=10, help="scanned PDFs (no text layer)")
+    parser.add_argument("--latency", type=float, default=0.8, help="fake model latency in seconds")
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = Path(tmp) / "invoices"
+        folder.mkdir()
+        truth = make_folder(folder, args.files, args.scanned)
+        pages = (args.files + args.scanned) * PAGES_PER_FILE
+        print(f"{pages} pages: {args.files * PAGES_PER_FILE} born-digital (1 in 4 in an unreadable layout), "
+              f"{args.scanned * PAGES_PER_FILE} scanned; model latency {args.latency:g}s")
+
+        for name, text_parser in (("vision model only", None), ("text layer first", TextLayerParser())):
+            db_path = os.path.join(tmp, f"{name}.db")
+            backend = FakeBackend(latency=args.latency)
+            extractor = Extractor(backend, text_parser=text_parser)
+            runner = BatchRunner(extractor, db_path=db_path, workers=args.workers)
+            stats = runner.run(find_files(folder))
+            print(f"\n{name}: {stats['seconds']:.1f}s, {pages / stats['seconds']:.1f} pages/s, "
+                  f"{backend.calls} model calls")
+            for tier, count, share, avg_ms in stats["tiers"]:
+                print(f"  {tier:<12} {count:>5} pages {share:>7.1%} {avg_ms:>9.2f} ms/page")
+            if text_parser is not None:
+                checked, accuracy = check_accuracy(db_path, truth)
+                print(f"  text-layer rows checked against ground truth: {checked}, fields correct {accuracy:.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# View Bills page load at different table sizes: the old full-table read
+# into pandas versus the paginated page (data version + SQL summary + one
+# page of rows).
+#
+#   python -m benchmarks.view_bills --rows 1000 100000 1000000
+#
+import argparse
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from benchmarks.db_queries import fill
+from database import BillDatabase
+
+PAGE_SIZE = 50
+
+
+def old_page_load(db):
+    # get_bills() + conversions + metric + CSV as the page used to do
+    with db.connection() as conn:
+        df = pd.read_sql_query("""
+            SELECT invoice_number, company_name, total_cost, bill_date
+            FROM bills ORDER BY bill_date DESC
+        """, conn)
+    df['bill_date'] = pd.to_datetime(df['bill_date'])
+    df['total_cost'] = pd.to_numeric(df['total_cost'], errors='coerce')
+    df['total_cost'].sum()
+    df.to_csv(index=False).encode('utf-8')
+
+
+def new_page_load(db, search_term=""):
+    db.data_version()
+    db.summarize_bills(search_term)
+    bills = db.search_bills(search_term, limit=PAGE_SIZE, offset=0)
+    df = pd.DataFrame.from_records(bills, columns=["invoice_number", "company_name", "total_cost", "bill_date"])
+    df['bill_date'] = pd.to_datetime(df['bill_date'], errors='coerce')
+
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark View Bills page loads")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'rows':>9} {'old ms':>9} {'new ms':>8} {'new search ms':>14}")
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = BillDatabase(os.path.join(tmp, "bills.db"))
+            fill(db.conn, rows)
+            old = timed(lambda: old_page_load(db), args.repeat)
+            new = timed(lambda: new_page_load(db), args.repeat)
+            search = timed(lambda: new_page_load(db, "Vendor 42"), args.repeat)
+            db.close()
+        print(f"{rows:>9} {1000 * old:>9.1f} {1000 * new:>8.2f} {1000 * search:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,69 +1,466 @@
+import logging
 import sqlite3
 import os
 import json
-from datetime import datetime
+import re
+import threading
+from contextlib import contextmanager
+
+from dateutil import parser as date_parser
+
+from telemetry import count, log_event, span
+
+DEFAULT_DB_PATH = "bills.db"
+
+# Applied to every connection: WAL lets the View Bills page read while the
+# uploader or a batch job writes, NORMAL sync is safe under WAL and avoids
+# an fsync per commit
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA busy_timeout=5000",
+)
+
+BILL_COLUMNS = ("invoice_number", "company_name", "total_cost", "bill_date")
+RESULT_COLUMNS = ("id",) + BILL_COLUMNS + ("upload_date",)
+SELECT_COLUMNS = ", ".join(RESULT_COLUMNS)
+# How many of a search's newest matches are ranked by relevance, see search_bills
+SEARCH_RANK_WINDOW = 200
+
+ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+YEAR_FIRST = re.compile(r"^\d{4}[-/.]")
+
+
+def normalize_date(value):
+    # Bill dates are stored as YYYY-MM-DD so they sort and range-scan as
+    # text. Day-first is assumed for ambiguous dates like 03/04/2024, as on
+    # the invoices we receive. Anything unparseable is kept as written,
+    # a blank date is stored as NULL.
+    if value is None:
+        return None
+    text = str(value).strip()
+    if not text:
+        return None
+    if ISO_DATE.match(text):
+        return text
+    year_first = bool(YEAR_FIRST.match(text))
+    try:
+        parsed = date_parser.parse(text, dayfirst=not year_first, yearfirst=year_first)
+    except (ValueError, OverflowError):
+        return text
+    return parsed.date().isoformat()
+
+
+def _table_columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _create_bills(conn):
+    # The uploader created bills with bill_date, the old BillDatabase with
+    # upload_date; whichever ran first won. Start fresh databases on the
+    # unified layout, existing ones are rebuilt by the next migration.
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS bills (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        invoice_number TEXT NOT NULL,
+        company_name TEXT NOT NULL,
+        total_cost REAL NOT NULL,
+        bill_date DATE,
+        upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+
+def _unify_bills_columns(conn):
+    columns = _table_columns(conn, "bills")
+    if {"bill_date", "upload_date"} <= columns:
+        return
+    # SQLite can't ADD COLUMN with a CURRENT_TIMESTAMP default, so rebuild
+    # The upload-only layout never stored a bill date; it stays unknown
+    # rather than being taken from the upload time
+    bill_date = "bill_date" if "bill_date" in columns else "NULL"
+    upload_date = "upload_date" if "upload_date" in columns else "CURRENT_TIMESTAMP"
+    conn.execute("ALTER TABLE bills RENAME TO bills_old")
+    _create_bills(conn)
+    conn.execute(f'''
+    INSERT INTO bills (id, invoice_number, company_name, total_cost, bill_date, upload_date)
+    SELECT id, invoice_number, company_name, total_cost, {bill_date}, {upload_date} FROM bills_old
+    ''')
+    conn.execute("DROP TABLE bills_old")
+
+
+def _normalize_bill_dates(conn):
+    rows = conn.execute(
+        "SELECT id, bill_date FROM bills WHERE bill_date IS NOT NULL AND bill_date NOT GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'"
+    ).fetchall()
+    updates = [(normalize_date(bill_date), id) for id, bill_date in rows]
+    conn.executemany("UPDATE bills SET bill_date = ? WHERE id = ?", updates)
+
+
+def _index_bills(conn):
+    # total_cost rides along so date-range totals never touch the table
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_bills_bill_date ON bills (bill_date, total_cost)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_bills_company_name ON bills (company_name)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_bills_invoice_number ON bills (invoice_number)")
+
+
+def _create_bills_fts(conn):
+    # External-content FTS5 index over vendor name and invoice number, kept
+    # in sync with bills by triggers. '-', '_' and '/' are part of tokens so
+    # invoice numbers like INV-2024/0042 stay searchable as one term.
+    conn.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS bills_fts USING fts5(
+        company_name,
+        invoice_number,
+        content='bills',
+        content_rowid='id',
+        tokenize="unicode61 tokenchars '-_/'",
+        prefix='2 3'
+    )
+    ''')
+    # Separate execute() calls: executescript() would commit the migration
+    for trigger in (
+        '''
+        CREATE TRIGGER IF NOT EXISTS bills_fts_insert AFTER INSERT ON bills BEGIN
+            INSERT INTO bills_fts (rowid, company_name, invoice_number)
+            VALUES (new.id, new.company_name, new.invoice_number);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS bills_fts_delete AFTER DELETE ON bills BEGIN
+            INSERT INTO bills_fts (bills_fts, rowid, company_name, invoice_number)
+            VALUES ('delete', old.id, old.company_name, old.invoice_number);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS bills_fts_update AFTER UPDATE ON bills BEGIN
+            INSERT INTO bills_fts (bills_fts, rowid, company_name, invoice_number)
+            VALUES ('delete', old.id, old.company_name, old.invoice_number);
+            INSERT INTO bills_fts (rowid, company_name, invoice_number)
+            VALUES (new.id, new.company_name, new.invoice_number);
+        END
+        ''',
+    ):
+        conn.execute(trigger)
+    conn.execute("INSERT INTO bills_fts (bills_fts) VALUES ('rebuild')")
+
+
+def _create_bill_stats(conn):
+    # Running count/total of the whole table so the unfiltered View Bills
+    # summary is O(1), plus a version that changes on every write, used to
+    # invalidate cached query results (also for writes from other processes)
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS bill_stats (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        row_count INTEGER NOT NULL,
+        total_cost REAL NOT NULL,
+        version INTEGER NOT NULL
+    )
+    ''')
+    conn.execute('''
+    INSERT OR REPLACE INTO bill_stats (id, row_count, total_cost, version)
+    SELECT 1, COUNT(*), COALESCE(SUM(total_cost), 0), 0 FROM bills
+    ''')
+    for trigger in (
+        '''
+        CREATE TRIGGER IF NOT EXISTS bill_stats_insert AFTER INSERT ON bills BEGIN
+            UPDATE bill_stats SET row_count = row_count + 1,
+                total_cost = total_cost + new.total_cost, version = version + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS bill_stats_delete AFTER DELETE ON bills BEGIN
+            UPDATE bill_stats SET row_count = row_count - 1,
+                total_cost = total_cost - old.total_cost, version = version + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS bill_stats_update AFTER UPDATE ON bills BEGIN
+            UPDATE bill_stats SET total_cost = total_cost - old.total_cost + new.total_cost,
+                version = version + 1;
+        END
+        ''',
+    ):
+        conn.execute(trigger)
+
+
+def _unique_vendor_invoice(conn):
+    # One row per invoice: vendor names compare case- and space-insensitively,
+    # bills without an invoice number are never considered duplicates.
+    # Repeats already in the table keep their first insert in bills; the
+    # others are moved to bills_duplicates, not deleted, so nothing a user
+    # entered is lost and they can be reviewed or restored.
+    repeats = '''
+    invoice_number != '' AND id NOT IN (
+        SELECT MIN(id) FROM bills WHERE invoice_number != ''
+        GROUP BY lower(trim(company_name)), invoice_number
+    )
+    '''
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS bills_duplicates (
+        id INTEGER PRIMARY KEY,
+        invoice_number TEXT NOT NULL,
+        company_name TEXT NOT NULL,
+        total_cost REAL NOT NULL,
+        bill_date DATE,
+        upload_date TIMESTAMP,
+        moved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    moved = conn.execute(f'''
+    INSERT INTO bills_duplicates (id, invoice_number, company_name, total_cost, bill_date, upload_date)
+    SELECT id, invoice_number, company_name, total_cost, bill_date, upload_date FROM bills WHERE {repeats}
+    ''').rowcount
+    conn.execute(f"DELETE FROM bills WHERE {repeats}")
+    if moved:
+        log_event("bills_duplicates_moved", level=logging.WARNING, rows=moved, table="bills_duplicates")
+    conn.execute('''
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_bills_vendor_invoice
+    ON bills (lower(trim(company_name)), invoice_number)
+    WHERE invoice_number != ''
+    ''')
+
+
+def _create_dedup_index(conn):
+    # Hashes of ingested files and extracted pages, see dedup.py
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS file_hashes (
+        sha256 TEXT PRIMARY KEY,
+        file_name TEXT,
+        pages INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS page_digests (
+        sha256 TEXT PRIMARY KEY,
+        response TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+
+def _create_jobs(conn):
+    # Background extraction jobs, see jobs.py. Times are Unix seconds so
+    # waits and run times are plain subtraction.
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        status TEXT NOT NULL DEFAULT 'queued',
+        file_name TEXT NOT NULL,
+        file_path TEXT NOT NULL,
+        options TEXT NOT NULL DEFAULT '{}',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        worker TEXT,
+        pages INTEGER,
+        pages_done INTEGER NOT NULL DEFAULT 0,
+        bills_inserted INTEGER NOT NULL DEFAULT 0,
+        result TEXT,
+        error TEXT,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        heartbeat_at REAL,
+        finished_at REAL
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_finished_at ON jobs (finished_at)")
+
+
+def fts_query(search_term):
+    # Every word the user typed must prefix-match a token, in any order.
+    # Words are quoted so characters like '-' or ':' aren't FTS syntax.
+    words = search_term.split()
+    return " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+
+
+# Schema version N is reached by running MIGRATIONS[:N]; the current
+# version is kept in PRAGMA user_version. Only ever append to this list.
+MIGRATIONS = [
+    _create_bills,
+    _unify_bills_columns,
+    _normalize_bill_dates,
+    _index_bills,
+    _create_bills_fts,
+    _create_bill_stats,
+    _unique_vendor_invoice,
+    _create_dedup_index,
+    _create_jobs,
+]
+
+
+def migrate(conn, target=None):
+    target = len(MIGRATIONS) if target is None else target
+    (version,) = conn.execute("PRAGMA user_version").fetchone()
+    for number in range(version, target):
+        # Explicit BEGIN so the DDL in a migration is rolled back with it
+        conn.execute("BEGIN")
+        try:
+            MIGRATIONS[number](conn)
+            conn.execute(f"PRAGMA user_version = {number + 1}")
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+    return max(version, target)
+
+
+def connect(db_path=DEFAULT_DB_PATH):
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
 
 class BillDatabase:
-    def __init__(self):
-        self.db_path = "bills.db"
+    # One long-lived connection per database, shared by every caller in the
+    # process (the UI keeps the instance in st.cache_resource). Access is
+    # serialized with a lock, so Streamlit sessions and worker threads can
+    # share it.
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        self.db_path = db_path
+        self.conn = connect(db_path)
+        self.lock = threading.RLock()
         self.setup_database()
 
+    @contextmanager
+    def connection(self):
+        # For callers that need the raw connection, e.g. pandas.read_sql_query
+        with self.lock:
+            yield self.conn
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
     def setup_database(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Create bills table with only essential fields
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS bills (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            invoice_number TEXT NOT NULL,
-            company_name TEXT NOT NULL,
-            total_cost REAL NOT NULL,
-            upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        ''')
-        
-        conn.commit()
-        conn.close()
-
-    def add_bill(self, invoice_number, company_name, total_cost):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-        INSERT INTO bills (invoice_number, company_name, total_cost)
-        VALUES (?, ?, ?)
-        ''', (invoice_number, company_name, total_cost))
-        
-        conn.commit()
-        conn.close()
+        with self.lock:
+            migrate(self.conn)
+
+    def add_bill(self, invoice_number, company_name, total_cost, bill_date=None):
+        # An unknown bill date stays NULL rather than becoming the upload date
+        bill_date = normalize_date(bill_date)
+        # False when this vendor's invoice number is already in the table
+        with span("store"), self.lock, self.conn:
+            cursor = self.conn.execute('''
+            INSERT INTO bills (invoice_number, company_name, total_cost, bill_date)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT DO NOTHING
+            ''', (invoice_number, company_name, total_cost, bill_date))
+        count("rows_inserted", cursor.rowcount)
+        return cursor.rowcount == 1
+
+    def add_bills(self, records):
+        # Bulk insert in a single transaction. Records are
+        # (invoice_number, company_name, total_cost, bill_date) tuples or
+        # dicts with those keys. Returns how many were new; repeats of an
+        # invoice already in the table are skipped.
+        rows = [
+            tuple(record[column] for column in BILL_COLUMNS) if isinstance(record, dict) else tuple(record)
+            for record in records
+        ]
+        rows = [(invoice, company, total, normalize_date(bill_date)) for invoice, company, total, bill_date in rows]
+        if not rows:
+            return 0
+        with span("store", rows=len(rows)), self.lock, self.conn:
+            cursor = self.conn.executemany('''
+            INSERT INTO bills (invoice_number, company_name, total_cost, bill_date)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT DO NOTHING
+            ''', rows)
+        count("rows_inserted", cursor.rowcount)
+        return cursor.rowcount
 
     def get_all_bills(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM bills ORDER BY upload_date DESC')
-        bills = cursor.fetchall()
-        
-        conn.close()
-        
+        with self.lock:
+            cursor = self.conn.execute(f'''
+            SELECT {SELECT_COLUMNS} FROM bills ORDER BY bill_date DESC, id DESC
+            ''')
+            bills = cursor.fetchall()
+
         # Convert to list of dictionaries
-        columns = ['id', 'invoice_number', 'company_name', 'total_cost', 'upload_date']
-        return [dict(zip(columns, bill)) for bill in bills]
-
-    def search_bills(self, search_term):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-        SELECT * FROM bills 
-        WHERE invoice_number LIKE ? 
-        OR company_name LIKE ?
-        ORDER BY upload_date DESC
-        ''', (f'%{search_term}%', f'%{search_term}%'))
-        
-        bills = cursor.fetchall()
-        conn.close()
-        
-        columns = ['id', 'invoice_number', 'company_name', 'total_cost', 'upload_date']
-        return [dict(zip(columns, bill)) for bill in bills] 
\ No newline at end of file
+        return [dict(zip(RESULT_COLUMNS, bill)) for bill in bills]
+
+    def search_bills(self, search_term, limit=50, offset=0):
+        # Ranked prefix search over vendor name and invoice number, one page
+        # at a time (limit=None returns every match). An empty search lists
+        # the newest bills.
+        query = fts_query(search_term or "")
+        if not query:
+            with self.lock:
+                bills = self.conn.execute(f'''
+                SELECT {SELECT_COLUMNS} FROM bills
+                ORDER BY bill_date DESC, id DESC
+                LIMIT ? OFFSET ?
+                ''', (-1 if limit is None else limit, offset)).fetchall()
+            return [dict(zip(RESULT_COLUMNS, bill)) for bill in bills]
+
+        # bm25 costs the same for every match, so a short prefix like "ve"
+        # would rank the whole table. Only the newest SEARCH_RANK_WINDOW
+        # matches are ranked; older ones follow them, newest first. The order
+        # doesn't depend on the page asked for, so paging through the
+        # results never repeats or skips a bill.
+        end = None if limit is None else offset + limit
+        columns = ", ".join(f"b.{column}" for column in RESULT_COLUMNS)
+        bills = []
+        with self.lock:
+            if offset < SEARCH_RANK_WINDOW:
+                ranked_limit = -1 if end is None else min(end, SEARCH_RANK_WINDOW) - offset
+                bills += self.conn.execute(f'''
+                SELECT {columns} FROM (
+                    SELECT rowid, rank FROM bills_fts
+                    WHERE bills_fts MATCH ?
+                    ORDER BY rowid DESC
+                    LIMIT ?
+                ) f
+                JOIN bills b ON b.id = f.rowid
+                ORDER BY f.rank, b.bill_date DESC, b.id DESC
+                LIMIT ? OFFSET ?
+                ''', (query, SEARCH_RANK_WINDOW, ranked_limit, offset)).fetchall()
+            if end is None or end > SEARCH_RANK_WINDOW:
+                skip = max(offset, SEARCH_RANK_WINDOW)
+                bills += self.conn.execute(f'''
+                SELECT {columns} FROM (
+                    SELECT rowid FROM bills_fts
+                    WHERE bills_fts MATCH ?
+                    ORDER BY rowid DESC
+                    LIMIT ? OFFSET ?
+                ) f
+                JOIN bills b ON b.id = f.rowid
+                ORDER BY b.id DESC
+                ''', (query, -1 if end is None else end - skip, skip)).fetchall()
+
+        return [dict(zip(RESULT_COLUMNS, bill)) for bill in bills]
+
+    def count_search_results(self, search_term):
+        query = fts_query(search_term or "")
+        with self.lock:
+            if not query:
+                (matches,) = self.conn.execute("SELECT row_count FROM bill_stats").fetchone()
+            else:
+                (matches,) = self.conn.execute(
+                    "SELECT COUNT(*) FROM bills_fts WHERE bills_fts MATCH ?", (query,)
+                ).fetchone()
+        return matches
+
+    def summarize_bills(self, search_term=""):
+        # (number of bills, total cost) for a search, computed in SQL
+        query = fts_query(search_term or "")
+        with self.lock:
+            if not query:
+                row = self.conn.execute("SELECT row_count, total_cost FROM bill_stats").fetchone()
+            else:
+                row = self.conn.execute('''
+                SELECT COUNT(*), COALESCE(SUM(b.total_cost), 0) FROM bills_fts
+                JOIN bills b ON b.id = bills_fts.rowid
+                WHERE bills_fts MATCH ?
+                ''', (query,)).fetchone()
+        return row[0], row[1]
+
+    def data_version(self):
+        # Changes whenever a bill is inserted, updated or deleted
+        with self.lock:
+            (version,) = self.conn.execute("SELECT version FROM bill_stats").fetchone()
+        return version
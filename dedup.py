@@ -0,0 +1,97 @@
+# Duplicate detection in front of the model, backed by tables in bills.db:
+#
+# - file_hashes: SHA-256 of every file already ingested, so the same PDF
+#   emailed twice is recognised before anything is rendered
+# - page_digests: SHA-256 of the pixels of every extracted page with the
+#   model's answer, so a page seen before (the same page in another PDF,
+#   an image re-saved under another name) reuses that answer instead of
+#   another model call
+# - the unique (vendor, invoice_number) key on bills (see database.py) that
+#   drops repeat inserts of the same invoice
+#
+# Pages only match when they are identical. Two invoices printed from one
+# template differ in a few glyphs of the number and total, no more than a
+# re-scan of the same page differs from the original, so no similarity
+# threshold tells them apart; a false match would drop a real invoice
+# without a warning. Re-scans go to the model like new pages.
+import hashlib
+import threading
+
+
+def file_digest(source, chunk_size=1024 * 1024):
+    # SHA-256 of a path or a binary file object; file objects are read in
+    # chunks and rewound afterwards
+    digest = hashlib.sha256()
+    if hasattr(source, "read"):
+        position = source.tell()
+        for chunk in iter(lambda: source.read(chunk_size), b""):
+            digest.update(chunk)
+        source.seek(position)
+    else:
+        with open(source, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def page_digest(image):
+    # SHA-256 of a PIL image's pixels (with its mode and size), whatever
+    # file format or PDF it came from
+    digest = hashlib.sha256(f"{image.mode} {image.width}x{image.height}\n".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class DedupIndex:
+    # Lookups and inserts go through the shared BillDatabase connection.
+    # stats counts what was avoided since the index was created.
+    def __init__(self, db):
+        self.db = db
+        self.stats = {"files": 0, "pages": 0, "bills": 0}
+        self._stats_lock = threading.Lock()
+
+    def count(self, kind, n=1):
+        with self._stats_lock:
+            self.stats[kind] += n
+
+    def find_file(self, digest):
+        # (file_name, pages, created_at) of the earlier ingest, or None
+        with self.db.lock:
+            return self.db.conn.execute(
+                "SELECT file_name, pages, created_at FROM file_hashes WHERE sha256 = ?", (digest,)
+            ).fetchone()
+
+    def add_file(self, digest, file_name, pages):
+        with self.db.lock, self.db.conn:
+            self.db.conn.execute(
+                "INSERT OR IGNORE INTO file_hashes (sha256, file_name, pages) VALUES (?, ?, ?)",
+                (digest, file_name, pages),
+            )
+
+    def page_signature(self, image):
+        # Accepts a PIL image or anything with one in .image (PageArtifact)
+        return page_digest(getattr(image, "image", image))
+
+    def find_page(self, signature):
+        # The stored answer for an identical page, or None
+        with self.db.lock:
+            row = self.db.conn.execute(
+                "SELECT response FROM page_digests WHERE sha256 = ?", (signature,)
+            ).fetchone()
+        if row is None:
+            return None
+        self.count("pages")
+        return row[0]
+
+    def add_page(self, signature, response):
+        with self.db.lock, self.db.conn:
+            self.db.conn.execute(
+                "INSERT OR IGNORE INTO page_digests (sha256, response) VALUES (?, ?)", (signature, response)
+            )
+
+    def summary(self):
+        stats = dict(self.stats)
+        return (
+            f"{stats['pages']} model calls avoided, {stats['files']} duplicate files, "
+            f"{stats['bills']} duplicate bills skipped"
+        )
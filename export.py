@@ -0,0 +1,175 @@
+# Streams the bills table (or the matches of a search) out of SQLite in
+# chunks, as CSV, gzip-compressed CSV or Parquet. Only one chunk of rows is
+# in memory at a time, however big the table is.
+#
+#   python export.py bills.csv
+#   python export.py march.csv.gz --search "acme"
+#   python export.py bills.parquet --db archive.db
+#   python export.py - --format csv | head
+#
+import argparse
+import csv
+import gzip
+import io
+import sys
+from datetime import date
+
+from database import BILL_COLUMNS, DEFAULT_DB_PATH, connect, fts_query, migrate
+
+CHUNK_SIZE = 10_000
+
+EXPORT_FORMATS = {
+    "csv": {"label": "CSV", "extension": ".csv", "mime_type": "text/csv"},
+    "csv.gz": {"label": "CSV (gzip)", "extension": ".csv.gz", "mime_type": "application/gzip"},
+    "parquet": {"label": "Parquet", "extension": ".parquet", "mime_type": "application/vnd.apache.parquet"},
+}
+
+
+def parquet_available():
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def available_formats():
+    return [name for name in EXPORT_FORMATS if name != "parquet" or parquet_available()]
+
+
+def format_for_path(path):
+    for name, info in sorted(EXPORT_FORMATS.items(), key=lambda item: -len(item[1]["extension"])):
+        if str(path).lower().endswith(info["extension"]):
+            return name
+    return "csv"
+
+
+def iter_bill_chunks(db_path=DEFAULT_DB_PATH, search_term="", chunk_size=CHUNK_SIZE):
+    # Lists of BILL_COLUMNS tuples, newest bill first. Uses its own
+    # connection so a long export never holds BillDatabase's lock; under WAL
+    # it reads one consistent snapshot while the uploader keeps writing.
+    query = fts_query(search_term or "")
+    columns = ", ".join(BILL_COLUMNS)
+    if query:
+        sql = f'''
+        SELECT {columns} FROM bills
+        WHERE id IN (SELECT rowid FROM bills_fts WHERE bills_fts MATCH ?)
+        ORDER BY bill_date DESC, id DESC
+        '''
+        params = (query,)
+    else:
+        sql = f"SELECT {columns} FROM bills ORDER BY bill_date DESC, id DESC"
+        params = ()
+
+    conn = connect(db_path)
+    try:
+        migrate(conn)
+        cursor = conn.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
+
+def write_csv(chunks, output):
+    # output is a binary file; the text layer is detached again at the end
+    # so the caller's file stays open
+    text = io.TextIOWrapper(output, encoding="utf-8", newline="")
+    writer = csv.writer(text)
+    writer.writerow(BILL_COLUMNS)
+    count = 0
+    for rows in chunks:
+        writer.writerows(rows)
+        count += len(rows)
+    text.flush()
+    text.detach()
+    return count
+
+
+def write_csv_gzip(chunks, output):
+    with gzip.GzipFile(fileobj=output, mode="wb") as compressed:
+        return write_csv(chunks, compressed)
+
+
+def parse_bill_date(value):
+    # Dates are stored as YYYY-MM-DD; the few kept as written on the invoice
+    # become nulls in the typed column
+    try:
+        return date.fromisoformat(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def write_parquet(chunks, output):
+    # One row group per chunk, with real date and float columns
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+
+    schema = pa.schema([
+        ("invoice_number", pa.string()),
+        ("company_name", pa.string()),
+        ("total_cost", pa.float64()),
+        ("bill_date", pa.date32()),
+    ])
+    count = 0
+    with pq.ParquetWriter(output, schema, compression="snappy") as writer:
+        for rows in chunks:
+            invoice_numbers, company_names, total_costs, bill_dates = zip(*rows)
+            writer.write_table(pa.Table.from_arrays([
+                pa.array([None if v is None else str(v) for v in invoice_numbers], pa.string()),
+                pa.array([None if v is None else str(v) for v in company_names], pa.string()),
+                pa.array(total_costs, pa.float64()),
+                pa.array([parse_bill_date(v) for v in bill_dates], pa.date32()),
+            ], schema=schema))
+            count += len(rows)
+    return count
+
+
+WRITERS = {
+    "csv": write_csv,
+    "csv.gz": write_csv_gzip,
+    "parquet": write_parquet,
+}
+
+
+def export_bills(output, format="csv", db_path=DEFAULT_DB_PATH, search_term="", chunk_size=CHUNK_SIZE):
+    # output is a path or a writable binary file. Returns the rows written.
+    if format not in WRITERS:
+        raise ValueError(f"unknown export format {format!r}")
+    if format == "parquet" and not parquet_available():
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+    chunks = iter_bill_chunks(db_path, search_term, chunk_size)
+    if hasattr(output, "write"):
+        return WRITERS[format](chunks, output)
+    with open(output, "wb") as f:
+        return WRITERS[format](chunks, f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export bills to CSV, gzip CSV or Parquet")
+    parser.add_argument("output", help="file to write, or - for stdout")
+    parser.add_argument("--format", choices=list(EXPORT_FORMATS),
+                        help="defaults to the output file's extension, else csv")
+    parser.add_argument("--search", default="", help="only export bills matching this search")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="rows read from SQLite at a time")
+    args = parser.parse_args(argv)
+
+    format = args.format or format_for_path(args.output)
+    output = sys.stdout.buffer if args.output == "-" else args.output
+    try:
+        count = export_bills(output, format, args.db, args.search, args.chunk_size)
+    except RuntimeError as e:
+        parser.error(str(e))
+    print(f"Exported {count} bills as {EXPORT_FORMATS[format]['label']}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
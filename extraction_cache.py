@@ -0,0 +1,98 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+# Raw model responses keyed by what was sent, so re-uploads and Streamlit
+# reruns don't pay for the same page twice. Lives next to bills.db.
+DEFAULT_CACHE_PATH = "extraction_cache.db"
+
+
+def make_cache_key(image_bytes, prompt, model, generation_config=None):
+    digest = hashlib.sha256()
+    digest.update(image_bytes)
+    for part in (prompt, model, json.dumps(generation_config or {}, sort_keys=True)):
+        digest.update(b"\0")
+        digest.update(part.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    def __init__(self, db_path=DEFAULT_CACHE_PATH, max_entries=5000, ttl_seconds=30 * 24 * 3600):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Shared by the page worker threads, all access goes through _lock
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS extraction_cache (
+                cache_key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_extraction_cache_last_access ON extraction_cache (last_access)"
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM extraction_cache WHERE cache_key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl_seconds and now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM extraction_cache WHERE cache_key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE extraction_cache SET last_access = ? WHERE cache_key = ?", (now, key)
+            )
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, response):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("""
+                INSERT OR REPLACE INTO extraction_cache (cache_key, response, created_at, last_access)
+                VALUES (?, ?, ?, ?)
+            """, (key, response, now, now))
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        if self.ttl_seconds:
+            self._conn.execute(
+                "DELETE FROM extraction_cache WHERE created_at < ?", (now - self.ttl_seconds,)
+            )
+        # Least recently used entries go first once the cache is over size
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM extraction_cache").fetchone()
+        if count > self.max_entries:
+            self._conn.execute("""
+                DELETE FROM extraction_cache WHERE cache_key IN (
+                    SELECT cache_key FROM extraction_cache ORDER BY last_access LIMIT ?
+                )
+            """, (count - self.max_entries,))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM extraction_cache")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM extraction_cache").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
@@ -0,0 +1,294 @@
+import hashlib
+import json
+import time
+from dataclasses import dataclass, asdict
+
+from database import normalize_date
+from extraction_cache import make_cache_key
+from preprocess import PageArtifact, PreparedImage, prepare_image
+from responses import clean_text, currency_code, normalize_fields, parse_amount, parse_json
+from telemetry import count, span
+from textlayer import TierStats
+
+# Define the prompt for JSON conversion
+DESCRIPTION_PROMPT = """
+        You are an AI model working for Global Autotech Limited that extracts billing information from images.
+        Analyze the attached bill/invoice image and provide ONLY a JSON response with the following case-sensitive fields:
+        - vendor_name: Name of the company/vendor
+        - bill_date: Date of the bill
+        - total_amount: Total amount of the bill
+        - invoice_number: Invoice number of the bill
+        Ensure the JSON is well-structured, includes only these fields, and contains no additional information.
+        Do not include any text, explanations, or code blocks. Respond with pure "JSON" only.
+    """
+
+VALID_KEYS = ("vendor_name", "bill_date", "total_amount", "invoice_number")
+# What a BillRecord shows and merges: the asked-for fields plus the currency
+RECORD_KEYS = VALID_KEYS + ("currency",)
+
+TOGETHER_MODEL = "meta-llama/Llama-3.2-11B-Vision-Instruct-Turbo"
+GEMINI_MODEL = "gemini-1.5-pro"
+GEMINI_GENERATION_CONFIG = {
+    "temperature": 1,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": 8192,
+}
+
+
+@dataclass(slots=True)
+class BillRecord:
+    # Fields are normalized on the way in: the total is a float with its
+    # currency split off, dates are YYYY-MM-DD where they can be read
+    vendor_name: str = None
+    bill_date: str = None
+    total_amount: float = None
+    currency: str = None
+    invoice_number: str = None
+    error: str = None
+    raw_response: str = ""
+    # Which tier answered: text_layer, dedup, cache or model
+    source: str = None
+    # 0-based page numbers the bill was read from, in grouped extraction
+    pages: list = None
+    # Values that were there but couldn't be normalized, as given
+    invalid: dict = None
+
+    @classmethod
+    def from_fields(cls, data, **kwargs):
+        # A bill from the model's JSON object
+        fields = normalize_fields(data)
+        if not fields:
+            return cls(error="No bill fields in AI response.", **kwargs)
+        total_amount, currency = parse_amount(fields.get("total_amount"))
+        if fields.get("currency") is not None:
+            currency = currency_code(str(fields["currency"])) or currency
+        invalid = {}
+        if total_amount is None and clean_text(fields.get("total_amount")) is not None:
+            invalid["total_amount"] = fields["total_amount"]
+        return cls(
+            vendor_name=clean_text(fields.get("vendor_name")),
+            bill_date=normalize_date(clean_text(fields.get("bill_date"))),
+            total_amount=total_amount,
+            currency=currency,
+            invoice_number=clean_text(fields.get("invoice_number")),
+            invalid=invalid or None,
+            **kwargs,
+        )
+
+    @classmethod
+    def from_value(cls, value, text):
+        # An array from a model that answered a one-bill prompt with a list
+        # counts as its first bill
+        if isinstance(value, list):
+            value = value[0] if value else {}
+        return cls.from_fields(value, raw_response=text)
+
+    @classmethod
+    def from_response(cls, text):
+        try:
+            value = parse_json(text)
+        except ValueError:
+            return cls(error="Invalid JSON response from AI model.", raw_response=text)
+        return cls.from_value(value, text)
+
+    def to_dict(self):
+        # Same shape the UI has always shown: the extracted fields, or an error
+        if self.error:
+            return {"error": self.error}
+        return {k: v for k, v in asdict(self).items() if k in RECORD_KEYS and v is not None}
+
+
+class Backend:
+    # A vision model that turns one PreparedImage plus a prompt into text.
+    # Clients are created once in __init__ and reused for every page.
+    name = "backend"
+    model_name = ""
+    generation_config = None
+    # Images the model accepts in one request
+    max_images = 1
+
+    def generate(self, prompt, image):
+        raise NotImplementedError
+
+    def generate_many(self, prompt, images):
+        # One request with several images, for models with max_images > 1
+        if len(images) == 1:
+            return self.generate(prompt, images[0])
+        raise NotImplementedError(f"{self.name} takes one image per request")
+
+    def close(self):
+        pass
+
+
+class FakeBackend(Backend):
+    # Deterministic local stand-in for tests and benchmarks: the answer is
+    # derived from the image bytes, with optional injected latency
+    name = "fake"
+    max_images = 16
+
+    def __init__(self, latency=0.0, model_name="fake-vision"):
+        self.latency = latency
+        self.model_name = model_name
+        self.calls = 0
+
+    def generate(self, prompt, image):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return json.dumps(self.answer(image))
+
+    def generate_many(self, prompt, images):
+        # One bill per image
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return json.dumps([dict(self.answer(image), pages=[number]) for number, image in enumerate(images, 1)])
+
+    def answer(self, image):
+        digest = hashlib.sha256(image.data).hexdigest()
+        return {
+            "vendor_name": f"Vendor {digest[:4].upper()}",
+            "bill_date": "2024-01-01",
+            "total_amount": f"{int(digest[4:10], 16) % 100000 / 100:.2f}",
+            "invoice_number": f"INV-{digest[10:16].upper()}",
+        }
+
+
+class Extractor:
+    def __init__(self, backend, prompt=DESCRIPTION_PROMPT, cache=None, rate_limiter=None, preprocess=None,
+                 dedup=None, text_parser=None):
+        self.backend = backend
+        self.prompt = prompt
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.preprocess = preprocess
+        self.dedup = dedup
+        self.text_parser = text_parser
+        self.tiers = TierStats()
+
+    def prepare(self, image):
+        # Accepts a PIL image, a PageArtifact, already-encoded PNG bytes or a PreparedImage
+        if isinstance(image, PreparedImage):
+            return image
+        if isinstance(image, PageArtifact):
+            return image.prepared
+        if isinstance(image, (bytes, bytearray)):
+            return PreparedImage(bytes(image), "image/png", original_bytes=len(image))
+        return prepare_image(image, self.preprocess, measure=False)
+
+    def extract_text(self, image):
+        return self._extract_text(image)[0]
+
+    def _extract_text(self, image):
+        # (text, tier) where tier says whether the cache or the model answered
+        prepared = self.prepare(image)
+
+        # Same page, prompt and model means the same answer, so skip the API call
+        cache_key = make_cache_key(
+            prepared.data, self.prompt, self.backend.model_name, self.backend.generation_config
+        )
+        cached = self._cached(cache_key)
+        if cached is not None:
+            return cached, "cache"
+
+        # Wait for a free slot so parallel pages stay under the provider's rate limit
+        if self.rate_limiter is not None:
+            with span("rate_wait"):
+                self.rate_limiter.acquire()
+
+        text = self._generate([prepared], lambda: self.backend.generate(self.prompt, prepared))
+        self._store(cache_key, text)
+        return text, "model"
+
+    def extract_text_many(self, images, prompt):
+        # One request for several images (or one tiled image) with its own
+        # prompt; cached and rate limited like a single page
+        prepared = [self.prepare(image) for image in images]
+        cache_key = make_cache_key(
+            b"".join(hashlib.sha256(image.data).digest() for image in prepared),
+            prompt, self.backend.model_name, self.backend.generation_config,
+        )
+        cached = self._cached(cache_key)
+        if cached is not None:
+            return cached, "cache"
+        if self.rate_limiter is not None:
+            with span("rate_wait"):
+                self.rate_limiter.acquire()
+        text = self._generate(prepared, lambda: self.backend.generate_many(prompt, prepared))
+        self._store(cache_key, text)
+        return text, "model"
+
+    def _cached(self, cache_key):
+        if self.cache is None:
+            return None
+        with span("cache"):
+            cached = self.cache.get(cache_key)
+        count("cache_misses" if cached is None else "cache_hits")
+        return cached
+
+    def _store(self, cache_key, text):
+        # Refusals and answers without JSON aren't cached, so the page goes
+        # to the model again next time instead of failing for the cache's lifetime
+        if self.cache is None:
+            return
+        try:
+            parse_json(text)
+        except ValueError:
+            return
+        self.cache.put(cache_key, text)
+
+    def _generate(self, prepared, call):
+        # The model call, counted with what it sends
+        count("model_calls")
+        count("bytes_sent", sum(len(image.data) for image in prepared))
+        with span("model", images=len(prepared)):
+            return call()
+
+    def extract_from_text(self, text):
+        # First tier: a PDF page's text layer, parsed locally. None when
+        # there's no usable text or the parse isn't confident.
+        if self.text_parser is None or not text:
+            return None
+        start = time.perf_counter()
+        with span("text_parse"):
+            response = self.text_parser.parse(text)
+        if response is None:
+            return None
+        self.tiers.record("text_layer", time.perf_counter() - start)
+        count("pages")
+        count("text_layer_hits")
+        record = BillRecord.from_response(response)
+        record.source = "text_layer"
+        return record
+
+    def extract(self, image):
+        start = time.perf_counter()
+        record = self.extract_from_text(getattr(image, "text", None))
+        if record is not None:
+            return record
+
+        # A page identical to one extracted before (the same page in another
+        # PDF or file) reuses that answer without encoding or sending anything
+        signature = None
+        if self.dedup is not None and not isinstance(image, (bytes, bytearray, PreparedImage)):
+            with span("dedup"):
+                signature = self.dedup.page_signature(image)
+                known = self.dedup.find_page(signature)
+            if known is not None:
+                self.tiers.record("dedup", time.perf_counter() - start)
+                count("pages")
+                count("dedup_hits")
+                record = BillRecord.from_response(known)
+                record.source = "dedup"
+                return record
+
+        text, tier = self._extract_text(image)
+        self.tiers.record(tier, time.perf_counter() - start)
+        count("pages")
+        with span("parse", tier=tier):
+            record = BillRecord.from_response(text)
+        record.source = tier
+        if signature is not None and not record.error:
+            self.dedup.add_page(signature, record.raw_response)
+        return record
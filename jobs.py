@@ -0,0 +1,232 @@
+# Durable queue of extraction jobs in bills.db, so uploads are processed by
+# worker.py outside the Streamlit session: a closed tab or a restarted app
+# loses nothing, and one large upload doesn't hold up anyone else's page.
+#
+# Uploaded files are copied to a spool folder; a job row points at its copy
+# and moves queued -> running -> done | failed. A worker claims a job in a
+# single write transaction, so any number of worker processes can share the
+# queue. Running jobs are heartbeated; a job whose worker died is put back
+# in the queue (up to MAX_ATTEMPTS runs).
+import json
+import os
+import re
+import tempfile
+import time
+
+DEFAULT_SPOOL_DIR = "job_files"
+# A running job that hasn't been heartbeated for this long lost its worker
+STALE_AFTER = 120
+MAX_ATTEMPTS = 3
+# Window for the throughput and latency figures in metrics()
+METRICS_WINDOW = 3600
+ACTIVE_STATUSES = ("queued", "running")
+JOB_COLUMNS = (
+    "id", "status", "file_name", "file_path", "options", "attempts", "worker", "pages", "pages_done",
+    "bills_inserted", "result", "error", "created_at", "started_at", "heartbeat_at", "finished_at",
+)
+
+
+def job_from_row(row):
+    job = dict(zip(JOB_COLUMNS, row))
+    job["options"] = json.loads(job["options"] or "{}")
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+def safe_file_name(name):
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", os.path.basename(name))[-100:] or "upload"
+
+
+class JobQueue:
+    # Goes through the BillDatabase connection (and lock) of the process
+    def __init__(self, db, spool_dir=DEFAULT_SPOOL_DIR):
+        self.db = db
+        self.spool_dir = spool_dir
+
+    def submit(self, source, file_name, options=None):
+        # source is a binary file object or bytes; returns the job id
+        os.makedirs(self.spool_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            dir=self.spool_dir, prefix="job_", suffix="_" + safe_file_name(file_name), delete=False
+        ) as f:
+            if isinstance(source, bytes):
+                f.write(source)
+            else:
+                position = source.tell()
+                for chunk in iter(lambda: source.read(1024 * 1024), b""):
+                    f.write(chunk)
+                source.seek(position)
+            path = f.name
+        with self.db.lock, self.db.conn:
+            cursor = self.db.conn.execute(
+                "INSERT INTO jobs (file_name, file_path, options, created_at) VALUES (?, ?, ?, ?)",
+                (file_name, path, json.dumps(options or {}), time.time()),
+            )
+        return cursor.lastrowid
+
+    def claim(self, worker):
+        # The oldest queued job, now running on this worker, or None
+        now = time.time()
+        with self.db.lock, self.db.conn:
+            row = self.db.conn.execute(f'''
+            UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1,
+                started_at = ?, heartbeat_at = ?, pages_done = 0, error = NULL
+            WHERE id = (SELECT id FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1)
+            RETURNING {", ".join(JOB_COLUMNS)}
+            ''', (worker, now, now)).fetchone()
+        return job_from_row(row) if row else None
+
+    def heartbeat(self, job_ids, pages_done=None, pages=None):
+        if not job_ids:
+            return
+        now = time.time()
+        with self.db.lock, self.db.conn:
+            if pages_done is None:
+                self.db.conn.executemany(
+                    "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = 'running'",
+                    [(now, job_id) for job_id in job_ids],
+                )
+            else:
+                self.db.conn.executemany(
+                    "UPDATE jobs SET heartbeat_at = ?, pages_done = ?, pages = COALESCE(?, pages) "
+                    "WHERE id = ? AND status = 'running'",
+                    [(now, pages_done, pages, job_id) for job_id in job_ids],
+                )
+
+    def finish(self, job_id, stats, errors=()):
+        # A job that ran to the end; pages that failed are in the result
+        result = dict(stats, error_messages=list(errors)[:50])
+        with self.db.lock, self.db.conn:
+            self.db.conn.execute('''
+            UPDATE jobs SET status = 'done', finished_at = ?, pages_done = ?, pages = ?,
+                bills_inserted = ?, result = ?
+            WHERE id = ?
+            ''', (time.time(), stats.get("pages", 0), stats.get("pages", 0), stats.get("inserted", 0),
+                  json.dumps(result), job_id))
+        self._remove_file(job_id)
+
+    def fail(self, job_id, error, retry=True):
+        # Back in the queue while it has attempts left, failed otherwise
+        with self.db.lock, self.db.conn:
+            (attempts,) = self.db.conn.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if retry and attempts < MAX_ATTEMPTS:
+                self.db.conn.execute(
+                    "UPDATE jobs SET status = 'queued', worker = NULL, error = ? WHERE id = ?", (error, job_id)
+                )
+                return
+            self.db.conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                (error, time.time(), job_id),
+            )
+        self._remove_file(job_id)
+
+    def requeue(self, job_id):
+        # Stopped by its worker shutting down; doesn't count as an attempt
+        with self.db.lock, self.db.conn:
+            self.db.conn.execute(
+                "UPDATE jobs SET status = 'queued', worker = NULL, attempts = MAX(attempts - 1, 0) "
+                "WHERE id = ? AND status = 'running'",
+                (job_id,),
+            )
+
+    def requeue_stale(self, stale_after=STALE_AFTER):
+        # Jobs whose worker stopped heartbeating; returns how many
+        with self.db.lock:
+            stale = [job_id for (job_id,) in self.db.conn.execute(
+                "SELECT id FROM jobs WHERE status = 'running' AND heartbeat_at < ?", (time.time() - stale_after,)
+            )]
+        for job_id in stale:
+            self.fail(job_id, "worker stopped responding")
+        return len(stale)
+
+    def cancel(self, job_id):
+        # Only jobs no worker has picked up yet
+        with self.db.lock, self.db.conn:
+            cursor = self.db.conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+                (time.time(), job_id),
+            )
+        if cursor.rowcount:
+            self._remove_file(job_id)
+        return bool(cursor.rowcount)
+
+    def get(self, job_id):
+        with self.db.lock:
+            row = self.db.conn.execute(
+                f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return job_from_row(row) if row else None
+
+    def recent(self, limit=50):
+        with self.db.lock:
+            rows = self.db.conn.execute(
+                f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs ORDER BY id DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [job_from_row(row) for row in rows]
+
+    def metrics(self, window=METRICS_WINDOW):
+        # Queue depth now; latency and throughput of jobs finished within
+        # the window. Latency is submit to finish, wait is submit to start.
+        now = time.time()
+        with self.db.lock:
+            counts = dict(self.db.conn.execute(
+                "SELECT status, COUNT(*) FROM jobs WHERE status IN ('queued', 'running') GROUP BY status"
+            ).fetchall())
+            oldest = self.db.conn.execute(
+                "SELECT MIN(created_at) FROM jobs WHERE status = 'queued'"
+            ).fetchone()[0]
+            workers = self.db.conn.execute(
+                "SELECT COUNT(DISTINCT worker) FROM jobs WHERE status = 'running' AND heartbeat_at >= ?",
+                (now - STALE_AFTER,),
+            ).fetchone()[0]
+            finished = self.db.conn.execute('''
+            SELECT status, created_at, started_at, finished_at, pages_done FROM jobs
+            WHERE finished_at >= ? AND status IN ('done', 'failed')
+            ORDER BY finished_at
+            ''', (now - window,)).fetchall()
+        done = [row for row in finished if row[0] == "done"]
+        latencies = sorted(row[3] - row[1] for row in done)
+        waits = sorted(row[2] - row[1] for row in done if row[2] is not None)
+        # Throughput over the time since the first of these jobs started
+        starts = [row[2] for row in finished if row[2] is not None]
+        span = max(now - min(starts), 1.0) if starts else window
+        return {
+            "queued": counts.get("queued", 0),
+            "running": counts.get("running", 0),
+            "oldest_queued_seconds": now - oldest if oldest else 0.0,
+            "active_workers": workers,
+            "done": len(done),
+            "failed": len(finished) - len(done),
+            "latency_p50": percentile(latencies, 50),
+            "latency_p95": percentile(latencies, 95),
+            "wait_p50": percentile(waits, 50),
+            "jobs_per_minute": len(done) * 60 / span,
+            "pages_per_minute": sum(row[4] for row in done) * 60 / span,
+        }
+
+    def _remove_file(self, job_id):
+        with self.db.lock:
+            row = self.db.conn.execute("SELECT file_path FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row and os.path.exists(row[0]):
+            os.remove(row[0])
+
+
+def percentile(values, p):
+    # Nearest rank over sorted values; None when there are none
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))]
+
+
+def format_metrics(metrics):
+    def seconds(value):
+        return "–" if value is None else f"{value:.1f}s"
+
+    return (
+        f"{metrics['queued']} queued (oldest {metrics['oldest_queued_seconds']:.0f}s), "
+        f"{metrics['running']} running on {metrics['active_workers']} workers · "
+        f"last hour: {metrics['done']} done, {metrics['failed']} failed, "
+        f"latency p50 {seconds(metrics['latency_p50'])} / p95 {seconds(metrics['latency_p95'])}, "
+        f"wait p50 {seconds(metrics['wait_p50'])}, "
+        f"{metrics['jobs_per_minute']:.1f} jobs/min, {metrics['pages_per_minute']:.1f} pages/min"
+    )
@@ -0,0 +1,186 @@
+# Grouped extraction: several consecutive pages go to the model in one
+# request, as separate images when the model takes more than one, else
+# tiled into a single image, and the model answers with a JSON array of
+# bills saying which pages each came from. That handles invoices running
+# over several pages (one bill) and pages holding several receipts (several
+# bills), with fewer calls per document. Bills cut in two by a group
+# boundary are merged again afterwards.
+import json
+import math
+import time
+
+from PIL import Image, ImageDraw
+
+import telemetry
+from extractor import RECORD_KEYS, BillRecord
+from responses import parse_json
+
+MULTI_BILL_PROMPT = """
+        You are an AI model working for Global Autotech Limited that extracts billing information from images.
+        You are given {layout}, numbered 1 to {count} in reading order. One bill/invoice may run over several
+        pages, and one page may hold several bills (e.g. a sheet of scanned receipts).
+        Provide ONLY a JSON array with one object per bill, in the order the bills appear, each with the
+        following case-sensitive fields:
+        - vendor_name: Name of the company/vendor
+        - bill_date: Date of the bill
+        - total_amount: Total amount of the bill
+        - invoice_number: Invoice number of the bill
+        - pages: Array of the page numbers the bill appears on
+        Ensure the JSON is well-structured, includes only these fields, and contains no additional information.
+        Do not include any text, explanations, or code blocks. Respond with pure "JSON" only.
+    """
+
+# Consecutive pages per request
+GROUP_SIZE = 4
+# Longest side of a tiled image
+TILE_MAX_DIMENSION = 2048
+TILE_GAP = 16
+
+
+def tile_grid(count):
+    # (rows, columns), as square as possible
+    columns = math.ceil(math.sqrt(count))
+    return math.ceil(count / columns), columns
+
+
+def tile_boxes(count, width, height, gap=TILE_GAP):
+    # The cell of each page in a tiled image of width x height
+    rows, columns = tile_grid(count)
+    cell_width = (width - gap * (columns + 1)) // columns
+    cell_height = (height - gap * (rows + 1)) // rows
+    boxes = []
+    for index in range(count):
+        row, column = divmod(index, columns)
+        left = gap + column * (cell_width + gap)
+        top = gap + row * (cell_height + gap)
+        boxes.append((left, top, left + cell_width, top + cell_height))
+    return boxes
+
+
+def tile_images(images, max_dimension=TILE_MAX_DIMENSION, gap=TILE_GAP):
+    # One white sheet with the pages in a grid, separated by grey rules
+    rows, columns = tile_grid(len(images))
+    cell_width = max(image.width for image in images)
+    cell_height = max(image.height for image in images)
+    width = columns * cell_width + gap * (columns + 1)
+    height = rows * cell_height + gap * (rows + 1)
+    scale = min(1.0, max_dimension / max(width, height))
+    width, height = int(width * scale), int(height * scale)
+
+    sheet = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(sheet)
+    for image, (left, top, right, bottom) in zip(images, tile_boxes(len(images), width, height, gap)):
+        page = image.convert("RGB")
+        page.thumbnail((right - left, bottom - top), Image.LANCZOS)
+        sheet.paste(page, (left, top))
+        draw.rectangle((left - gap // 2, top - gap // 2, right + gap // 2, bottom + gap // 2), outline="grey")
+    return sheet
+
+
+def prompt_for(count, tiled):
+    if tiled:
+        rows, columns = tile_grid(count)
+        layout = f"one image showing {count} pages tiled in a grid of {rows} rows by {columns} columns"
+    else:
+        layout = f"{count} images, one per page"
+    return MULTI_BILL_PROMPT.format(layout=layout, count=count)
+
+
+def parse_bills(text):
+    # The model's array of bill objects; a lone object counts as one bill
+    data = parse_json(text)
+    if isinstance(data, dict):
+        data = data.get("bills", [data])
+    if not isinstance(data, list):
+        raise ValueError("expected a JSON array of bills")
+    return [bill for bill in data if isinstance(bill, dict)]
+
+
+def bill_pages(bill, first_page, count):
+    # The bill's 1-based page numbers within the group as absolute page
+    # numbers; pages the model didn't name (or named wrongly) mean the group
+    pages = bill.get("pages")
+    if isinstance(pages, int):
+        pages = [pages]
+    if not isinstance(pages, list):
+        pages = []
+    pages = sorted({int(p) for p in pages if isinstance(p, (int, float)) or str(p).isdigit()})
+    pages = [first_page + p - 1 for p in pages if 1 <= p <= count]
+    return pages or list(range(first_page, first_page + count))
+
+
+def same_bill(a, b):
+    # Two records of one invoice: same invoice number and vendor (or one of
+    # them missing the vendor, as on a continuation page)
+    if a.error or b.error or not a.invoice_number or not b.invoice_number:
+        return False
+    if str(a.invoice_number).strip().lower() != str(b.invoice_number).strip().lower():
+        return False
+    vendors = [str(v).strip().lower() for v in (a.vendor_name, b.vendor_name) if v]
+    return len(set(vendors)) <= 1
+
+
+def merge_records(records):
+    # Folds together consecutive records of the same invoice (split over a
+    # group boundary, or over pages in per-page mode). Fields come from the
+    # first record, except the total, which is printed on the last page.
+    merged = []
+    for record in records:
+        previous = merged[-1] if merged else None
+        if previous is not None and same_bill(previous, record):
+            for key in RECORD_KEYS:
+                if getattr(previous, key) is None:
+                    setattr(previous, key, getattr(record, key))
+            if record.total_amount is not None:
+                previous.total_amount = record.total_amount
+            previous.pages = sorted(set(previous.pages or []) | set(record.pages or []))
+            previous.raw_response = "\n".join(filter(None, (previous.raw_response, record.raw_response)))
+            continue
+        merged.append(record)
+    return merged
+
+
+class GroupExtractor:
+    # Extracts a group of consecutive page images with one model call.
+    # Pages are sent as separate images when the backend takes that many,
+    # otherwise tiled into one image (tile=True forces tiling).
+    def __init__(self, extractor, group_size=GROUP_SIZE, tile=None, max_dimension=TILE_MAX_DIMENSION):
+        self.extractor = extractor
+        self.group_size = group_size
+        self.tile = tile
+        self.max_dimension = max_dimension
+
+    def tiles(self, count):
+        if self.tile is not None:
+            return self.tile and count > 1
+        return count > getattr(self.extractor.backend, "max_images", 1)
+
+    def extract_group(self, images, first_page=0):
+        # images are PageArtifacts or PIL images; returns BillRecords with
+        # absolute 0-based page numbers in .pages
+        start = time.perf_counter()
+        count = len(images)
+        tiled = self.tiles(count)
+        if tiled:
+            sheet = tile_images([getattr(image, "image", image) for image in images], self.max_dimension)
+            payload = [sheet]
+        else:
+            payload = images
+        text, tier = self.extractor.extract_text_many(payload, prompt_for(count, tiled))
+        self.extractor.tiers.record(tier, time.perf_counter() - start)
+        telemetry.count("pages", count)
+
+        try:
+            with telemetry.span("parse", tier=tier):
+                bills = parse_bills(text)
+        except ValueError:
+            return [BillRecord(
+                error="Invalid JSON response from AI model.", raw_response=text, source=tier,
+                pages=list(range(first_page, first_page + count)),
+            )]
+        return [
+            BillRecord.from_fields(
+                bill, raw_response=json.dumps(bill), source=tier, pages=bill_pages(bill, first_page, count)
+            )
+            for bill in bills
+        ]
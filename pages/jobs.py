@@ -0,0 +1,93 @@
+import time
+from datetime import datetime
+import streamlit as st
+import pandas as pd
+from database import BillDatabase
+from jobs import ACTIVE_STATUSES, JobQueue
+
+REFRESH_SECONDS = 3
+RECENT_JOBS = 100
+
+st.set_page_config(
+    page_title="Jobs",
+    page_icon="⏳",
+    layout="wide"
+)
+
+st.title("⏳ Background Jobs")
+
+@st.cache_resource
+def get_db():
+    return BillDatabase()
+
+@st.cache_resource
+def get_job_queue():
+    return JobQueue(get_db())
+
+def format_seconds(value):
+    return "–" if value is None else f"{value:.1f}s"
+
+def format_time(value):
+    return datetime.fromtimestamp(value).strftime("%Y-%m-%d %H:%M:%S") if value else None
+
+queue = get_job_queue()
+metrics = queue.metrics()
+
+# Queue depth now, latency and throughput over the last hour
+col1, col2, col3, col4, col5 = st.columns(5)
+col1.metric("Queued", metrics["queued"], help=f"Oldest waiting {metrics['oldest_queued_seconds']:.0f}s")
+col2.metric("Running", metrics["running"], help=f"{metrics['active_workers']} workers active")
+col3.metric("Latency p50 / p95", f"{format_seconds(metrics['latency_p50'])} / {format_seconds(metrics['latency_p95'])}",
+            help=f"Submit to finish; waiting in the queue p50 {format_seconds(metrics['wait_p50'])}")
+col4.metric("Pages / min", f"{metrics['pages_per_minute']:.1f}", help=f"{metrics['jobs_per_minute']:.1f} jobs/min")
+col5.metric("Done / failed (1h)", f"{metrics['done']} / {metrics['failed']}")
+
+if not metrics["active_workers"] and metrics["queued"]:
+    st.warning("Jobs are waiting but no worker is running. Start one with `python worker.py`.")
+
+jobs = queue.recent(RECENT_JOBS)
+df = pd.DataFrame.from_records([
+    {
+        "id": job["id"],
+        "file": job["file_name"],
+        "status": job["status"],
+        "progress": job["pages_done"] / job["pages"] if job["pages"] else 0.0,
+        "pages": job["pages"],
+        "bills added": job["bills_inserted"],
+        "page errors": (job["result"] or {}).get("errors", 0),
+        "attempts": job["attempts"],
+        "worker": job["worker"],
+        "submitted": format_time(job["created_at"]),
+        "wait": job["started_at"] - job["created_at"] if job["started_at"] else None,
+        "run time": job["finished_at"] - job["started_at"] if job["finished_at"] and job["started_at"] else None,
+        "error": job["error"],
+    }
+    for job in jobs
+], columns=["id", "file", "status", "progress", "pages", "bills added", "page errors", "attempts", "worker",
+            "submitted", "wait", "run time", "error"])
+
+st.dataframe(
+    df,
+    column_config={
+        "progress": st.column_config.ProgressColumn("Progress", min_value=0.0, max_value=1.0),
+        "wait": st.column_config.NumberColumn("Wait", format="%.1fs"),
+        "run time": st.column_config.NumberColumn("Run time", format="%.1fs"),
+    },
+    hide_index=True,
+    use_container_width=True
+)
+
+# Jobs no worker has picked up yet can be withdrawn
+queued_ids = [job["id"] for job in jobs if job["status"] == "queued"]
+if queued_ids:
+    col1, col2 = st.columns([1, 3])
+    job_id = col1.selectbox("Queued job", queued_ids)
+    if col2.button("Cancel job"):
+        if queue.cancel(job_id):
+            st.success(f"Job {job_id} cancelled.")
+        else:
+            st.warning(f"Job {job_id} was already picked up by a worker.")
+
+if st.checkbox("Refresh automatically", value=True) and any(job["status"] in ACTIVE_STATUSES for job in jobs):
+    time.sleep(REFRESH_SECONDS)
+    st.rerun()
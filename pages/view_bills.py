@@ -1,6 +1,12 @@
+import math
+import tempfile
 import streamlit as st
-import sqlite3
 import pandas as pd
+from database import BillDatabase
+from export import EXPORT_FORMATS, available_formats, export_bills
+
+PAGE_SIZE = 50
+DISPLAY_COLUMNS = ["invoice_number", "company_name", "total_cost", "bill_date"]
 
 st.set_page_config(
     page_title="View Bills",
@@ -10,37 +16,43 @@ st.set_page_config(
 
 st.title("📊 View Bills")
 
-def get_bills():
-    conn = sqlite3.connect('bills.db')
-    query = """
-        SELECT 
-            invoice_number,
-            company_name,
-            total_cost,
-            bill_date
-        FROM bills
-        ORDER BY bill_date DESC
-    """
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df
+@st.cache_resource
+def get_db():
+    return BillDatabase()
+
+# Cached results are keyed on the database's data version, which every
+# insert/update/delete bumps (from the uploader, batch jobs or anywhere
+# else), so new bills show up without clearing the cache by hand
 
-# Get the data
-df = get_bills()
+@st.cache_data(max_entries=256)
+def get_summary(search_term, data_version):
+    return get_db().summarize_bills(search_term)
 
-# Convert bill_date to datetime and total_cost to float
-df['bill_date'] = pd.to_datetime(df['bill_date'])
-df['total_cost'] = pd.to_numeric(df['total_cost'], errors='coerce')
+@st.cache_data(max_entries=256)
+def get_bills_page(search_term, page, data_version):
+    # Only the visible page is fetched; search runs in SQLite (FTS5 prefix
+    # match on company name and invoice number)
+    bills = get_db().search_bills(search_term, limit=PAGE_SIZE, offset=page * PAGE_SIZE)
+    df = pd.DataFrame.from_records(bills, columns=DISPLAY_COLUMNS)
+    # Convert bill_date to datetime and total_cost to float
+    df['bill_date'] = pd.to_datetime(df['bill_date'], errors='coerce')
+    df['total_cost'] = pd.to_numeric(df['total_cost'], errors='coerce')
+    return df
+
+data_version = get_db().data_version()
 
 # Add search box
-search_term = st.text_input("Search bills by company name", "")
+search_term = st.text_input("Search bills by company name or invoice number", "")
 
-# Filter dataframe based on search
-filtered_df = df[df['company_name'].str.contains(search_term, case=False, na=False)]
+# Show total amount and count, aggregated in SQL
+bill_count, total_amount = get_summary(search_term, data_version)
+col1, col2 = st.columns(2)
+col1.metric("Total Amount", f"₹{total_amount:,.2f}")
+col2.metric("Bills", f"{bill_count:,}")
 
-# Show total amount
-total_amount = filtered_df['total_cost'].sum()
-st.metric("Total Amount", f"₹{total_amount:,.2f}")
+page_count = max(1, math.ceil(bill_count / PAGE_SIZE))
+page = st.number_input("Page", min_value=1, max_value=page_count, value=1, step=1) - 1
+filtered_df = get_bills_page(search_term, page, data_version)
 
 # Display the data
 st.dataframe(
@@ -58,13 +70,26 @@ st.dataframe(
     hide_index=True,
     use_container_width=True
 )
+first_row = page * PAGE_SIZE + 1 if bill_count else 0
+st.caption(f"Showing {first_row}-{page * PAGE_SIZE + len(filtered_df)} of {bill_count:,} bills · page {page + 1} of {page_count}")
 
-# Add download button
-csv = filtered_df.to_csv(index=False).encode('utf-8')
-st.download_button(
-    "Download as CSV",
-    csv,
-    "bills.csv",
-    "text/csv",
-    key='download-csv'
-) 
\ No newline at end of file
+# Export the whole result set: rows are streamed from SQLite into a temp
+# file in chunks, so only the finished (compressed) file is ever in memory
+col1, col2 = st.columns([1, 3])
+export_format = col1.selectbox(
+    "Export format",
+    available_formats(),
+    format_func=lambda name: EXPORT_FORMATS[name]["label"]
+)
+if col2.button("Prepare download"):
+    export_file = tempfile.TemporaryFile()
+    with st.spinner("Exporting bills..."):
+        export_bills(export_file, export_format, get_db().db_path, search_term)
+    export_file.seek(0)
+    st.download_button(
+        f"Download as {EXPORT_FORMATS[export_format]['label']}",
+        export_file,
+        "bills" + EXPORT_FORMATS[export_format]["extension"],
+        EXPORT_FORMATS[export_format]["mime_type"],
+        key='download-export'
+    )
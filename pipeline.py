@@ -0,0 +1,67 @@
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# pdfium is not thread-safe, so every call into a PdfDocument/PdfPage from a
+# worker thread has to hold this lock
+RENDER_LOCK = threading.Lock()
+
+
+class RateLimiter:
+    # Spaces calls out so a provider never sees more than `rate` requests
+    # per second, no matter how many worker threads share the limiter
+    def __init__(self, rate):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def set_rate(self, rate):
+        with self._lock:
+            self.rate = rate
+
+    def acquire(self):
+        with self._lock:
+            if not self.rate or self.rate <= 0:
+                return
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + 1.0 / self.rate
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+def process_in_order(items, func, max_workers=4, max_pending=None):
+    # Runs func(item) on a bounded thread pool and yields (item, result) in
+    # the original order. At most max_pending items (default max_workers)
+    # are in flight, so a long PDF is not rendered up front while the first
+    # pages are still waiting. A bigger window lets quick items keep the
+    # workers busy while a slow one holds up the head of the line.
+    # Exceptions raised by func are re-raised when their item is reached.
+    # func runs in a copy of the caller's context, so what it records goes
+    # to the caller's bound telemetry.
+    max_workers = max(1, int(max_workers))
+    max_pending = max(max_workers, int(max_pending or 0))
+    items = iter(items)
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            for item in items:
+                pending.append((item, executor.submit(contextvars.copy_context().run, func, item)))
+                if len(pending) >= max_pending:
+                    break
+
+            while pending:
+                item, future = pending.popleft()
+                result = future.result()
+                for next_item in items:
+                    pending.append((next_item, executor.submit(contextvars.copy_context().run, func, next_item)))
+                    break
+                yield item, result
+        finally:
+            # Don't start anything new if the consumer stopped early
+            for _, future in pending:
+                future.cancel()
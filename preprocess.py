@@ -0,0 +1,211 @@
+import base64
+import threading
+import time
+from dataclasses import dataclass, field
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+from telemetry import span
+
+MIME_TYPES = {
+    "PNG": "image/png",
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+}
+
+
+@dataclass
+class PreprocessConfig:
+    grayscale: bool = False
+    # Longest side in pixels after downscaling, None/0 keeps the rendered size
+    max_dimension: int = None
+    format: str = "PNG"
+    # JPEG/WEBP only
+    quality: int = 85
+    crop_borders: bool = False
+    # Pixels at or above this luminance count as blank paper when cropping
+    border_threshold: int = 245
+    border_margin: int = 8
+
+    def is_default(self):
+        # True when the payload is just the rendered page as lossless PNG
+        return (
+            not self.grayscale
+            and not self.max_dimension
+            and self.format == "PNG"
+            and not self.crop_borders
+        )
+
+
+@dataclass
+class PreparedImage:
+    # The encoded payload that is actually sent to the vision model
+    data: bytes
+    mime_type: str
+    width: int = 0
+    height: int = 0
+    # Lossless PNG size of the image as rendered, for before/after reporting
+    original_bytes: int = 0
+    seconds: float = 0.0
+    _base64: str = field(default=None, repr=False, compare=False)
+
+    @property
+    def saved_bytes(self):
+        return self.original_bytes - len(self.data)
+
+    def base64(self):
+        # Encoded once, however many times the payload is sent or retried
+        if self._base64 is None:
+            with span("base64"):
+                self._base64 = base64.b64encode(self.data).decode("ascii")
+        return self._base64
+
+
+def crop_whitespace(image, threshold=245, margin=8):
+    # Trims the blank paper around the content, leaving a small margin
+    mask = ImageOps.invert(image.convert("L")).point(lambda p: 255 if p > 255 - threshold else 0)
+    bbox = mask.getbbox()
+    if bbox is None:
+        return image
+    left, top, right, bottom = bbox
+    return image.crop((
+        max(left - margin, 0),
+        max(top - margin, 0),
+        min(right + margin, image.width),
+        min(bottom + margin, image.height),
+    ))
+
+
+def encode(image, format="PNG", quality=85):
+    if format != "PNG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buffered = BytesIO()
+    with span("encode", format=format):
+        if format == "PNG":
+            image.save(buffered, format="PNG")
+        else:
+            image.save(buffered, format=format, quality=quality)
+    return buffered.getvalue()
+
+
+def prepare_image(image, config=None, measure=True):
+    config = config or PreprocessConfig()
+    start = time.perf_counter()
+
+    processed = image
+    if config.crop_borders:
+        processed = crop_whitespace(processed, config.border_threshold, config.border_margin)
+    if config.grayscale:
+        processed = processed.convert("L")
+    if config.max_dimension and max(processed.size) > config.max_dimension:
+        processed = processed.copy()
+        processed.thumbnail((config.max_dimension, config.max_dimension), Image.LANCZOS)
+
+    data = encode(processed, config.format, config.quality)
+    seconds = time.perf_counter() - start
+
+    # With the default config the payload already is the lossless PNG
+    if config.is_default():
+        original_bytes = len(data)
+    elif measure:
+        original_bytes = len(encode(image))
+    else:
+        original_bytes = 0
+
+    return PreparedImage(
+        data=data,
+        mime_type=MIME_TYPES[config.format],
+        width=processed.width,
+        height=processed.height,
+        original_bytes=original_bytes,
+        seconds=seconds,
+    )
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB"):
+        if abs(size) < 1024 or unit == "MB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+class PageArtifact:
+    # Everything produced for one page: the rendered image, the lossless PNG
+    # (display and download) and the model payload. Each encoding happens at
+    # most once, on first use, and the same bytes object is handed to every
+    # consumer. release() drops the bitmap as soon as the page is done.
+    # text is the PDF page's text layer, when it was read.
+    def __init__(self, image, config=None, resources=(), text=None):
+        self.config = config or PreprocessConfig()
+        self.text = text
+        self.width, self.height = image.size
+        self._image = image
+        # pdfium page/bitmap objects backing the image, closed on release
+        self._resources = list(resources)
+        self._png = None
+        self._prepared = None
+        self._lock = threading.Lock()
+
+    @property
+    def image(self):
+        if self._image is None:
+            raise ValueError("page artifact has been released")
+        return self._image
+
+    @property
+    def png(self):
+        with self._lock:
+            if self._png is None:
+                self._png = encode(self.image)
+            return self._png
+
+    @property
+    def prepared(self):
+        with self._lock:
+            if self._prepared is None:
+                if self.config.is_default():
+                    # The payload is the PNG, so don't encode it twice
+                    if self._png is None:
+                        start = time.perf_counter()
+                        self._png = encode(self.image)
+                        seconds = time.perf_counter() - start
+                    else:
+                        seconds = 0.0
+                    self._prepared = PreparedImage(
+                        data=self._png,
+                        mime_type=MIME_TYPES["PNG"],
+                        width=self.width,
+                        height=self.height,
+                        original_bytes=len(self._png),
+                        seconds=seconds,
+                    )
+                else:
+                    self._prepared = prepare_image(self.image, self.config, measure=False)
+            if not self._prepared.original_bytes and self._png is not None:
+                self._prepared.original_bytes = len(self._png)
+            return self._prepared
+
+    def hold(self, resource):
+        # Closes resource along with this artifact, e.g. a budget reservation
+        # shared by a group of pages
+        with self._lock:
+            self._resources.insert(0, resource)
+
+    def release(self):
+        # Frees the bitmap and the encodings; the bytes already handed out stay valid
+        with self._lock:
+            if self._image is not None:
+                self._image.close()
+                self._image = None
+            for resource in reversed(self._resources):
+                resource.close()
+            self._resources = []
+            self._png = None
+            self._prepared = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
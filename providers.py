@@ -0,0 +1,534 @@
+# asyncio HTTP clients for the vision providers, with the failure handling
+# the SDK calls never had: a timeout per request, jittered exponential
+# retry, a token bucket that slows down when the provider answers 429, and
+# a circuit breaker per provider so a failing one fails over to the next.
+#
+# Responses are streamed: the text is fed to JsonStreamParser as it
+# arrives, and once the answer's JSON is complete the connection is closed
+# soon after instead of waiting for (and paying for) whatever prose the
+# model adds.
+#
+# ResilientBackend puts all of that behind the generate(prompt, image) and
+# generate_many(prompt, images) calls of extractor.Backend, so the
+# Extractor, its cache and the page pipeline work unchanged. Requests from
+# every worker thread share one event loop and one connection pool.
+import asyncio
+import json
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+
+import aiohttp
+
+from extractor import GEMINI_GENERATION_CONFIG, GEMINI_MODEL, TOGETHER_MODEL, Backend
+from responses import JsonStreamParser
+from telemetry import count
+
+TOGETHER_BASE_URL = "https://api.together.xyz/v1"
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com/v1beta"
+
+# Worth another attempt: throttling, timeouts and the provider's own failures
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+# Seconds a stream is read on after the answer's JSON is complete
+STREAM_GRACE = 0.25
+
+
+class ProviderError(Exception):
+    def __init__(self, provider, message, status=None, retryable=False, retry_after=None):
+        super().__init__(f"{provider}: {message}")
+        self.provider = provider
+        self.status = status
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(ProviderError):
+    def __init__(self, provider):
+        super().__init__(provider, "circuit open after repeated failures")
+
+
+class AdaptiveTokenBucket:
+    # Token bucket at up to max_rate requests per second. A 429 halves the
+    # rate and pauses for Retry-After; every success adds a little back
+    # (AIMD), so the rate settles just under what the provider accepts.
+    # Only used from the event loop thread. max_rate 0 means unlimited.
+    def __init__(self, max_rate, burst=1, min_rate=0.1, increase=0.05):
+        self.max_rate = max_rate
+        self.rate = max_rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.increase = increase
+        self.tokens = burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def set_rate(self, max_rate):
+        # A higher limit applies at once; a lower one only clamps the rate,
+        # so throttling learned from 429s isn't forgotten
+        previous, self.max_rate = self.max_rate, max_rate
+        if not previous or not max_rate or max_rate > previous:
+            self.rate = max_rate
+        else:
+            self.rate = min(self.rate, max_rate)
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        while True:
+            if not self.max_rate or self.max_rate <= 0:
+                return
+            now = time.monotonic()
+            self._refill(now)
+            wait = self._paused_until - now
+            if wait <= 0:
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            await asyncio.sleep(wait)
+
+    def throttled(self, retry_after=None):
+        if not self.max_rate:
+            return
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = 0
+        if retry_after:
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+    def succeeded(self):
+        if self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+
+class CircuitBreaker:
+    # Opens after failure_threshold consecutive failures and rejects calls
+    # for reset_timeout seconds, then lets one trial call through
+    # (half-open): success closes it, failure opens it again.
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._trial or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self._trial = False
+
+    def release_trial(self):
+        # The trial call ended without saying anything about the provider
+        # (throttled, cancelled): the next call gets to be the trial
+        self._trial = False
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 4
+    base_delay: float = 0.5
+    max_delay: float = 10.0
+
+    def delay(self, attempt, retry_after=None):
+        # Full jitter: uniform in [0, base * 2^attempt], capped, so parallel
+        # pages that failed together don't retry together
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+
+class ProviderClient:
+    # Builds one provider's HTTP request and reads the text out of its reply
+    name = "provider"
+    model_name = ""
+    generation_config = None
+    # Images the model accepts in one request
+    max_images = 1
+
+    def request(self, prompt, images):
+        # Returns (url, headers, json payload) for a list of PreparedImages
+        raise NotImplementedError
+
+    def parse(self, data):
+        raise NotImplementedError
+
+    def stream_request(self, prompt, images):
+        # The same request, answered as server-sent events
+        raise NotImplementedError
+
+    def parse_event(self, data):
+        # (text, usage or None) of one streamed event
+        raise NotImplementedError
+
+    def usage(self, data):
+        # (prompt tokens, completion tokens) the provider reports, 0 if it doesn't
+        return 0, 0
+
+
+class TogetherClient(ProviderClient):
+    name = "together"
+
+    def __init__(self, api_key, model_name=TOGETHER_MODEL, base_url=TOGETHER_BASE_URL):
+        self.api_key = api_key
+        self.model_name = model_name
+        self.base_url = base_url.rstrip("/")
+
+    def request(self, prompt, images):
+        payload = {
+            "model": self.model_name,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [{"type": "text", "text": prompt}] + [
+                        {
+                            "type": "image_url",
+                            "image_url": {"url": f"data:{image.mime_type};base64,{image.base64()}"},
+                        }
+                        for image in images
+                    ],
+                }
+            ],
+        }
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        return f"{self.base_url}/chat/completions", headers, payload
+
+    def parse(self, data):
+        return data["choices"][0]["message"]["content"].strip()
+
+    def stream_request(self, prompt, images):
+        url, headers, payload = self.request(prompt, images)
+        payload.update(stream=True, stream_options={"include_usage": True})
+        return url, headers, payload
+
+    def parse_event(self, data):
+        # Text deltas in choices; usage comes in a last event without choices
+        choices = data.get("choices") or []
+        text = (choices[0].get("delta") or {}).get("content") or "" if choices else ""
+        return text, self.usage(data) if data.get("usage") else None
+
+    def usage(self, data):
+        usage = data.get("usage") or {}
+        return usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0
+
+
+class GeminiClient(ProviderClient):
+    name = "gemini"
+    max_images = 16
+
+    def __init__(self, api_key, model_name=GEMINI_MODEL, generation_config=GEMINI_GENERATION_CONFIG,
+                 base_url=GEMINI_BASE_URL):
+        self.api_key = api_key
+        self.model_name = model_name
+        self.generation_config = generation_config
+        self.base_url = base_url.rstrip("/")
+
+    def request(self, prompt, images):
+        config = self.generation_config or {}
+        payload = {
+            "contents": [
+                {
+                    "parts": [
+                        {"inline_data": {"mime_type": image.mime_type, "data": image.base64()}}
+                        for image in images
+                    ] + [{"text": prompt}]
+                }
+            ],
+            "generationConfig": {
+                "temperature": config.get("temperature"),
+                "topP": config.get("top_p"),
+                "topK": config.get("top_k"),
+                "maxOutputTokens": config.get("max_output_tokens"),
+            },
+        }
+        headers = {"x-goog-api-key": self.api_key}
+        return f"{self.base_url}/models/{self.model_name}:generateContent", headers, payload
+
+    def parse(self, data):
+        parts = data["candidates"][0]["content"]["parts"]
+        return "".join(part.get("text", "") for part in parts).strip()
+
+    def stream_request(self, prompt, images):
+        url, headers, payload = self.request(prompt, images)
+        return url.replace(":generateContent", ":streamGenerateContent") + "?alt=sse", headers, payload
+
+    def parse_event(self, data):
+        # Every event carries the usage so far
+        candidates = data.get("candidates") or []
+        parts = (candidates[0].get("content") or {}).get("parts") or [] if candidates else []
+        text = "".join(part.get("text", "") for part in parts)
+        return text, self.usage(data) if data.get("usageMetadata") else None
+
+    def usage(self, data):
+        usage = data.get("usageMetadata") or {}
+        return usage.get("promptTokenCount") or 0, usage.get("candidatesTokenCount") or 0
+
+
+PROVIDER_CLIENTS = {
+    "together": TogetherClient,
+    "gemini": GeminiClient,
+}
+
+
+def retry_after_seconds(headers):
+    try:
+        return float(headers.get("Retry-After", ""))
+    except ValueError:
+        return None
+
+
+class ResilientProvider:
+    # One provider with its own rate limit, circuit breaker and retries
+    def __init__(self, client, rate=2.0, timeout=60.0, retry=None, breaker=None, stream=True):
+        self.client = client
+        self.name = client.name
+        self.stream = stream
+        self.bucket = AdaptiveTokenBucket(rate)
+        self.timeout = timeout
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+
+    async def attempt(self, session, prompt, images, stats):
+        request = self.client.stream_request if self.stream else self.client.request
+        url, headers, payload = request(prompt, images)
+        try:
+            async with session.post(
+                url, json=payload, headers=headers, timeout=aiohttp.ClientTimeout(total=self.timeout)
+            ) as response:
+                if response.status != 200:
+                    body = (await response.text())[:200]
+                    raise ProviderError(
+                        self.name, f"HTTP {response.status}: {body}",
+                        status=response.status,
+                        retryable=response.status in RETRYABLE_STATUSES,
+                        retry_after=retry_after_seconds(response.headers),
+                    )
+                if self.stream:
+                    text, (tokens_in, tokens_out) = await self.read_stream(response)
+                else:
+                    data = await response.json(content_type=None)
+                    text = self.client.parse(data)
+                    tokens_in, tokens_out = self.client.usage(data)
+        except asyncio.TimeoutError:
+            raise ProviderError(self.name, f"timed out after {self.timeout:g}s", retryable=True)
+        except aiohttp.ClientError as e:
+            raise ProviderError(self.name, f"connection failed: {e}", retryable=True)
+        except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+            raise ProviderError(self.name, "unexpected response shape")
+        stats["tokens_in"] += tokens_in
+        stats["tokens_out"] += tokens_out
+        return text
+
+    async def read_stream(self, response):
+        # (text, usage) of a server-sent event stream. The text is checked as
+        # it arrives; once its JSON is complete, whatever follows is only
+        # waited for STREAM_GRACE seconds (normally just the usage event)
+        # before the connection is closed, which also stops the model
+        # generating more. Tokens the provider hadn't reported by then
+        # aren't counted.
+        parser = JsonStreamParser()
+        chunks = []
+        usage = None
+        deadline = None
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                if deadline is None:
+                    line = await response.content.readline()
+                else:
+                    line = await asyncio.wait_for(response.content.readline(), max(0.0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                if deadline is None:
+                    raise
+                response.close()
+                break
+            if not line:
+                break
+            if not line.startswith(b"data:"):
+                continue
+            data = line[5:].strip()
+            if data == b"[DONE]":
+                break
+            text, event_usage = self.client.parse_event(json.loads(data))
+            usage = event_usage or usage
+            if text and deadline is None:
+                chunks.append(text)
+                if parser.feed(text):
+                    deadline = loop.time() + STREAM_GRACE
+        return "".join(chunks).strip(), usage or (0, 0)
+
+    async def generate(self, session, prompt, images, stats):
+        for attempt in range(self.retry.max_attempts):
+            if not self.breaker.allow():
+                raise CircuitOpenError(self.name)
+            # A half-open breaker lets exactly one call through; unless this
+            # call records a success or failure, it has to give the trial back
+            trial = self.breaker.state == "half-open"
+            settled = False
+            try:
+                await self.bucket.acquire()
+                text = await self.attempt(session, prompt, images, stats)
+                self.breaker.record_success()
+                settled = True
+                self.bucket.succeeded()
+                return text
+            except ProviderError as e:
+                if e.status == 429:
+                    # The provider is up, just busy: slow down, don't trip the breaker
+                    stats["throttled"] += 1
+                    self.bucket.throttled(e.retry_after)
+                else:
+                    self.breaker.record_failure()
+                    settled = True
+                if not e.retryable or attempt == self.retry.max_attempts - 1:
+                    raise
+                retry_after = e.retry_after
+            finally:
+                if trial and not settled:
+                    self.breaker.release_trial()
+            stats["retries"] += 1
+            await asyncio.sleep(self.retry.delay(attempt, retry_after))
+
+
+class ResilientBackend(Backend):
+    # Tries the providers in order; a provider whose retries run out or
+    # whose circuit is open hands the page to the next one. The cache key
+    # (model_name, generation_config) is the primary provider's.
+    name = "resilient"
+
+    def __init__(self, providers, max_connections=32, latency_samples=10000):
+        self.providers = list(providers)
+        primary = self.providers[0].client
+        self.model_name = primary.model_name
+        self.generation_config = primary.generation_config
+        # Any provider may end up with the request
+        self.max_images = min(provider.client.max_images for provider in self.providers)
+        self.max_connections = max_connections
+        self.stats = {"requests": 0, "succeeded": 0, "failed": 0, "retries": 0, "throttled": 0, "failovers": 0,
+                      "tokens_in": 0, "tokens_out": 0}
+        self.latencies = deque(maxlen=latency_samples)
+        self._session = None
+        self._loop = None
+        self._loop_lock = threading.Lock()
+
+    def set_rate(self, rate):
+        for provider in self.providers:
+            self._call_soon(provider.bucket.set_rate, rate)
+
+    def _call_soon(self, func, *args):
+        if self._loop is None:
+            func(*args)
+        else:
+            self._loop.call_soon_threadsafe(func, *args)
+
+    async def agenerate(self, prompt, images, call=None):
+        # call collects this request's counts (same keys as stats); they are
+        # added to stats once the request is over
+        if self._session is None:
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_connections))
+        call = dict.fromkeys(self.stats, 0) if call is None else call
+        call["requests"] += 1
+        start = time.perf_counter()
+        errors = []
+        try:
+            for index, provider in enumerate(self.providers):
+                if index:
+                    call["failovers"] += 1
+                try:
+                    text = await provider.generate(self._session, prompt, images, call)
+                except ProviderError as e:
+                    errors.append(str(e))
+                    continue
+                call["succeeded"] += 1
+                self.latencies.append(time.perf_counter() - start)
+                return text
+            call["failed"] += 1
+            raise ProviderError(self.name, "; ".join(errors))
+        finally:
+            for key, n in call.items():
+                self.stats[key] += n
+
+    def _ensure_loop(self):
+        # A private event loop on a daemon thread, shared by every caller
+        with self._loop_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="provider-loop", daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    def generate(self, prompt, image):
+        return self.generate_many(prompt, [image])
+
+    def generate_many(self, prompt, images):
+        # Blocking call for the worker threads of the page pipeline. The
+        # images are base64-encoded here, on the calling thread, rather than
+        # holding up the event loop every other request goes through.
+        for image in images:
+            image.base64()
+        call = dict.fromkeys(self.stats, 0)
+        future = asyncio.run_coroutine_threadsafe(self.agenerate(prompt, images, call), self._ensure_loop())
+        try:
+            return future.result()
+        finally:
+            for key in ("retries", "throttled", "failovers", "tokens_in", "tokens_out"):
+                count(key, call[key])
+            count("model_failures", call["failed"])
+
+    def latency_percentiles(self, percentiles=(50, 99)):
+        samples = sorted(self.latencies)
+        if not samples:
+            return {p: None for p in percentiles}
+        return {p: samples[min(len(samples) - 1, int(len(samples) * p / 100))] for p in percentiles}
+
+    def close(self):
+        if self._loop is None:
+            return
+        if self._session is not None:
+            asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result()
+            self._session = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop = None
+
+
+def create_resilient_backend(api_keys, rate=2.0, timeout=60.0, retry=None, base_urls=None, stream=True):
+    # api_keys: {provider name: key} in failover order, e.g.
+    # {"together": "...", "gemini": "..."}; providers without a key are left out.
+    # stream=False waits for whole responses instead of streaming them.
+    base_urls = base_urls or {}
+    providers = []
+    for name, api_key in api_keys.items():
+        if not api_key:
+            continue
+        kwargs = {"base_url": base_urls[name]} if name in base_urls else {}
+        client = PROVIDER_CLIENTS[name](api_key, **kwargs)
+        providers.append(ResilientProvider(client, rate=rate, timeout=timeout, retry=retry, stream=stream))
+    if not providers:
+        raise ValueError("at least one provider needs an API key")
+    return ResilientBackend(providers)
@@ -0,0 +1,234 @@
+import ctypes
+import ctypes.util
+import math
+import threading
+
+import pypdfium2 as pdfium
+
+from pipeline import RENDER_LOCK, process_in_order
+from preprocess import PageArtifact
+from telemetry import span
+
+# pdfium renders BGR(A); count 4 bytes per pixel plus the same again for
+# the encodings made from it while the page is alive
+BYTES_PER_PIXEL = 8
+
+
+# mallopt() parameter number for M_ARENA_MAX in glibc's malloc.h
+M_ARENA_MAX = -8
+
+
+def limit_malloc_arenas(arenas=2):
+    # glibc gives every worker thread its own malloc arena and rarely hands
+    # freed page bitmaps back to the OS, so resident memory climbs with the
+    # worker count even though only a few pages are alive at once. Capping
+    # the arenas keeps RSS close to the MemoryBudget. No-op off glibc.
+    libc_name = ctypes.util.find_library("c")
+    if not libc_name:
+        return False
+    try:
+        libc = ctypes.CDLL(libc_name)
+        return bool(libc.mallopt(M_ARENA_MAX, arenas))
+    except (OSError, AttributeError):
+        return False
+
+
+def open_pdf(source):
+    # A path or a file object (e.g. the upload), which pdfium reads from as
+    # it needs pages instead of from another full copy in memory. A file
+    # object has to stay open until the document is closed.
+    if hasattr(source, "seek"):
+        source.seek(0)
+    with RENDER_LOCK:
+        return pdfium.PdfDocument(source)
+
+
+class MemoryBudget:
+    # Caps the estimated bytes of rendered pages that are alive at once.
+    # Reservations are granted strictly in ticket order (page order), so a
+    # later page can never hold the budget an earlier, still-pending page
+    # needs. A single page bigger than the whole budget is still admitted
+    # when nothing else is resident, otherwise it could never render.
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self.peak = 0
+        self._next_ticket = 0
+        self._aborted = False
+        self._condition = threading.Condition()
+
+    def reserve(self, ticket, nbytes):
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._aborted or (
+                    ticket == self._next_ticket
+                    and (self.used == 0 or not self.max_bytes or self.used + nbytes <= self.max_bytes)
+                )
+            )
+            if self._aborted:
+                raise RuntimeError("memory budget was aborted")
+            self._next_ticket += 1
+            self.used += nbytes
+            self.peak = max(self.peak, self.used)
+            self._condition.notify_all()
+        return Reservation(self, nbytes)
+
+    def skip(self, ticket):
+        # For work items that fail before they can render anything
+        self.reserve(ticket, 0).close()
+
+    def release(self, nbytes):
+        with self._condition:
+            self.used -= nbytes
+            self._condition.notify_all()
+
+    def abort(self):
+        # Wakes every waiting worker when the consumer goes away early
+        with self._condition:
+            self._aborted = True
+            self._condition.notify_all()
+
+
+class Reservation:
+    # Returned budget on close(), so it can sit in PageArtifact's resources
+    def __init__(self, budget, nbytes):
+        self.budget = budget
+        self.nbytes = nbytes
+
+    def close(self):
+        if self.budget is not None:
+            self.budget.release(self.nbytes)
+            self.budget = None
+
+
+def estimate_page_bytes(width, height, scale):
+    return math.ceil(width * scale) * math.ceil(height * scale) * BYTES_PER_PIXEL
+
+
+def render_page(pdf, page_number, scale=1.0, config=None, budget=None, ticket=None, text_layer=False):
+    # Renders one page into a PageArtifact once the budget has room for it.
+    # The budget comes back when the artifact is released. With text_layer
+    # the page's text is read as well, for the local extraction tier.
+    ticket = page_number if ticket is None else ticket
+    text = None
+    try:
+        with RENDER_LOCK:
+            page = pdf[page_number]
+            width, height = page.get_size()
+            if text_layer:
+                with span("text_layer"):
+                    textpage = page.get_textpage()
+                    text = textpage.get_text_bounded()
+                    textpage.close()
+    except Exception:
+        if budget is not None:
+            budget.skip(ticket)
+        raise
+
+    reservation = None
+    if budget is not None:
+        reservation = budget.reserve(ticket, estimate_page_bytes(width, height, scale))
+    try:
+        with RENDER_LOCK, span("render", page=page_number):
+            bitmap = page.render(scale=scale, rotation=0)
+            image = bitmap.to_pil()
+    except Exception:
+        if reservation is not None:
+            reservation.close()
+        with RENDER_LOCK:
+            page.close()
+        raise
+    resources = (page, bitmap) if reservation is None else (reservation, page, bitmap)
+    return PageArtifact(image, config, resources=resources, text=text)
+
+
+def iter_page_results(pdf, analyze, max_workers=4, scale=1.0, config=None, budget=None, text_layer=False):
+    # Generator over (page_number, artifact, analyze(artifact)) in page order.
+    # Pages are rendered on demand by the workers, at most max_workers ahead
+    # of the consumer and never beyond the MemoryBudget, so a slow extraction
+    # stage holds rendering back instead of memory growing.
+    # The consumer must release() each artifact when it is done with it.
+
+    def work(page_number):
+        artifact = render_page(pdf, page_number, scale, config, budget, text_layer=text_layer)
+        try:
+            return artifact, analyze(artifact)
+        except Exception:
+            with RENDER_LOCK:
+                artifact.release()
+            raise
+
+    # The budget is aborted before the pool is closed: closing waits for the
+    # workers, and one blocked in reserve() only wakes up on abort
+    results = process_in_order(range(len(pdf)), work, max_workers)
+    try:
+        for page_number, (artifact, result) in results:
+            yield page_number, artifact, result
+    finally:
+        if budget is not None:
+            budget.abort()
+        results.close()
+
+
+def render_group(pdf, page_numbers, scale=1.0, config=None, budget=None, ticket=None):
+    # Renders consecutive pages for one grouped request under a single
+    # reservation, so a group never waits for memory its own pages hold.
+    # The reservation is returned when the first artifact is released.
+    page_numbers = list(page_numbers)
+    ticket = page_numbers[0] if ticket is None else ticket
+    try:
+        nbytes = 0
+        for page_number in page_numbers:
+            with RENDER_LOCK:
+                page = pdf[page_number]
+                width, height = page.get_size()
+                page.close()
+            nbytes += estimate_page_bytes(width, height, scale)
+    except Exception:
+        if budget is not None:
+            budget.skip(ticket)
+        raise
+
+    reservation = budget.reserve(ticket, nbytes) if budget is not None else None
+    artifacts = []
+    try:
+        for page_number in page_numbers:
+            artifacts.append(render_page(pdf, page_number, scale, config))
+    except Exception:
+        with RENDER_LOCK:
+            for artifact in artifacts:
+                artifact.release()
+        if reservation is not None:
+            reservation.close()
+        raise
+    if reservation is not None:
+        artifacts[0].hold(reservation)
+    return artifacts
+
+
+def iter_group_results(pdf, analyze, group_size=4, max_workers=4, scale=1.0, config=None, budget=None):
+    # Like iter_page_results, but over groups of consecutive pages:
+    # yields (page_numbers, artifacts, analyze(artifacts, first_page)) in
+    # order. The consumer must release() every artifact.
+    groups = [list(range(first, min(first + group_size, len(pdf)))) for first in range(0, len(pdf), group_size)]
+
+    def work(item):
+        index, page_numbers = item
+        artifacts = render_group(pdf, page_numbers, scale, config, budget, ticket=index)
+        try:
+            return artifacts, analyze(artifacts, page_numbers[0])
+        except Exception:
+            with RENDER_LOCK:
+                for artifact in artifacts:
+                    artifact.release()
+            raise
+
+    # Abort before closing the pool, as in iter_page_results
+    results = process_in_order(enumerate(groups), work, max_workers)
+    try:
+        for (_, page_numbers), (artifacts, result) in results:
+            yield page_numbers, artifacts, result
+    finally:
+        if budget is not None:
+            budget.abort()
+        results.close()
@@ -0,0 +1,291 @@
+# Tolerant parsing of model responses. Models wrap their JSON in code
+# fences or a sentence of prose, leave trailing commas, answer with Python
+# literals or unquoted keys, write amounts as "₹1,200.00", and get cut off
+# at the token limit. JsonStreamParser picks the first JSON object (or array
+# of objects) out of the text as it arrives, so the fields can be checked
+# before the response is complete, and repairs what it can.
+import ast
+import json
+import re
+from decimal import Decimal, InvalidOperation
+
+CLOSING = {"{": "}", "[": "]"}
+OPENING = re.compile(r"[{\[]")
+STRING_STOPS = {quote: re.compile(r"[\\%s]" % quote) for quote in "\"'"}
+SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "„": '"'})
+
+# Fixes applied outside string literals when the text isn't valid JSON
+REPAIRS = re.compile(
+    r'''(?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')'''
+    r'''|(?P<comment>//[^\n]*|/\*.*?\*/)'''
+    r'''|(?P<trailing>,\s*(?=[}\]]))'''
+    r'''|(?<=:)(?P<number>\s*-?\d{1,3}(?:,\d{2,3})+(?:\.\d+)?)(?=\s*[,}\n])'''
+    r'''|(?P<literal>\b(?:None|True|False|NaN)\b)'''
+    r'''|(?<=[{,])(?P<key>\s*[A-Za-z_][\w ]*?)(?=\s*:)''',
+    re.DOTALL,
+)
+LITERALS = {"None": "null", "True": "true", "False": "false", "NaN": "null"}
+# A member ending in a number followed by a comma may be a thousands
+# separator ("total_amount": 1,200.00); wait for the next character
+NUMBER_TAIL = re.compile(r":\s*-?\d[\d,]*$")
+
+CURRENCIES = (
+    (re.compile(r"₹|\brs\b\.?|\binr\b", re.IGNORECASE), "INR"),
+    (re.compile(r"\bus\$|\busd\b|\$", re.IGNORECASE), "USD"),
+    (re.compile(r"€|\beur\b|\beuro", re.IGNORECASE), "EUR"),
+    (re.compile(r"£|\bgbp\b", re.IGNORECASE), "GBP"),
+    (re.compile(r"¥|\bjpy\b", re.IGNORECASE), "JPY"),
+)
+AMOUNT_NUMBER = re.compile(r"\d(?:[\d,.'  ]*\d)?")
+
+# Field names models use instead of the ones asked for, compared lower
+# case without punctuation
+FIELD_ALIASES = {
+    "vendorname": "vendor_name", "vendor": "vendor_name", "companyname": "vendor_name",
+    "company": "vendor_name", "suppliername": "vendor_name", "supplier": "vendor_name",
+    "seller": "vendor_name",
+    "billdate": "bill_date", "invoicedate": "bill_date", "date": "bill_date",
+    "totalamount": "total_amount", "total": "total_amount", "grandtotal": "total_amount",
+    "amount": "total_amount", "amountdue": "total_amount", "totalcost": "total_amount",
+    "invoicenumber": "invoice_number", "invoiceno": "invoice_number", "invoicenum": "invoice_number",
+    "invoiceid": "invoice_number", "billnumber": "invoice_number", "billno": "invoice_number",
+    "currency": "currency",
+}
+MISSING = {"", "null", "none", "n/a", "na", "-", "unknown", "not available", "not found"}
+
+
+def _repair(match):
+    kind = match.lastgroup
+    text = match.group(kind)
+    if kind == "string":
+        if text[0] == '"':
+            return text
+        try:
+            return json.dumps(ast.literal_eval(text))
+        except (ValueError, SyntaxError):
+            return json.dumps(text[1:-1])
+    if kind == "comment" or kind == "trailing":
+        return ""
+    if kind == "number":
+        return json.dumps(text.strip())
+    if kind == "literal":
+        return LITERALS[text]
+    return json.dumps(text.strip())
+
+
+def loads_tolerant(text):
+    # json.loads, then again after the repairs above. Raises ValueError.
+    try:
+        return json.loads(text)
+    except ValueError:
+        return json.loads(REPAIRS.sub(_repair, text))
+
+
+def acceptable(value):
+    # A bill object or an array of them; [1] in "see note [1]" doesn't count
+    if isinstance(value, dict):
+        return True
+    return isinstance(value, list) and all(isinstance(item, dict) for item in value)
+
+
+class JsonStreamParser:
+    # feed() it text as it arrives. Completed members of the top-level
+    # object show up in .fields (elements of an array in .items) straight
+    # away; .done is set once the value is closed, and the rest of the
+    # response can be ignored. close() returns the value, repairing a
+    # response that was cut off.
+    def __init__(self):
+        self.text = ""
+        self.value = None
+        self.done = False
+        self._restart(0)
+
+    def _restart(self, position):
+        self.pos = position
+        self.start = None
+        self.stack = []
+        self.quote = None
+        self.escape = False
+        self.last = ""
+        self.member_start = None
+        self.split = None
+        self.fields = {}
+        self.items = []
+
+    def feed(self, chunk):
+        if not self.done:
+            self.text += chunk.translate(SMART_QUOTES)
+            self._scan()
+        return self.done
+
+    def _scan(self):
+        text = self.text
+        while self.pos < len(text) and not self.done:
+            c = text[self.pos]
+            if self.split is not None and not c.isspace():
+                # A comma inside a number is a thousands separator
+                if not (c.isdigit() and NUMBER_TAIL.search(text, self.member_start, self.split)):
+                    self._end_member(self.split)
+                self.split = None
+            if self.quote:
+                if self.escape:
+                    self.escape = False
+                elif c == "\\":
+                    self.escape = True
+                elif c == self.quote:
+                    self.quote = None
+                else:
+                    # Jump to the next quote or backslash
+                    match = STRING_STOPS[self.quote].search(text, self.pos)
+                    self.pos = match.start() if match else len(text)
+                    continue
+            elif not self.stack:
+                if c in CLOSING:
+                    self.start = self.pos
+                    self.stack.append(c)
+                    self.member_start = self.pos + 1
+                else:
+                    match = OPENING.search(text, self.pos)
+                    self.pos = match.start() if match else len(text)
+                    continue
+            elif c == '"' or (c == "'" and self.last in "{[,:"):
+                self.quote = c
+            elif c in CLOSING:
+                self.stack.append(c)
+            elif c in "}]":
+                if CLOSING[self.stack[-1]] != c:
+                    self._restart(self.start + 1)
+                    continue
+                self.stack.pop()
+                if not self.stack:
+                    self._end_member(self.pos)
+                    self._complete(self.pos)
+                    continue
+            elif c == "," and len(self.stack) == 1:
+                self.split = self.pos
+            if not c.isspace():
+                self.last = c
+            self.pos += 1
+
+    def _end_member(self, end):
+        member = self.text[self.member_start:end].strip()
+        self.member_start = end + 1
+        if not member:
+            return
+        try:
+            if self.text[self.start] == "[":
+                self.items.extend(loads_tolerant(f"[{member}]"))
+            else:
+                self.fields.update(loads_tolerant(f"{{{member}}}"))
+        except ValueError:
+            pass
+
+    def _complete(self, end):
+        try:
+            value = loads_tolerant(self.text[self.start:end + 1])
+        except ValueError:
+            value = None
+        if value is not None and acceptable(value):
+            self.value = value
+            self.done = True
+            self.pos = end + 1
+        else:
+            # Not the response's JSON, keep looking after its first bracket
+            self._restart(self.start + 1)
+
+    def close(self):
+        if self.done:
+            return self.value
+        if self.start is not None:
+            if self.split is not None:
+                self._end_member(self.split)
+            candidates = []
+            if not self.quote and self.text[self.start:].rstrip()[-1] in '",{}[]':
+                # Cut off right after a complete value: close what's open
+                closers = "".join(CLOSING[c] for c in reversed(self.stack))
+                candidates.append(self.text[self.start:].rstrip().rstrip(",:") + closers)
+            # Otherwise drop the member that was cut off
+            candidates.append(self.text[self.start:self.member_start].rstrip().rstrip(",") + CLOSING[self.stack[0]])
+            for candidate in candidates:
+                try:
+                    value = loads_tolerant(candidate)
+                except ValueError:
+                    continue
+                if acceptable(value):
+                    self.value = value
+                    return value
+        raise ValueError("no JSON object or array in the response")
+
+
+def parse_json(text):
+    # The first JSON object or array of objects in a whole response. Most
+    # responses are plain JSON and skip the scan.
+    try:
+        value = json.loads(text)
+    except ValueError:
+        value = None
+    if value is not None and acceptable(value):
+        return value
+    parser = JsonStreamParser()
+    parser.feed(text)
+    return parser.close()
+
+
+def normalize_fields(data):
+    # Maps field name variants onto the bill fields; a bill wrapped in a
+    # single key ({"invoice": {...}}) is unwrapped
+    fields = {}
+    for key, value in data.items():
+        name = FIELD_ALIASES.get(re.sub(r"[^a-z]", "", str(key).lower()))
+        if name and name not in fields and not isinstance(value, (dict, list)):
+            fields[name] = value
+    if not fields:
+        nested = [value for value in data.values() if isinstance(value, dict)]
+        if len(nested) == 1:
+            return normalize_fields(nested[0])
+    return fields
+
+
+def clean_text(value):
+    if value is None or isinstance(value, (dict, list)):
+        return None
+    text = " ".join(str(value).split())
+    return None if text.lower() in MISSING else text
+
+
+def currency_code(text):
+    for pattern, code in CURRENCIES:
+        if pattern.search(text):
+            return code
+    code = text.strip().upper()
+    return code if re.fullmatch(r"[A-Z]{3}", code) else None
+
+
+def parse_amount(value):
+    # (amount, currency code) from 1200, "1,200.00", "₹1,200.00", "Rs. 12,34,567/-",
+    # "1.234,56 €" or "(100.00)"; amount is None when there is no number
+    if value is None or isinstance(value, bool):
+        return None, None
+    if isinstance(value, (int, float)):
+        return float(value), None
+    text = str(value).strip()
+    currency = next((code for pattern, code in CURRENCIES if pattern.search(text)), None)
+    match = AMOUNT_NUMBER.search(text)
+    if not match:
+        return None, currency
+    number = re.sub(r"['  ]", "", match.group())
+    if "," in number and "." in number:
+        # Whichever comes last is the decimal point
+        separator = "," if number.rfind(".") > number.rfind(",") else "."
+        number = number.replace(separator, "").replace(",", ".")
+    elif "," in number:
+        head, _, tail = number.rpartition(",")
+        number = f"{head.replace(',', '')}.{tail}" if number.count(",") == 1 and len(tail) <= 2 else number.replace(",", "")
+    elif number.count(".") > 1:
+        number = number.replace(".", "")
+    try:
+        amount = float(Decimal(number))
+    except InvalidOperation:
+        return None, currency
+    negative = text.startswith("-") or (text.startswith("(") and text.endswith(")"))
+    return -amount if negative else amount, currency
@@ -0,0 +1,325 @@
+# Per-stage timing and counters for the render -> encode -> extract ->
+# store pipeline, so it's visible where a page's time goes.
+#
+#   with span("render"):
+#       bitmap = page.render(...)
+#   count("bytes_sent", len(data))
+#
+# Everything is recorded into TELEMETRY, the process-wide registry, and
+# into the Telemetry bound to the current context with bind() (a Streamlit
+# session's own). process_in_order copies the context into its workers, so
+# pages extracted for a session count towards that session.
+#
+# Exports: structured JSON log lines (configure_json_logs), Prometheus text
+# format (prometheus_text, write_metrics_file, serve_metrics) and cProfile
+# stats of a block of work (profiled).
+import contextvars
+import cProfile
+import json
+import logging
+import math
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+           math.inf)
+# Pipeline stages in the order a page goes through them
+STAGES = ("text_layer", "text_parse", "render", "encode", "dedup", "cache", "rate_wait", "base64", "model", "parse",
+          "store")
+COUNTERS = {
+    "pages": "Pages extracted",
+    "bytes_sent": "Image bytes sent to the model",
+    "model_calls": "Requests sent to the model",
+    "model_failures": "Requests that failed after retries and failover",
+    "retries": "Provider requests retried",
+    "throttled": "Provider requests rejected with 429",
+    "failovers": "Requests handed to the fallback provider",
+    "tokens_in": "Prompt tokens reported by the provider",
+    "tokens_out": "Completion tokens reported by the provider",
+    "cache_hits": "Pages answered by the extraction cache",
+    "cache_misses": "Pages the extraction cache didn't have",
+    "dedup_hits": "Pages answered from a duplicate page",
+    "text_layer_hits": "Pages answered from the PDF text layer",
+    "rows_inserted": "Bills inserted into the database",
+}
+METRIC_PREFIX = "bills"
+
+logger = logging.getLogger("bills.telemetry")
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        for index, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[index] += 1
+                break
+        self.sum += seconds
+        self.count += 1
+
+    def quantile(self, q):
+        # Estimated like Prometheus' histogram_quantile: linear within the
+        # bucket the rank falls in; None without observations
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, n in zip(BUCKETS, self.counts):
+            if n and seen + n >= rank:
+                if math.isinf(bound):
+                    return lower
+                return lower + (bound - lower) * (rank - seen) / n
+            seen += n
+            if not math.isinf(bound):
+                lower = bound
+        return lower
+
+
+class Telemetry:
+    # Latency histograms per stage, counters and gauges; thread-safe
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+            self.counters = {}
+            self.gauges = {}
+
+    def snapshot(self):
+        # Plain, JSON-serializable copy, e.g. to send from a worker process
+        with self._lock:
+            return {
+                "stages": {
+                    stage: {"buckets": list(h.counts), "sum": h.sum, "count": h.count}
+                    for stage, h in self.histograms.items()
+                },
+                "counters": dict(self.counters),
+            }
+
+    def merge(self, snapshot):
+        # Adds another registry's snapshot to this one
+        with self._lock:
+            for stage, data in snapshot.get("stages", {}).items():
+                histogram = self.histograms.get(stage)
+                if histogram is None:
+                    histogram = self.histograms[stage] = Histogram()
+                histogram.counts = [a + b for a, b in zip(histogram.counts, data["buckets"])]
+                histogram.sum += data["sum"]
+                histogram.count += data["count"]
+            for name, n in snapshot.get("counters", {}).items():
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def stage_summary(self):
+        # [(stage, calls, total seconds, p50, p95, bucket counts)], pipeline order first
+        with self._lock:
+            histograms = sorted(self.histograms.items(), key=lambda item: stage_order(item[0]))
+            return [
+                (stage, h.count, h.sum, h.quantile(0.5), h.quantile(0.95), list(h.counts))
+                for stage, h in histograms
+            ]
+
+    def format(self):
+        # One line: where the time went, by stage
+        summary = self.stage_summary()
+        total = sum(seconds for _, _, seconds, _, _, _ in summary) or 1e-9
+        return ", ".join(
+            f"{stage} {seconds / total:.0%} ({calls}× p50 {1000 * p50:.1f} ms)"
+            for stage, calls, seconds, p50, _, _ in summary
+        )
+
+
+def stage_order(stage):
+    return (STAGES.index(stage), stage) if stage in STAGES else (len(STAGES), stage)
+
+
+TELEMETRY = Telemetry()
+_bound = contextvars.ContextVar("telemetry", default=None)
+
+
+def bind(telemetry):
+    # Also record into telemetry for the rest of this context
+    _bound.set(telemetry)
+
+
+def _targets():
+    bound = _bound.get()
+    return (TELEMETRY,) if bound is None or bound is TELEMETRY else (TELEMETRY, bound)
+
+
+@contextmanager
+def span(stage, **fields):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        for telemetry in _targets():
+            telemetry.observe(stage, seconds)
+        if logger.isEnabledFor(logging.DEBUG):
+            log_event("span", level=logging.DEBUG, stage=stage, ms=round(1000 * seconds, 3), **fields)
+
+
+def count(name, n=1):
+    if n:
+        for telemetry in _targets():
+            telemetry.count(name, n)
+
+
+def log_event(event, level=logging.INFO, **fields):
+    # One JSON object per line, when configure_json_logs has been called
+    if logger.isEnabledFor(level):
+        logger.log(level, json.dumps(
+            {"ts": round(time.time(), 3), "event": event, "thread": threading.current_thread().name, **fields},
+            default=str,
+        ))
+
+
+def json_logging():
+    # Whether configure_json_logs has been called
+    return bool(logger.handlers)
+
+
+def configure_json_logs(destination="-", spans=False):
+    # destination: '-' for stdout or a file path (appended to). With spans,
+    # every timed stage is logged too, not only events.
+    if logger.handlers:
+        return
+    if destination == "-":
+        handler = logging.StreamHandler(sys.stdout)
+    else:
+        handler = logging.FileHandler(destination, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG if spans else logging.INFO)
+    logger.propagate = False
+
+
+def prometheus_text(telemetry=TELEMETRY, prefix=METRIC_PREFIX):
+    # Prometheus text exposition format
+    snapshot = telemetry.snapshot()
+    with telemetry._lock:
+        gauges = dict(telemetry.gauges)
+    lines = [
+        f"# HELP {prefix}_stage_seconds Time spent per pipeline stage",
+        f"# TYPE {prefix}_stage_seconds histogram",
+    ]
+    for stage in sorted(snapshot["stages"], key=stage_order):
+        data = snapshot["stages"][stage]
+        cumulative = 0
+        for bound, n in zip(BUCKETS, data["buckets"]):
+            cumulative += n
+            le = "+Inf" if math.isinf(bound) else f"{bound:g}"
+            lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+        lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {data["sum"]:.6f}')
+        lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {data["count"]}')
+    for name in sorted(set(COUNTERS) | set(snapshot["counters"])):
+        lines.append(f"# HELP {prefix}_{name}_total {COUNTERS.get(name, name.replace('_', ' '))}")
+        lines.append(f"# TYPE {prefix}_{name}_total counter")
+        lines.append(f"{prefix}_{name}_total {snapshot['counters'].get(name, 0)}")
+    for name in sorted(gauges):
+        lines.append(f"# TYPE {prefix}_{name} gauge")
+        lines.append(f"{prefix}_{name} {gauges[name]:g}")
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics_file(path, telemetry=TELEMETRY):
+    # Replaced atomically, for node_exporter's textfile collector or a cron job
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile("w", dir=directory, suffix=".tmp", delete=False, encoding="utf-8") as f:
+        f.write(prometheus_text(telemetry))
+    os.replace(f.name, path)
+
+
+def serve_metrics(port, telemetry=TELEMETRY, host="0.0.0.0"):
+    # GET /metrics on a daemon thread; returns the server (shutdown() stops it)
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            data = prometheus_text(telemetry).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+
+@contextmanager
+def profiled(path):
+    # cProfile stats of the block, dumped to path for `python -m pstats` or
+    # snakeviz. Covers the calling thread and every thread started inside
+    # the block, i.e. the page pipeline's workers; before Python 3.12 that
+    # takes one profiler per thread, merged at the end.
+    if sys.version_info >= (3, 12):
+        # cProfile sees every thread
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.dump_stats(path)
+        return
+
+    profiles = []
+    lock = threading.Lock()
+
+    def start_thread_profile(frame, event, arg):
+        # First event in a new thread; enabling replaces this hook
+        profile = cProfile.Profile()
+        with lock:
+            profiles.append(profile)
+        profile.enable()
+
+    main = cProfile.Profile()
+    threading.setprofile(start_thread_profile)
+    main.enable()
+    try:
+        yield
+    finally:
+        main.disable()
+        threading.setprofile(None)
+        stats = pstats.Stats(main)
+        with lock:
+            for profile in profiles:
+                stats.add(profile)
+        stats.dump_stats(path)
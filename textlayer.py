@@ -0,0 +1,196 @@
+# Local first tier for born-digital PDFs: read the page's text layer with
+# pdfium and pick the bill fields out of it with a few rules. Only pages
+# without a text layer, or where the rules aren't confident, go on to the
+# vision model.
+import json
+import re
+import threading
+
+from database import normalize_date
+from pipeline import RENDER_LOCK
+from telemetry import span
+
+# Records below this confidence fall back to the model
+MIN_CONFIDENCE = 0.7
+# Score of a field the rules could only guess (no label, no company
+# suffix): below MIN_CONFIDENCE, so a guess alone never skips the model
+GUESS_CONFIDENCE = 0.5
+# Fewer characters than this is a scan (or a page with just a logo)
+MIN_TEXT_CHARS = 40
+
+AMOUNT = r"(?:(?:rs\.?|inr|usd|eur|gbp)\s*|[₹$€£]\s*)?(\d{1,3}(?:,\d{2,3})+(?:\.\d{1,2})?|\d+(?:\.\d{1,2})?)"
+DATE = (
+    r"(\d{4}[-/.]\d{1,2}[-/.]\d{1,2}"
+    r"|\d{1,2}[-/.]\d{1,2}[-/.]\d{2,4}"
+    r"|\d{1,2}(?:st|nd|rd|th)?[ -](?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?,?[ -]\d{4}"
+    r"|(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.? \d{1,2}(?:st|nd|rd|th)?,? \d{4})"
+)
+
+INVOICE_NUMBER = re.compile(
+    r"\b(?:invoice|inv|bill)\s*(?:no\.?|number|num\.?|#)?\s*[:#.]?\s*(?:no\.?\s*[:#]?\s*)?"
+    r"([A-Z0-9][A-Z0-9\-/_.]*\d[A-Z0-9\-/_]*)",
+    re.IGNORECASE,
+)
+LABELLED_DATE = re.compile(r"\b(?:invoice|bill)?\s*date(?:d)?\s*(?:of issue)?\s*[:\-]?\s*" + DATE, re.IGNORECASE)
+ANY_DATE = re.compile(r"\b" + DATE + r"\b", re.IGNORECASE)
+# Most specific first; "sub total" and tax lines never count as the total
+TOTAL_LABELS = (
+    (re.compile(r"\b(?:grand total|total amount|amount due|balance due|total due|amount payable|net payable)\b",
+                re.IGNORECASE), 1.0),
+    (re.compile(r"(?<!sub)(?<!sub )\btotal\b(?!\s*(?:tax|gst|vat|qty|quantity|items))", re.IGNORECASE), 0.8),
+)
+AMOUNT_PATTERN = re.compile(AMOUNT, re.IGNORECASE)
+COMPANY_SUFFIX = re.compile(
+    r"\b(?:ltd|limited|pvt|private|inc|llc|llp|corp|corporation|co|company|gmbh|plc|traders|enterprises|industries)\b\.?",
+    re.IGNORECASE,
+)
+# Header lines that are never the vendor's name, including the buyer's
+# name block (billed to, customer, consignee ...), which often carries a
+# company suffix too
+NOT_VENDOR = re.compile(
+    r"\b(?:invoice|bill(?:ed)? to|ship(?:ped)? to|sold to|deliver(?:ed)? to|customer|buyer|consignee|client"
+    r"|recipient|date|page|tax|gstin|phone|tel|email|www\.|http|receipt|original|copy)\b",
+    re.IGNORECASE,
+)
+# Labels some layouts print before the vendor's name, removed from it
+VENDOR_LABEL = re.compile(r"^(?:from|vendor|supplier|seller|sold by|billed by|issued by)\s*[:\-]\s*", re.IGNORECASE)
+
+
+def read_text_layer(pdf, page_number):
+    # The page's text as pdfium extracts it, '' for scanned pages
+    with RENDER_LOCK, span("text_layer", page=page_number):
+        page = pdf[page_number]
+        try:
+            textpage = page.get_textpage()
+            try:
+                return textpage.get_text_bounded()
+            finally:
+                textpage.close()
+        finally:
+            page.close()
+
+
+def _lines(text):
+    return [line.strip() for line in text.replace("\r", "\n").split("\n") if line.strip()]
+
+
+def find_invoice_number(lines):
+    for line in lines:
+        match = INVOICE_NUMBER.search(line)
+        if match and not re.fullmatch(DATE, match.group(1), re.IGNORECASE):
+            return match.group(1).rstrip(".-/"), 1.0
+    return None, 0.0
+
+
+def find_bill_date(lines):
+    for line in lines:
+        match = LABELLED_DATE.search(line)
+        if match and "due" not in line.lower():
+            return normalize_date(match.group(1)), 1.0
+    for line in lines:
+        match = ANY_DATE.search(line)
+        if match:
+            return normalize_date(match.group(1)), GUESS_CONFIDENCE
+    return None, 0.0
+
+
+def _amount_after(line, label_end, next_line):
+    # The amount printed after the label, or on the next line for tables
+    # that put labels and values in separate rows
+    for candidate in (line[label_end:], next_line or ""):
+        amounts = AMOUNT_PATTERN.findall(candidate)
+        if amounts:
+            return amounts[-1].replace(",", "")
+    return None
+
+
+def find_total_amount(lines):
+    best = None
+    for pattern, confidence in TOTAL_LABELS:
+        for index, line in enumerate(lines):
+            match = pattern.search(line)
+            if not match:
+                continue
+            next_line = lines[index + 1] if index + 1 < len(lines) else None
+            amount = _amount_after(line, match.end(), next_line)
+            if amount is None:
+                continue
+            # The grand total comes last on the page
+            best = amount, confidence
+        if best is not None:
+            return best
+    return None, 0.0
+
+
+def find_vendor_name(lines):
+    header = [VENDOR_LABEL.sub("", line) for line in lines[:8] if not NOT_VENDOR.search(line)]
+    header = [line for line in header if re.search(r"[A-Za-z]{2}", line)]
+    for line in header:
+        if COMPANY_SUFFIX.search(line):
+            return line, 0.95
+    if header:
+        return header[0], GUESS_CONFIDENCE
+    return None, 0.0
+
+
+def parse_text(text):
+    # Returns (fields, confidence). The record is only as trustworthy as its
+    # least certain field, so confidence is the lowest field score.
+    lines = _lines(text)
+    fields = {}
+    scores = []
+    for key, finder in (
+        ("vendor_name", find_vendor_name),
+        ("bill_date", find_bill_date),
+        ("total_amount", find_total_amount),
+        ("invoice_number", find_invoice_number),
+    ):
+        value, score = finder(lines)
+        if value is not None:
+            fields[key] = value
+        scores.append(score)
+    return fields, min(scores)
+
+
+class TextLayerParser:
+    def __init__(self, min_confidence=MIN_CONFIDENCE, min_chars=MIN_TEXT_CHARS):
+        self.min_confidence = min_confidence
+        self.min_chars = min_chars
+
+    def parse(self, text):
+        # JSON in the same shape the model answers with, or None to fall back
+        if not text or len(text.strip()) < self.min_chars:
+            return None
+        fields, confidence = parse_text(text)
+        if confidence < self.min_confidence:
+            return None
+        return json.dumps(fields)
+
+
+class TierStats:
+    # How each page was answered (text_layer, dedup, cache, model) and how
+    # long that took
+    def __init__(self):
+        self.counts = {}
+        self.seconds = {}
+        self._lock = threading.Lock()
+
+    def record(self, tier, seconds):
+        with self._lock:
+            self.counts[tier] = self.counts.get(tier, 0) + 1
+            self.seconds[tier] = self.seconds.get(tier, 0.0) + seconds
+
+    def summary(self):
+        # [(tier, count, share of pages, average ms)]
+        with self._lock:
+            total = sum(self.counts.values()) or 1
+            return [
+                (tier, count, count / total, 1000 * self.seconds[tier] / count)
+                for tier, count in sorted(self.counts.items(), key=lambda item: -item[1])
+            ]
+
+    def format(self):
+        return ", ".join(
+            f"{tier} {share:.0%} ({avg_ms:.0f} ms)" for tier, _, share, avg_ms in self.summary()
+        )
+
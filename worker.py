@@ -0,0 +1,306 @@
+# Background worker for the job queue (jobs.py). Claims queued uploads and
+# runs render + extract for each on its own process pool, one job per
+# process, writing the bills to bills.db the way batch.py does. Rendering
+# is serialized per process by RENDER_LOCK, so processes are what scale it
+# across cores; start more workers, here or on other machines sharing the
+# database, to split the queue further.
+#
+#   python worker.py --processes 4
+#   python worker.py --backend fake --once     # drain the queue and exit
+#
+# API keys come from TOGETHER_API_KEY / GEMINI_API_KEY; jobs say which
+# provider they want. Ctrl-C (or SIGTERM) stops claiming jobs and lets the
+# running ones finish; a second Ctrl-C puts them back in the queue.
+#
+# Stage timings and counters of finished jobs are summed in this process
+# and exported with --metrics-port (GET /metrics) or --metrics-file, in the
+# Prometheus text format, along with the queue's depth.
+import argparse
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+from contextlib import nullcontext
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+from batch import BatchRunner, make_backend
+from database import BillDatabase
+from dedup import DedupIndex
+from extraction_cache import ExtractionCache
+from extractor import Extractor
+from jobs import DEFAULT_SPOOL_DIR, JobQueue, format_metrics
+from preprocess import PreprocessConfig
+from rendering import limit_malloc_arenas
+from telemetry import (
+    TELEMETRY, configure_json_logs, json_logging, log_event, profiled, serve_metrics, write_metrics_file,
+)
+from textlayer import TextLayerParser
+
+POLL_INTERVAL = 1.0
+# Seconds between queue metrics lines in the log
+METRICS_INTERVAL = 60
+# Seconds between progress writes for a running job
+PROGRESS_INTERVAL = 1.0
+# Seconds between refreshes of the exported metrics
+EXPORT_INTERVAL = 5.0
+
+# Per-process state, set up once by init_process
+_process = {}
+
+
+def log(message, event="log", **fields):
+    # A JSON line with --json-logs, plain text otherwise
+    if json_logging():
+        log_event(event, message=message, **fields)
+    else:
+        print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {message}", flush=True)
+
+
+def init_process(settings):
+    # Runs in every pool process; Ctrl-C is handled by the parent only
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    limit_malloc_arenas()
+    if settings["json_logs"]:
+        configure_json_logs(settings["json_logs"], spans=settings["log_spans"])
+    db = BillDatabase(settings["db"])
+    _process.update(
+        settings=settings,
+        db=db,
+        queue=JobQueue(db, settings["spool_dir"]),
+        dedup=DedupIndex(db),
+        cache=ExtractionCache() if settings["cache"] else None,
+        backends={},
+    )
+
+
+def get_backend(name):
+    # Provider clients are built once per process and reused for every job
+    backends = _process["backends"]
+    if name not in backends:
+        settings = _process["settings"]
+        fake_options = {"latency": settings["fake_latency"]} if name == "fake" else {}
+        backends[name] = make_backend(name, rate=settings["rate"], timeout=settings["timeout"], **fake_options)
+    return backends[name]
+
+
+def run_job(job):
+    # One uploaded file, start to finish; returns (stats, errors, telemetry
+    # snapshot of the job)
+    settings = _process["settings"]
+    options = job["options"]
+    path = Path(job["file_path"])
+    if not path.exists():
+        raise FileNotFoundError(f"uploaded file {path} is gone")
+    backend, rate_limiter = get_backend(options.get("backend") or settings["backend"])
+    use_dedup = options.get("dedup", True)
+    extractor = Extractor(
+        backend,
+        cache=_process["cache"],
+        rate_limiter=rate_limiter,
+        preprocess=PreprocessConfig(**options.get("preprocess", {})),
+        dedup=_process["dedup"] if use_dedup else None,
+        text_parser=TextLayerParser() if options.get("text_layer", True) else None,
+    )
+
+    queue = _process["queue"]
+    last_write = 0.0
+
+    def progress(stats, total_pages):
+        # Doubles as the job's heartbeat
+        nonlocal last_write
+        now = time.monotonic()
+        if now - last_write >= PROGRESS_INTERVAL or stats["pages"] >= total_pages:
+            last_write = now
+            queue.heartbeat([job["id"]], stats["pages"], total_pages)
+
+    runner = BatchRunner(
+        extractor,
+        db_path=settings["db"],
+        workers=settings["threads"],
+        scale=settings["scale"],
+        max_resident_bytes=settings["max_page_memory"],
+        dedup=_process["dedup"] if use_dedup else None,
+        progress=progress,
+    )
+    profile_dir = settings["profile_dir"]
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+    with profiled(os.path.join(profile_dir, f"job_{job['id']}.prof")) if profile_dir else nullcontext():
+        stats = runner.run([path])
+    return stats, runner.errors, runner.telemetry.snapshot()
+
+
+class Worker:
+    def __init__(self, queue, settings, processes, metrics_file=None, export=False):
+        self.queue = queue
+        self.settings = settings
+        self.processes = processes
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self.running = {}
+        self.stopping = False
+        # Keep TELEMETRY's queue gauges current (for --metrics-port), and write them out
+        self.export = export or bool(metrics_file)
+        self.metrics_file = metrics_file
+        self.last_export = 0.0
+        self.executor = self.start_pool()
+
+    def start_pool(self):
+        # spawn, not fork: pdfium and the provider event loop don't survive a fork
+        return ProcessPoolExecutor(
+            self.processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_process,
+            initargs=(self.settings,),
+        )
+
+    def stop(self, signum=None, frame=None):
+        if self.stopping:
+            raise KeyboardInterrupt
+        self.stopping = True
+        log(f"stopping: finishing {len(self.running)} running jobs (Ctrl-C again to requeue them)")
+
+    def claim_jobs(self):
+        while not self.stopping and len(self.running) < self.processes:
+            job = self.queue.claim(self.name)
+            if job is None:
+                return
+            self.running[self.executor.submit(run_job, job)] = job
+            log(f"job {job['id']} ({job['file_name']}): started, attempt {job['attempts']}",
+                event="job_started", job=job["id"], file=job["file_name"], attempt=job["attempts"])
+
+    def collect(self, futures):
+        broken = False
+        for future in futures:
+            job = self.running.pop(future)
+            try:
+                stats, errors, snapshot = future.result()
+            except BrokenProcessPool:
+                # A pool process died (e.g. out of memory); the pool is unusable
+                broken = True
+                self.queue.fail(job["id"], "worker process died")
+                log(f"job {job['id']}: worker process died", event="job_failed", job=job["id"])
+            except Exception as e:
+                self.queue.fail(job["id"], f"{type(e).__name__}: {e}")
+                log(f"job {job['id']}: failed: {e}", event="job_failed", job=job["id"], error=str(e))
+            else:
+                self.queue.finish(job["id"], stats, errors)
+                TELEMETRY.merge(snapshot)
+                log(f"job {job['id']}: done, {stats['pages']} pages, {stats['inserted']} bills, "
+                    f"{stats['errors']} errors in {stats['seconds']:.1f}s",
+                    event="job_done", job=job["id"], **{k: v for k, v in stats.items() if k != "tiers"})
+        if broken:
+            for job in self.running.values():
+                self.queue.fail(job["id"], "worker process died")
+            self.running = {}
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = self.start_pool()
+
+    def export_metrics(self, force=False):
+        if not self.export or (not force and time.monotonic() - self.last_export < EXPORT_INTERVAL):
+            return
+        self.last_export = time.monotonic()
+        metrics = self.queue.metrics()
+        for name in ("queued", "running", "active_workers", "oldest_queued_seconds"):
+            TELEMETRY.set_gauge(f"queue_{name}", metrics[name])
+        if self.metrics_file:
+            write_metrics_file(self.metrics_file)
+
+    def run(self, once=False, poll_interval=POLL_INTERVAL):
+        log(f"worker {self.name}: {self.processes} processes, {format_metrics(self.queue.metrics())}")
+        last_metrics = time.monotonic()
+        try:
+            while True:
+                requeued = self.queue.requeue_stale()
+                if requeued:
+                    log(f"requeued {requeued} jobs from workers that stopped responding")
+                self.claim_jobs()
+                if not self.running:
+                    if once or self.stopping:
+                        break
+                    self.export_metrics()
+                    time.sleep(poll_interval)
+                    continue
+                done, _ = wait(self.running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                self.collect(done)
+                # Covers jobs stuck in one long model call between pages
+                self.queue.heartbeat([job["id"] for job in self.running.values()])
+                if time.monotonic() - last_metrics >= METRICS_INTERVAL:
+                    last_metrics = time.monotonic()
+                    log(format_metrics(self.queue.metrics()))
+                self.export_metrics()
+        except KeyboardInterrupt:
+            for job in self.running.values():
+                self.queue.requeue(job["id"])
+            log(f"requeued {len(self.running)} running jobs")
+            self.running = {}
+            for process in list(getattr(self.executor, "_processes", {}).values()):
+                process.terminate()
+        finally:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.export_metrics(force=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Process queued uploads in the background")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="jobs run in parallel")
+    parser.add_argument("--threads", type=int, default=4, help="pages in flight per job")
+    parser.add_argument("--backend", choices=["together", "gemini", "fake"], default="together",
+                        help="for jobs that don't name one")
+    parser.add_argument("--rate", type=float, default=2.0,
+                        help="max model requests per second for the whole worker (0 = unlimited)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds per provider request")
+    parser.add_argument("--fake-latency", type=float, default=0.0, help="seconds per call of the fake backend")
+    parser.add_argument("--scale", type=float, default=1.0, help="PDF render scale")
+    parser.add_argument("--max-page-memory", type=int, default=256,
+                        help="MB of rendered pages in flight per process (0 = unlimited)")
+    parser.add_argument("--db", default="bills.db")
+    parser.add_argument("--spool-dir", default=DEFAULT_SPOOL_DIR, help="where uploaded files wait")
+    parser.add_argument("--no-cache", action="store_true", help="skip the extraction cache")
+    parser.add_argument("--once", action="store_true", help="exit when the queue is empty")
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL)
+    parser.add_argument("--json-logs", metavar="PATH", help="log JSON lines here ('-' for stdout)")
+    parser.add_argument("--log-spans", action="store_true", help="with --json-logs, log every timed stage too")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port")
+    parser.add_argument("--metrics-file", help="keep Prometheus text-format metrics in this file")
+    parser.add_argument("--profile-dir", help="write cProfile stats of every job here, as job_<id>.prof")
+    args = parser.parse_args(argv)
+
+    processes = max(1, args.processes)
+    settings = {
+        "db": args.db,
+        "spool_dir": args.spool_dir,
+        "backend": args.backend,
+        # Each process has its own limiter, so they share the worker's rate
+        "rate": args.rate / processes,
+        "timeout": args.timeout,
+        "fake_latency": args.fake_latency,
+        "threads": args.threads,
+        "scale": args.scale,
+        "max_page_memory": args.max_page_memory * 1024 * 1024 or None,
+        "cache": not args.no_cache,
+        "json_logs": args.json_logs,
+        "log_spans": args.log_spans,
+        "profile_dir": args.profile_dir,
+    }
+    if args.json_logs:
+        configure_json_logs(args.json_logs, spans=args.log_spans)
+    if args.metrics_port:
+        serve_metrics(args.metrics_port)
+    db = BillDatabase(args.db)
+    worker = Worker(JobQueue(db, args.spool_dir), settings, processes, args.metrics_file,
+                    export=bool(args.metrics_port))
+    signal.signal(signal.SIGINT, worker.stop)
+    signal.signal(signal.SIGTERM, worker.stop)
+    try:
+        worker.run(once=args.once, poll_interval=args.poll_interval)
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())